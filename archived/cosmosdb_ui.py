@@ -41,7 +41,7 @@ class MyApplication(QtWidgets.QMainWindow, CosmosDBHandler):
 
 
         self.db = self.initialize_cosmos_client()
-        self.all_commit_time = self.db.get_commit_time_list()
+        self.all_commit_time = self.db.get_commit_time_range()
         self.init_setting()
         self.show()
         self.call_cosmosdb()
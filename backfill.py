@@ -0,0 +1,216 @@
+"""
+Backfill: analyse a historical commit range for a topic in bulk.
+
+``eyes_on_docs.main`` only ever processes commits newer than the latest
+record in CosmosDB, so after a prompt upgrade (or for a newly added topic)
+there was no way to (re)build the history. This entry point takes a topic
+and a UTC date range and, for every matching target in target_config.json:
+
+1. Lists the commits in ``[since, until)`` (GitHub ``since``/``until``
+   parameters, following ``Link: rel="next"`` up to ``--max-pages`` pages).
+2. Skips commits that already have an analysed record (status ``post`` or
+   ``skip``) in CosmosDB for the same target, plus commits recorded in the
+   local checkpoint file by an earlier, interrupted run.
+3. Runs the normal fetch/analyse/store pipeline (``Spyder.process_commits``)
+   with ``--workers`` analysis threads. Nothing is posted to Teams; records
+   are written to CosmosDB in commit order, and each stored commit is added
+   to the checkpoint so a restarted run resumes where it stopped.
+
+With ``--batch`` the GPT requests go through the Batch API first
+(see ``gpt_batch``), which is cheaper and keeps the interactive quota free
+for the live crawler.
+
+Usage:
+    python backfill.py --topic "Azure OpenAI" --since 2026-01-01 --until 2026-02-01
+    python backfill.py --topic AML --language Chinese --since 2026-01-01 --until 2026-01-08 --workers 32 --batch
+
+A commit that fails is logged and left out of the checkpoint, so rerunning
+the same range only processes what is still missing.
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from commit_fetch import CommitFetcher
+from commit_history_writer import commit_history_writer
+from eyes_on_docs import load_system_prompts, load_targets_config, target_key
+from github_cache import commit_details_cache
+from gpt_batch import run_batch_rounds
+from llm_cache import response_cache
+from logs import logger
+from spyder import PERSONAL_TOKEN, Spyder
+
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", 16))
+BACKFILL_MAX_PAGES = int(os.getenv("BACKFILL_MAX_PAGES", 200))
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", "backfill_checkpoint.json")
+# Same limit process_target passes to Spyder.
+BACKFILL_MAX_INPUT_TOKEN = 30000
+
+
+def parse_date(value: str) -> datetime.datetime:
+    """``2026-01-01`` or ``2026-01-01T08:00:00`` (UTC) -> naive datetime, like the parsed commit times."""
+    parsed = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def commit_sha(commit_url: str) -> str:
+    """SHA from an API (``/commits/<sha>``) or web (``/commit/<sha>``) commit URL."""
+    return commit_url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def select_targets(targets: Iterable[dict], topic: str, language: Optional[str] = None) -> List[dict]:
+    return [
+        t for t in targets
+        if t.get("topic_name") == topic and (language is None or t.get("language") == language)
+    ]
+
+
+class BackfillCheckpoint:
+    """SHAs stored by earlier backfill runs, per target; rewritten atomically after every commit."""
+
+    def __init__(self, path: str = BACKFILL_CHECKPOINT_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        self._done: Dict[str, Set[str]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._done = {key: set(shas) for key, shas in json.load(f).items()}
+            except (OSError, ValueError) as exc:
+                logger.warning(f"BackfillCheckpoint: ignoring unreadable {path} ({exc})")
+
+    @staticmethod
+    def key(target: dict) -> str:
+        return "|".join(target_key(target))
+
+    def done(self, key: str) -> Set[str]:
+        with self._lock:
+            return set(self._done.get(key, ()))
+
+    def mark(self, key: str, sha: str) -> None:
+        with self._lock:
+            self._done.setdefault(key, set()).add(sha)
+            if not self._path:
+                return
+            try:
+                tmp_path = f"{self._path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({k: sorted(v) for k, v in self._done.items()}, f)
+                os.replace(tmp_path, self._path)
+            except OSError as exc:
+                logger.warning(f"BackfillCheckpoint: failed to save {self._path} ({exc})")
+
+
+class BackfillSpyder(Spyder):
+    """Spyder over a fixed commit set: never posts to Teams, checkpoints every stored commit."""
+
+    # A historical range must not move the live crawler's watermark.
+    update_watermark = False
+
+    def __init__(self, target: dict, commits: Dict[datetime.datetime, str], checkpoint: BackfillCheckpoint,
+                 workers: int = BACKFILL_WORKERS, batch: bool = False):
+        start_time = min(commits) - datetime.timedelta(seconds=1) if commits else datetime.datetime.min
+        super().__init__(
+            target["topic_name"], target["root_commits_url"], target["language"],
+            None,   # no Teams webhook: backfilled commits are only stored
+            False, load_system_prompts(target), BACKFILL_MAX_INPUT_TOKEN,
+            target.get("gpt_analysis_mode", "legacy"),
+            start_time=start_time,   # select_latest_commits keeps commits after start_time
+            prefetched_commits=commits,
+        )
+        self.pipeline_workers = workers
+        self.gpt_batch_mode = batch
+        self.checkpoint = checkpoint
+        self.checkpoint_key = BackfillCheckpoint.key(target)
+
+    def process_commits(self, selected_commits, url_mapping=None):
+        if self.gpt_batch_mode:
+            # Generate all GPT results through the Batch API first; the normal pass then hits the response cache.
+            run_batch_rounds(lambda: list(self._iter_analyzed_commits(selected_commits, url_mapping)))
+        super().process_commits(selected_commits, url_mapping)
+
+    def stored_shas(self, since: datetime.datetime, until: datetime.datetime) -> Set[str]:
+        """SHAs of commits in the range that already have an analysed record in CosmosDB."""
+        if self.cosmosDB_client is None:
+            return set()
+        try:
+            urls = self.cosmosDB_client.get_commit_urls(self.topic, self.language, self.root_commits_url, since, until)
+        except Exception as exc:
+            logger.warning(f"Backfill: failed to query existing commits ({exc}), relying on the checkpoint only")
+            return set()
+        return {commit_sha(url) for url in urls if url}
+
+    def upload_commit_history(self, commit_history):
+        stored = super().upload_commit_history(commit_history)
+        if stored:
+            self.checkpoint.mark(self.checkpoint_key, commit_sha(commit_history["commit_url"]))
+        return stored
+
+
+def backfill_target(target: dict, since: datetime.datetime, until: datetime.datetime,
+                    checkpoint: BackfillCheckpoint, workers: int = BACKFILL_WORKERS,
+                    max_pages: int = BACKFILL_MAX_PAGES, batch: bool = False) -> dict:
+    """Backfill one target; returns counts of listed, skipped and processed commits."""
+    topic = target["topic_name"]
+    headers = {"Authorization": "token " + PERSONAL_TOKEN}
+    listed = CommitFetcher().list_commits(target["root_commits_url"], headers, since=since, max_pages=max_pages, until=until)
+    commits = dict(sorted((t, url) for t, url in listed if since <= t < until))
+    logger.warning(f"[backfill] {topic} ({target['language']}): {len(commits)} commits between {since} and {until}")
+    if not commits:
+        return {"listed": 0, "skipped": 0, "processed": 0}
+
+    spyder = BackfillSpyder(target, commits, checkpoint, workers, batch)
+    skip = checkpoint.done(BackfillCheckpoint.key(target)) | spyder.stored_shas(since, until)
+    todo = {t: url for t, url in spyder.latest_commits.items() if commit_sha(url) not in skip}
+    skipped = len(commits) - len(todo)
+    logger.warning(f"[backfill] {topic}: {skipped} commits already stored, processing {len(todo)} with {workers} workers")
+
+    started_at = time.monotonic()
+    spyder.process_commits(todo, target.get("url_mapping", None))
+    logger.warning(f"[backfill] {topic}: finished {len(todo)} commits in {time.monotonic() - started_at:.1f}s")
+    return {"listed": len(commits), "skipped": skipped, "processed": len(todo)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse and store the commits of a topic in a past date range (no Teams posts).")
+    parser.add_argument("--topic", required=True, help="topic_name in target_config.json")
+    parser.add_argument("--language", help="only the target with this language (default: every language of the topic)")
+    parser.add_argument("--since", required=True, type=parse_date, help="UTC start, inclusive (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument("--until", required=True, type=parse_date, help="UTC end, exclusive (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="parallel commit analysis threads")
+    parser.add_argument("--max-pages", type=int, default=BACKFILL_MAX_PAGES, help="max commit list pages (100 commits each)")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH, help="checkpoint file ('' to disable)")
+    parser.add_argument("--batch", action="store_true", help="send GPT requests through the Batch API first")
+    args = parser.parse_args(argv)
+
+    if args.since >= args.until:
+        parser.error("--since must be before --until")
+    targets = select_targets(load_targets_config(), args.topic, args.language)
+    if not targets:
+        parser.error(f"no target with topic_name={args.topic!r}" + (f" and language={args.language!r}" if args.language else ""))
+
+    checkpoint = BackfillCheckpoint(args.checkpoint)
+    for target in targets:
+        try:
+            result = backfill_target(target, args.since, args.until, checkpoint, args.workers, args.max_pages, args.batch)
+            logger.warning(f"[backfill] {target['topic_name']} ({target['language']}): {result}")
+        except Exception as e:
+            logger.exception(f"Backfill of {target['topic_name']} ({target['language']}) failed:", e)
+    commit_history_writer.flush()
+
+    detail_stats = commit_details_cache.stats()
+    gpt_cache_stats = response_cache.stats()
+    logger.warning(f"[commit detail cache] hits: {detail_stats['hits']}, misses: {detail_stats['misses']}")
+    logger.warning(f"[gpt response cache] hits: {gpt_cache_stats['hits']}, misses: {gpt_cache_stats['misses']}, stores: {gpt_cache_stats['stores']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
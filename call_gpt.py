@@ -1,6 +1,28 @@
+import os
 from logs import logger
-from gpt_reply import get_gpt_response, get_gpt_structured_response
-import tiktoken
+from gpt_reply import (
+    collecting_gpt_requests,
+    gather_gpt_calls,
+    get_gpt_response,
+    get_gpt_response_async,
+    get_gpt_structured_response,
+    run_sync,
+)
+from token_utils import count_tokens
+
+# 一周的更新超过 max_input_token 时分块总结再合并（map-reduce），关闭时按原来的方式截断
+WEEKLY_SUMMARY_MAP_REDUCE = os.getenv("WEEKLY_SUMMARY_MAP_REDUCE", "False") in ("True", "true")
+# 每个分块总结的最大输出token数（实际取值不超过合并请求输入预算的一半，保证每次合并至少放得下两个分块总结）
+WEEKLY_SUMMARY_PARTIAL_MAX_TOKENS = int(os.getenv("WEEKLY_SUMMARY_PARTIAL_MAX_TOKENS", 2000))
+# 分块合并的最大层数，超过后放弃本次周总结（正常情况下每层至少把分块数减半，很少超过3层）
+WEEKLY_SUMMARY_MAX_LEVELS = int(os.getenv("WEEKLY_SUMMARY_MAX_LEVELS", 6))
+# 最终周总结的最大输出token数
+WEEKLY_SUMMARY_MAX_TOKENS = 4000
+
+WEEKLY_SUMMARY_INIT_PROMPT = "Here are the document titles and summaries for this week's updates from Microsoft Learn:\n\n"
+WEEKLY_SUMMARY_END_PROMPT = "Please format the updates in a numbered list, with each entry containing the title tag, title, summary, and link, prioritized by their significance with the most important updates at the top."
+WEEKLY_SUMMARY_MERGE_INIT_PROMPT = "Here are partial summaries, each covering a different part of this week's updates from Microsoft Learn:\n\n"
+WEEKLY_SUMMARY_MERGE_END_PROMPT = "Please merge them into a single numbered list that keeps every update, with each entry containing the title tag, title, summary, and link, prioritized by their significance with the most important updates at the top."
 
 # Optional include-link resolver. Never fail hard on import — if the
 # module is absent (e.g. rolled back) or misbehaves, the rest of this
@@ -111,6 +133,10 @@ class CallGPT:
         logger.warning(f"GPT_Summary Response:\n  {gpt_summary_response}")  
         logger.info(f"GPT_Summary Tokens: Prompt {prompt_tokens}, Completion {completion_tokens}, Total {total_tokens}")  
   
+        if gpt_summary_response is None and collecting_gpt_requests():
+            # Batch API 收集阶段请求只是被记录下来，没有可修正链接的回复
+            return None, None, commit_patch_data
+
         # 替换响应中的链接  
         gpt_summary_response = self.correct_links(gpt_summary_response, url_mapping)  
    
@@ -156,65 +182,61 @@ class CallGPT:
   
     
 
-    def generate_weekly_summary_using_weekly_commit_list(self, language, weekly_commit_list, gpt_weekly_summary_prompt, max_input_token):  
+    def generate_weekly_summary_using_weekly_commit_list(self, language, weekly_commit_list, gpt_weekly_summary_prompt, max_input_token, map_reduce=None):  
         """  
         获取一周 commit 的总结  
   
         :param language: 语言  
         :param weekly_commit_list: 一周的 commit 列表  
         :param gpt_weekly_summary_prompt: GPT 周总结提示信息  
+        :param max_input_token: 单次请求的输入token上限
+        :param map_reduce: 超过上限时是否分块总结再合并，默认取 WEEKLY_SUMMARY_MAP_REDUCE；否则截断
         :return: GPT 周总结响应  
         """  
         if not weekly_commit_list:
             logger.warning("Weekly commit list is empty")
             return None, None
+        if map_reduce is None:
+            map_reduce = WEEKLY_SUMMARY_MAP_REDUCE
         
-        init_prompt = "Here are the document titles and summaries for this week's updates from Microsoft Learn:\n\n"  
-        end_prompt = "Please format the updates in a numbered list, with each entry containing the title tag, title, summary, and link, prioritized by their significance with the most important updates at the top."
-        
-        post_data = False
-        skipped_commits = 0
-        
-        for commit in weekly_commit_list:  
-            title_response = commit.get("gpt_title_response", "")
-            if not isinstance(title_response, str) or len(title_response) < 1:
-                logger.warning(f"Invalid title response for commit: {commit}")
-                continue
-            
-            if title_response[0] == "1":
-                summary_response = commit.get("gpt_summary_response", "")
-                if not isinstance(summary_response, str):
-                    logger.warning(f"Invalid summary response for commit: {commit}")
-                    continue
-                
-                post_data = True
-                init_prompt += f"{title_response[2:]}\n\n{summary_response}\n\n"
-                
-                used_tokens = self.num_tokens_from_string(
-                    gpt_weekly_summary_prompt + init_prompt + end_prompt, 
-                    "cl100k_base"
-                )
-                
-                if used_tokens > max_input_token:
-                    logger.warning(f"Input tokens exceed the limit: {used_tokens} / {max_input_token}")
-                    skipped_commits = len(weekly_commit_list) - weekly_commit_list.index(commit)
-                    logger.warning(f"Skipped {skipped_commits} commits due to token limit")
-                    break
+        # 每条记录只编码一次：(在列表中的位置, 条目文本, token数)
+        entries = self._weekly_summary_entries(weekly_commit_list)
+        if not entries:
+            logger.warning("No valid commit data found for weekly summary")
+            return None, None
+
+        system_message = f"{gpt_weekly_summary_prompt}\n  Reply Reasoning in {language}."
+        # 固定部分（系统提示 + 开头 + 结尾）的token数
+        fixed_tokens = self.num_tokens_from_string(gpt_weekly_summary_prompt + WEEKLY_SUMMARY_INIT_PROMPT + WEEKLY_SUMMARY_END_PROMPT, "cl100k_base")
+        needed_tokens = fixed_tokens + sum(tokens for _, _, tokens in entries)
+        if map_reduce and needed_tokens > max_input_token:
+            logger.warning(f"Weekly summary needs {needed_tokens} input tokens (limit {max_input_token}), summarising {len(entries)} commits in chunks")
+            return self._map_reduce_weekly_summary(system_message, gpt_weekly_summary_prompt, entries, max_input_token)
+
+        prompt_parts = [WEEKLY_SUMMARY_INIT_PROMPT]
+        used_tokens = fixed_tokens
+        for index, entry, entry_tokens in entries:
+            if used_tokens + entry_tokens > max_input_token:
+                logger.warning(f"Input tokens exceed the limit: {used_tokens + entry_tokens} / {max_input_token}")
+                skipped_commits = len(weekly_commit_list) - index
+                logger.warning(f"Skipped {skipped_commits} commits due to token limit")
+                break
+            prompt_parts.append(entry)
+            used_tokens += entry_tokens
 
-        if not post_data:
+        if len(prompt_parts) == 1:
             logger.warning("No valid commit data found for weekly summary")
             return None, None
 
-        
-        prompt = init_prompt + end_prompt
+        prompt = "".join(prompt_parts) + WEEKLY_SUMMARY_END_PROMPT
         messages = [  
-            {"role": "system", "content": f"{gpt_weekly_summary_prompt}\n  Reply Reasoning in {language}."},  
+            {"role": "system", "content": system_message},  
             {"role": "user", "content": prompt},  
         ]  
         logger.debug(f"GPT_Weekly_Summary Request body: {messages}")  
   
         # 获取 GPT 周总结响应  
-        gpt_weekly_summary_response, prompt_tokens, completion_tokens, total_tokens = get_gpt_response(messages, max_tokens=4000)  
+        gpt_weekly_summary_response, prompt_tokens, completion_tokens, total_tokens = get_gpt_response(messages, max_tokens=WEEKLY_SUMMARY_MAX_TOKENS)  
           
         # 记录日志  
         logger.debug(f"GPT_Weekly_Summary Response:\n  {gpt_weekly_summary_response}")  
@@ -227,6 +249,124 @@ class CallGPT:
         }
 
         return gpt_weekly_summary_response, gpt_weekly_summary_tokens
+
+    def _weekly_summary_entries(self, weekly_commit_list):
+        """重要commit（标题以 "1" 开头）的周总结条目：[(在列表中的位置, 条目文本, token数)]"""
+        entries = []
+        for index, commit in enumerate(weekly_commit_list):  
+            title_response = commit.get("gpt_title_response", "")
+            if not isinstance(title_response, str) or len(title_response) < 1:
+                logger.warning(f"Invalid title response for commit: {commit}")
+                continue
+            
+            if title_response[0] == "1":
+                summary_response = commit.get("gpt_summary_response", "")
+                if not isinstance(summary_response, str):
+                    logger.warning(f"Invalid summary response for commit: {commit}")
+                    continue
+                
+                entry = f"{title_response[2:]}\n\n{summary_response}\n\n"
+                # 来自周汇总文档的记录已带有该条目的token数，不必重新编码
+                entry_tokens = commit.get("digest_tokens") or self.num_tokens_from_string(entry, "cl100k_base")
+                entries.append((index, entry, entry_tokens))
+        return entries
+
+    @staticmethod
+    def _pack_chunks(items, budget):
+        """按顺序把 (文本, token数) 装入若干块，每块的token数不超过 budget（单条超过 budget 时独占一块）"""
+        chunks, current, used = [], [], 0
+        for text, tokens in items:
+            if current and used + tokens > budget:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(text)
+            used += tokens
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _map_reduce_weekly_summary(self, system_message, gpt_weekly_summary_prompt, entries, max_input_token):
+        """
+        分块周总结：按token数把commit分块并发总结（map），再把各块的总结合并（reduce）；
+        合并的输入仍超过上限时，对分块总结再分块合并，直到一次请求放得下，每次请求的输入都不超过 max_input_token。
+        分块总结的输出上限不超过合并预算的一半，每一层合并至少把分块数减半，不会丢弃任何分块总结。
+        预算按 cl100k_base 计算，而 max_tokens 由部署模型自己的分词器执行，两者可能不一致：
+        分块数没有减少或超过 WEEKLY_SUMMARY_MAX_LEVELS 层时停止，避免无限重复总结
+
+        Returns:
+            tuple: (周总结, 所有请求累计的token用量)；全部分块都失败或无法收敛时返回 (None, None)
+        """
+        usage = {"prompt": 0, "completion": 0, "total": 0}
+        calls = 0
+        items = [(entry, tokens) for _, entry, tokens in entries]
+        merge_fixed_tokens = self.num_tokens_from_string(
+            gpt_weekly_summary_prompt + WEEKLY_SUMMARY_MERGE_INIT_PROMPT + WEEKLY_SUMMARY_MERGE_END_PROMPT, "cl100k_base"
+            )
+        # 每个分块总结（加上分隔的换行）最多占合并预算的一半
+        partial_max_tokens = min(WEEKLY_SUMMARY_PARTIAL_MAX_TOKENS, (max_input_token - merge_fixed_tokens) // 2 - 1)
+        if partial_max_tokens < 1:
+            logger.error(f"Weekly summary map-reduce: max_input_token {max_input_token} cannot hold two partial summaries")
+            return None, None
+        init_prompt, end_prompt = WEEKLY_SUMMARY_INIT_PROMPT, WEEKLY_SUMMARY_END_PROMPT
+        level = 0
+        previous_chunks = None
+        while True:
+            fixed_tokens = self.num_tokens_from_string(gpt_weekly_summary_prompt + init_prompt + end_prompt, "cl100k_base")
+            chunks = self._pack_chunks(items, max_input_token - fixed_tokens)
+            if len(chunks) == 1:
+                break
+            if previous_chunks is not None and len(chunks) >= previous_chunks:
+                logger.error(f"Weekly summary map-reduce made no progress at level {level}: {len(chunks)} chunks, "
+                             f"partial summaries are longer than WEEKLY_SUMMARY_PARTIAL_MAX_TOKENS allows for max_input_token {max_input_token}")
+                return None, None
+            if level >= WEEKLY_SUMMARY_MAX_LEVELS:
+                logger.error(f"Weekly summary map-reduce still has {len(chunks)} chunks after {level} levels, giving up")
+                return None, None
+            previous_chunks = len(chunks)
+
+            level += 1
+            requests = [
+                [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": init_prompt + "".join(chunk) + end_prompt},
+                ]
+                for chunk in chunks
+            ]
+            results = run_sync(gather_gpt_calls(*[
+                get_gpt_response_async(messages, max_tokens=partial_max_tokens) for messages in requests
+            ]))
+            calls += len(results)
+            partials = []
+            for response, prompt_tokens, completion_tokens, total_tokens in results:
+                if not response:
+                    continue
+                partials.append(response)
+                usage["prompt"] += prompt_tokens or 0
+                usage["completion"] += completion_tokens or 0
+                usage["total"] += total_tokens or 0
+            logger.warning(f"Weekly summary map-reduce level {level}: {len(chunks)} chunks, {len(partials)} partial summaries")
+            if not partials or (collecting_gpt_requests() and len(partials) < len(chunks)):
+                # 全部失败，或批量收集模式下还有分块在等 Batch API 的结果
+                return None, None
+            if len(partials) < len(chunks):
+                logger.warning(f"{len(chunks) - len(partials)} weekly summary chunks failed, the summary does not cover them")
+
+            items = [(partial + "\n\n", self.num_tokens_from_string(partial + "\n\n", "cl100k_base")) for partial in partials]
+            init_prompt, end_prompt = WEEKLY_SUMMARY_MERGE_INIT_PROMPT, WEEKLY_SUMMARY_MERGE_END_PROMPT
+
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": init_prompt + "".join(chunks[0]) + end_prompt},
+        ]
+        response, prompt_tokens, completion_tokens, total_tokens = get_gpt_response(messages, max_tokens=WEEKLY_SUMMARY_MAX_TOKENS)
+        calls += 1
+        if not response:
+            return None, None
+        usage["prompt"] += prompt_tokens or 0
+        usage["completion"] += completion_tokens or 0
+        usage["total"] += total_tokens or 0
+        logger.info(f"**************** GPT_Weekly_Summary Tokens ({calls} calls): Prompt {usage['prompt']}, Completion {usage['completion']}, Total {usage['total']}")
+        return response, usage
   
     def get_similarity(self, input_dict, language, latest_commit_in_cosmosdb, gpt_similarity_prompt):  
         """  
@@ -354,7 +494,5 @@ class CallGPT:
             return None, None, None, None, None, commit_patch_data
   
     def num_tokens_from_string(self, string: str, encoding_name: str) -> int:
-        """Returns the number of tokens in a text string."""
-        encoding = tiktoken.get_encoding(encoding_name)
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
\ No newline at end of file
+        """Returns the number of tokens in a text string (the encoder is cached per process)."""
+        return count_tokens(string, encoding_name)
\ No newline at end of file
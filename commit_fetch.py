@@ -2,8 +2,49 @@
 import requests  # HTTP请求库，用于调用GitHub API
 from bs4 import BeautifulSoup  # HTML解析库（用于废弃的网页爬虫方法）
 import datetime  # 时间处理库
-from urllib.parse import urlparse, parse_qs  # URL 解析，避免手动 split 出错
+from urllib.parse import urlparse, parse_qs, urlencode  # URL 解析，避免手动 split 出错
 from logs import logger  # 日志记录器
+from github_cache import commit_list_validators, commit_details_cache  # commit列表的ETag缓存（条件请求）与按SHA的commit详情缓存
+from token_utils import build_patch_prompt  # 按token预算拼接patch
+from github_http import github_session, github_rate_limit, is_retryable, GITHUB_REQUEST_TIMEOUT_SECONDS  # 共享连接池与限流处理
+
+# 每页请求的commit数量（GitHub API允许的最大值）
+GITHUB_COMMITS_PER_PAGE = 100
+# 单次获取commit列表时最多读取的页数
+GITHUB_MAX_COMMIT_PAGES = 20
+
+def build_commits_page_url(root_commits_url, since=None, until=None):
+    """
+    在commit列表URL上补充分页参数：per_page（URL中已指定则保留）、since 和 until（回填历史区间时使用）
+
+    例：
+      .../commits?path=articles/foundry&sha=live
+      -> .../commits?path=articles/foundry&sha=live&per_page=100&since=2026-06-01T00:00:00Z
+    """
+    parsed = urlparse(root_commits_url)
+    query_params = parse_qs(parsed.query, keep_blank_values=True)
+    query_params.setdefault('per_page', [str(GITHUB_COMMITS_PER_PAGE)])
+    if isinstance(since, datetime.datetime):
+        query_params['since'] = [since.strftime("%Y-%m-%dT%H:%M:%SZ")]
+    if isinstance(until, datetime.datetime):
+        query_params['until'] = [until.strftime("%Y-%m-%dT%H:%M:%SZ")]
+    return parsed._replace(query=urlencode(query_params, doseq=True, safe="/:")).geturl()
+
+def parse_topic_path(root_commits_url):
+    """
+    从commit列表URL中提取主题路径（path参数），没有path参数时返回None
+
+    使用 urllib.parse 处理query string，正确支持多参数（例如 ?path=X&sha=live），
+    避免旧版本 `split('path=')` 在 path 参数后面还有其他参数时把它们粘在一起。
+    例：
+      .../commits?path=articles/foundry/openai              -> "articles/foundry/openai"
+      .../commits?path=articles/foundry/openai&sha=live     -> "articles/foundry/openai"
+      .../commits?sha=live&path=articles/foundry/openai     -> "articles/foundry/openai"
+      .../commits                                            -> None
+    """
+    query_params = parse_qs(urlparse(root_commits_url).query)
+    path_values = query_params.get('path', [])
+    return path_values[0] if path_values else None
 
 class CommitFetcher:  
     """
@@ -16,92 +57,177 @@ class CommitFetcher:
     3. 获取每个commit的详细文件变更内容（patch数据）
     """
     topic_path : str = ""  # 主题路径，用于过滤特定目录下的文件变更
-    def get_all_commits(self, root_commits_url, headers={}):  
+    commits_truncated : bool = False  # 上一次读取commit列表时是否因页数上限或翻页失败而没有读完
+    def get_all_commits(self, root_commits_url, headers={}, since=None, max_pages=GITHUB_MAX_COMMIT_PAGES):  
         """
         获取指定仓库路径的所有commit记录
+
+        参数与 list_commits 相同。
+
+        Returns:
+            dict: commit时间到URL的映射字典，格式为 {datetime: url, ...}
+        """
+        # 将时间和URL打包成字典，便于后续按时间筛选和排序
+        commits_dic_time_url = dict(self.list_commits(root_commits_url, headers, since=since, max_pages=max_pages))
+        return commits_dic_time_url
+
+    def list_commits(self, root_commits_url, headers={}, since=None, max_pages=GITHUB_MAX_COMMIT_PAGES, until=None):
+        """
+        获取指定仓库路径的所有commit记录（列表形式，同一秒内的多个commit都会保留）
         
         通过GitHub API获取commit列表，解析每个commit的时间和URL信息。
         相比旧版本的网页爬虫方法，API方式更稳定可靠。
+
+        GitHub默认每页只返回30条commit，这里会带上 per_page=100 和 since=<起始时间>，
+        并沿着响应头 `Link: rel="next"` 逐页读取，直到没有下一页、
+        或者某一页的commit全部早于起始时间为止，避免繁忙时段漏掉第一页之外的commit。
+        第一页使用ETag条件请求，没有新commit时GitHub返回304，不消耗API配额。
         
         Args:
             root_commits_url (str): GitHub API的commit列表URL
                                   格式如：https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/ai-services/openai
             headers (dict): HTTP请求头，包含认证信息
+            since (datetime, optional): 起始时间，只请求此时间之后的commit
+            max_pages (int): 最多读取的页数，防止异常情况下无限翻页
+            until (datetime, optional): 截止时间，只请求此时间之前的commit（回填历史区间时使用）
             
         Returns:
-            dict: commit时间到URL的映射字典，格式为 {datetime: url, ...}
+            list: [(commit时间, commit的API URL), ...]，按GitHub返回顺序（新到旧）
         """
         logger.info(f"Commit Root page: {root_commits_url}")
 
         # 从URL中提取主题路径，用于后续过滤特定目录的文件变更
-        # 使用 urllib.parse 处理query string，正确支持多参数（例如 ?path=X&sha=live），
-        # 避免旧版本 `split('path=')` 在 path 参数后面还有其他参数时把它们粘在一起。
-        # 例：
-        #   .../commits?path=articles/foundry/openai              -> "articles/foundry/openai"
-        #   .../commits?path=articles/foundry/openai&sha=live     -> "articles/foundry/openai"
-        #   .../commits?sha=live&path=articles/foundry/openai     -> "articles/foundry/openai"
-        #   .../commits                                            -> None
-        query_params = parse_qs(urlparse(root_commits_url).query)
-        path_values = query_params.get('path', [])
-        self.topic_path = path_values[0] if path_values else None
-
-        # 通过GitHub API获取commit列表的JSON响应
-        # response = requests.get(root_commits_url, headers=headers).text  # 废弃的直接请求方式
-        response = self._make_request_to_json(root_commits_url, headers=headers)
-        
-        # 验证响应格式是否正确（应该是包含commit记录的列表）
-        if not isinstance(response, list):
-            logger.error(f"Failed to fetch commits or response is not a list. URL: {root_commits_url}, Response: {response}")
-            return {}
+        self.topic_path = parse_topic_path(root_commits_url)
 
         # 初始化数据存储列表
         precise_time_list = []  # 存储commit的精确时间
         commits_url_list = []   # 存储commit的API URL
 
-        # 解析每个commit记录
-        for idx, item in enumerate(response):
-            try:
-                # 验证数据结构是否正确
-                if not isinstance(item, dict):
-                    logger.warning(f"Item at index {idx} is not a dict: {item}")
-                    continue
-                    
-                # 检查必要的字段是否存在
-                if 'commit' not in item or 'author' not in item['commit'] or 'date' not in item['commit']['author']:
-                    logger.warning(f"Missing expected keys in item at index {idx}: {item}")
-                    continue
-                    
-                # 提取并解析commit时间
-                datetime_str = item['commit']['author']['date']
-                try:
-                    # 将ISO格式的时间字符串转换为datetime对象
-                    # 格式：2023-08-07T10:30:45Z
-                    precise_time = datetime.datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%SZ")
-                except ValueError as ve:
-                    logger.warning(f"Invalid datetime format at index {idx}: {datetime_str}, Exception: {ve}")
+        # 逐页获取commit列表，每页解析完再决定是否继续请求下一页
+        first_page_url = build_commits_page_url(root_commits_url, since, until)
+        for page_number, (page, response) in enumerate(self._iter_commit_pages(first_page_url, headers, max_pages), start=1):
+            newer_in_page = 0
+            for idx, item in enumerate(page):
+                parsed = self._parse_commit_item(idx, item)
+                if parsed is None:
                     continue
-                    
+                precise_time, full_url = parsed
                 precise_time_list.append(precise_time)
-                
-                # 提取commit的API URL
-                full_url = item.get('url')
-                if not full_url:
-                    logger.warning(f"Missing 'url' in item at index {idx}: {item}")
-                    continue
                 commits_url_list.append(full_url)
-                
-            except Exception as e:
-                logger.error(f"Error processing item at index {idx}: {item}, Exception: {e}", exc_info=True)
-                continue
+                if since is None or precise_time > since:
+                    newer_in_page += 1
+
+            # 第一页没有新commit时记录ETag，下一轮相同URL的请求可以直接得到304；
+            # 有新commit的响应不缓存，避免这些commit处理失败后被304跳过
+            if page_number == 1:
+                if newer_in_page == 0:
+                    commit_list_validators.store(first_page_url, response)
+                else:
+                    commit_list_validators.discard(first_page_url)
+
+            # 整页都早于起始时间，后面的页只会更早，不再继续翻页
+            if since is not None and page and newer_in_page == 0:
+                logger.info(f"Page {page_number} has no commits after {since}, stop paging")
+                break
 
         # 验证是否获取到有效数据
         if not precise_time_list or not commits_url_list:
             logger.warning(f"No valid commits found for URL: {root_commits_url}. precise_time_list: {precise_time_list}, commits_url_list: {commits_url_list}")
-            return {}
+            return []
 
-        # 将时间和URL打包成字典，便于后续按时间筛选和排序
-        commits_dic_time_url = dict(zip(precise_time_list, commits_url_list))  
-        return commits_dic_time_url    
+        return list(zip(precise_time_list, commits_url_list))
+
+    def _iter_commit_pages(self, url, headers={}, max_pages=GITHUB_MAX_COMMIT_PAGES):
+        """
+        按需逐页读取commit列表（生成器），调用方停止迭代后不会再请求后续页面
+
+        第一页以条件请求发送（If-None-Match / If-Modified-Since），
+        GitHub返回304表示与上次“没有新commit”的结果相同，此时不产出任何页面。
+
+        Args:
+            url (str): 第一页的URL
+            headers (dict): HTTP请求头
+            max_pages (int): 最多读取的页数
+
+        Yields:
+            tuple: (每一页的commit列表, 该页的响应对象)
+        """
+        self.commits_truncated = False
+        page_number = 0
+        page = []
+        while url and page_number < max_pages:
+            page_number += 1
+            if page_number == 1:
+                response = self._request_with_retries(url, headers=commit_list_validators.conditional_headers(url, headers))
+                if response is not None:
+                    commit_list_validators.record(response.status_code == 304)
+                    if response.status_code == 304:
+                        logger.info(f"Commits list not modified (304), no new commits. URL: {url}")
+                        return
+            else:
+                response = self._request_with_retries(url, headers=headers)
+            # 第一页之后的页面读取失败时，已产出的页面只是列表的一部分
+            if response is None:
+                self.commits_truncated = page_number > 1
+                return
+            try:
+                page = response.json()
+            except ValueError as e:
+                logger.error(f"Failed to parse commits page as JSON. URL: {url}, Exception: {e}")
+                self.commits_truncated = page_number > 1
+                return
+            # 验证响应格式是否正确（应该是包含commit记录的列表）
+            if not isinstance(page, list):
+                logger.error(f"Failed to fetch commits or response is not a list. URL: {url}, Response: {page}")
+                self.commits_truncated = page_number > 1
+                return
+            logger.info(f"Fetched commits page {page_number} with {len(page)} items")
+            yield page, response
+            # requests 会解析 Link 响应头，最后一页没有 next
+            url = response.links.get("next", {}).get("url")
+        # 达到页数上限时仍有下一页（或没有Link头但最后一页是满的），后面更早的commit没有读到
+        if url or (page_number >= max_pages and len(page) >= GITHUB_COMMITS_PER_PAGE):
+            self.commits_truncated = True
+            logger.warning(f"Reached max pages ({max_pages}) while fetching commits, remaining pages are skipped")
+
+    def _parse_commit_item(self, idx, item):
+        """
+        解析commit列表中的单条记录
+
+        Returns:
+            tuple: (commit时间, commit的API URL)，数据不完整时返回None
+        """
+        try:
+            # 验证数据结构是否正确
+            if not isinstance(item, dict):
+                logger.warning(f"Item at index {idx} is not a dict: {item}")
+                return None
+                
+            # 检查必要的字段是否存在
+            if 'commit' not in item or 'author' not in item['commit'] or 'date' not in item['commit']['author']:
+                logger.warning(f"Missing expected keys in item at index {idx}: {item}")
+                return None
+                
+            # 提取并解析commit时间
+            datetime_str = item['commit']['author']['date']
+            try:
+                # 将ISO格式的时间字符串转换为datetime对象
+                # 格式：2023-08-07T10:30:45Z
+                precise_time = datetime.datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%SZ")
+            except ValueError as ve:
+                logger.warning(f"Invalid datetime format at index {idx}: {datetime_str}, Exception: {ve}")
+                return None
+            
+            # 提取commit的API URL
+            full_url = item.get('url')
+            if not full_url:
+                logger.warning(f"Missing 'url' in item at index {idx}: {item}")
+                return None
+            return precise_time, full_url
+            
+        except Exception as e:
+            logger.error(f"Error processing item at index {idx}: {item}, Exception: {e}", exc_info=True)
+            return None
     
     
         ########################老代码 网页爬虫#########################################
@@ -135,6 +261,24 @@ class CommitFetcher:
         #################################################################
 
 
+    def get_commit_files(self, commit_url, headers={}):
+        """
+        获取commit变更的文件列表（GitHub API返回的 files 字段）
+
+        优先读取按 repo+SHA 缓存的结果；多个target同时需要同一个commit时只下载一次。
+
+        Returns:
+            list: 文件变更列表，请求失败时返回None
+        """
+        def fetch():
+            # 通过GitHub API获取具体commit信息的JSON数据
+            response = self._make_request_to_json(commit_url, headers=headers)
+            if not isinstance(response, dict) or not isinstance(response.get('files'), list):
+                return None
+            return response['files']
+
+        return commit_details_cache.get_files(commit_url, fetch)
+
     def get_change_from_each_url(self, time, commit_url, max_input_token, headers={}):  
         """
         获取单个commit的详细文件变更内容
@@ -145,7 +289,7 @@ class CommitFetcher:
         Args:
             time: commit时间（用于日志记录）
             commit_url (str): commit的API URL
-            max_input_token (int): 最大输入token限制，用于截断过长的内容
+            max_input_token (int): patch内容的最大token数，超出时按文件分配并整块裁剪hunk
             headers (dict): HTTP请求头，包含认证信息
             
         Returns:
@@ -153,14 +297,13 @@ class CommitFetcher:
         """
         logger.warning(f"Getting changes from url: {commit_url}")  
 
-        # 通过GitHub API获取具体commit信息的JSON数据
-        # response = requests.get(commit_url, headers=headers).json()  # 废弃的直接请求方式
-        response = self._make_request_to_json(commit_url, headers=headers)
-
-        # 提取commit中的文件变更信息
-        commit_response = response['files']
+        # 提取commit中的文件变更信息（commit不可变，按 repo+SHA 缓存，重复处理时不再请求GitHub）
+        commit_response = self.get_commit_files(commit_url, headers=headers)
+        if commit_response is None:
+            logger.error(f"Failed to get files of commit: {commit_url}")
+            return "Error"
         # result_list = []  # 构建结果列表（废弃的处理方式）
-        commit_patch_data = ""  # 用于存储所有相关文件的patch数据
+        files = []  # 主题路径下有patch的文件：(文件路径, patch)
         
         # 遍历commit中的每个文件变更
         for item in commit_response:
@@ -169,19 +312,11 @@ class CommitFetcher:
 
                 # 过滤：只处理指定主题路径下的文件变更
                 # 如果topic_path为None，则处理所有文件
-                if item["filename"].startswith(self.topic_path) or self.topic_path is None:
-                    # 格式化patch数据：原始路径 + 变更内容
-                    patch_data = "Original Path:" + item["filename"] + "\r\n" + item["patch"] + "\n\n"
-                    commit_patch_data += patch_data
-                    
-                    # 废弃的处理方式（保留作为参考）
-                    # if len(patch_data) >= max_input_token:
-                    #     result_list.append(patch_data[:max_input_token])
-                    # else:
-                    #     result_list.append(patch_data)
+                if self.topic_path is None or item["filename"].startswith(self.topic_path):
+                    files.append((item["filename"], item["patch"]))
         
-        # 根据最大token限制截断内容，确保不超过GPT的输入限制
-        commit_patch_data = commit_patch_data[:max_input_token] if len(commit_patch_data) >= max_input_token else commit_patch_data
+        # 按token（而不是字符）限制拼接patch：放不下时优先保留小文件，大文件按整个hunk裁剪
+        commit_patch_data = build_patch_prompt(files, max_input_token)
 
         logger.debug(f"Get commit_patch_data: {commit_patch_data}")  
         
@@ -274,6 +409,58 @@ class CommitFetcher:
         except requests.RequestException as e:  
             logger.error(f"Request exception for URL: {url}", exc_info=e)  
             return "Error"  
+
+    def _request_with_retries(self, url, is_stream=False, headers={}, retries=3, delay=2):
+        """
+        发送HTTP GET请求并返回响应对象，包含重试机制
+
+        _make_request_to_json 和分页读取都基于这个方法，
+        分页时需要读取响应头中的 Link 信息，因此这里返回完整的响应对象。
+
+        所有请求共用一个保持连接的 requests.Session（连接池），
+        并根据GitHub的限流响应头决定等待时间：
+        - Retry-After：次级限流，按指定秒数等待
+        - X-RateLimit-Remaining / X-RateLimit-Reset：配额将耗尽时，所有目标统一暂停到重置时间
+        - 其他可重试错误（5xx、网络异常）：指数退避
+        
+        Args:
+            url (str): 请求的URL
+            is_stream (bool): 是否使用流式请求
+            headers (dict): HTTP请求头
+            retries (int): 最大重试次数，默认3次
+            delay (int): 退避的基础间隔时间（秒），默认2秒
+            
+        Returns:
+            requests.Response: 成功（或304）时返回响应对象，所有重试都失败时返回None
+        """
+        import time
+
+        # 执行重试逻辑
+        for attempt in range(retries):
+            # 其他线程发现配额耗尽时，这里会统一等待到配额重置
+            github_rate_limit.wait_if_paused()
+            response = None
+            try:
+                response = github_session.get(url, stream=is_stream, headers=headers, timeout=GITHUB_REQUEST_TIMEOUT_SECONDS)
+                github_rate_limit.observe(response)
+                if not is_retryable(response):
+                    response.raise_for_status()  # 检查HTTP状态码
+                    return response
+                logger.warning(f"Retryable response for URL: {url}, Status: {response.status_code}, Attempt: {attempt+1}")
+            except requests.HTTPError as e:
+                # 404/401 等客户端错误重试也不会成功，直接返回
+                logger.error(f"Request exception for URL: {url}, Attempt: {attempt+1}, Exception: {e}", exc_info=True)
+                return None
+            except requests.RequestException as e:
+                logger.error(f"Request exception for URL: {url}, Attempt: {attempt+1}, Exception: {e}", exc_info=True)
+            if attempt + 1 < retries:
+                wait_seconds = github_rate_limit.retry_delay(response, attempt, delay)
+                logger.warning(f"Retrying in {wait_seconds:.1f}s. URL: {url}")
+                time.sleep(wait_seconds)  # 等待后重试
+                
+        # 所有重试都失败
+        logger.error(f"All retries failed for URL: {url}")
+        return None
         
     def _make_request_to_json(self, url, is_stream=False, headers={}, retries=3, delay=2):
         """
@@ -292,21 +479,14 @@ class CommitFetcher:
         Returns:
             dict/list: 解析后的JSON数据，失败时返回None
         """
-        import time
-        
-        # 执行重试逻辑
-        for attempt in range(retries):
-            try:
-                response = requests.get(url, stream=is_stream, headers=headers)
-                response.raise_for_status()  # 检查HTTP状态码
-                return response.json()  # 解析并返回JSON数据
-            except requests.RequestException as e:
-                logger.error(f"Request exception for URL: {url}, Attempt: {attempt+1}, Exception: {e}", exc_info=True)
-                time.sleep(delay)  # 等待后重试
-                
-        # 所有重试都失败
-        logger.error(f"All retries failed for URL: {url}")
-        return None
+        response = self._request_with_retries(url, is_stream=is_stream, headers=headers, retries=retries, delay=delay)
+        if response is None:
+            return None
+        try:
+            return response.json()  # 解析并返回JSON数据
+        except ValueError as e:
+            logger.error(f"Failed to parse JSON response for URL: {url}, Exception: {e}")
+            return None
 
 # 主程序入口，用于测试CommitFetcher类的功能
 if __name__ == "__main__":  
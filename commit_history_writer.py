@@ -0,0 +1,250 @@
+"""
+Write-behind buffer for commit history documents.
+
+``Spyder.upload_commit_history`` used to call ``create_commit_history``
+synchronously for every commit, so each CosmosDB round trip sat on the
+commit pipeline's critical path. With ``COMMIT_HISTORY_WRITE_BEHIND=true``
+the document is instead:
+
+1. given its ``id`` up front (so retries and replays are idempotent
+   upserts instead of duplicates),
+2. appended to a local JSONL spill file and fsync'ed, and
+3. queued for a background flusher that writes up to
+   ``COMMIT_HISTORY_BATCH_SIZE`` documents at a time with at most
+   ``COMMIT_HISTORY_WRITE_CONCURRENCY`` concurrent upserts.
+
+The call returns as soon as step 2 has succeeded; the spill file is
+rewritten without the documents CosmosDB has confirmed after every batch.
+If the process dies before a flush, the next process replays the spill
+file on start. ``flush()`` waits for the queue to drain; ``eyes_on_docs``
+calls it after each target so weekly summaries see the target's records.
+
+The pinned azure-cosmos 4.5.1 ships ``azure.cosmos.aio.CosmosClient``, but
+it requires ``aiohttp``, which is not in requirements.txt, and it has no
+transactional batch (``execute_item_batch``). Documents are therefore
+written with the regular client from a small thread pool.
+
+If the spill file cannot be written, ``submit`` returns False and the
+caller writes synchronously. A document that keeps failing
+(``COMMIT_HISTORY_MAX_ATTEMPTS``) stays in the spill file until the next
+``flush()`` or start.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from logs import logger
+
+
+COMMIT_HISTORY_WRITE_BEHIND = os.getenv("COMMIT_HISTORY_WRITE_BEHIND", "False") in ("True", "true")
+COMMIT_HISTORY_SPILL_PATH = os.getenv("COMMIT_HISTORY_SPILL_PATH", "commit_history_spill.jsonl")
+COMMIT_HISTORY_BATCH_SIZE = int(os.getenv("COMMIT_HISTORY_BATCH_SIZE", 25))
+COMMIT_HISTORY_WRITE_CONCURRENCY = int(os.getenv("COMMIT_HISTORY_WRITE_CONCURRENCY", 4))
+COMMIT_HISTORY_MAX_ATTEMPTS = int(os.getenv("COMMIT_HISTORY_MAX_ATTEMPTS", 5))
+COMMIT_HISTORY_FLUSH_TIMEOUT_SECONDS = float(os.getenv("COMMIT_HISTORY_FLUSH_TIMEOUT_SECONDS", 120))
+
+
+def _default_client_factory():
+    from cosmosdb_client import CosmosDBHandler
+    return CosmosDBHandler().initialize_cosmos_client()
+
+
+class CommitHistoryWriter:
+    """Queues commit history documents and upserts them in the background."""
+
+    def __init__(self, client_factory: Callable = _default_client_factory,
+                 spill_path: Optional[str] = COMMIT_HISTORY_SPILL_PATH,
+                 enabled: bool = COMMIT_HISTORY_WRITE_BEHIND,
+                 batch_size: int = COMMIT_HISTORY_BATCH_SIZE,
+                 max_concurrency: int = COMMIT_HISTORY_WRITE_CONCURRENCY,
+                 max_attempts: int = COMMIT_HISTORY_MAX_ATTEMPTS,
+                 retry_delay: float = 1.0):
+        self.enabled = enabled and bool(spill_path)
+        self._client_factory = client_factory
+        self._client = None
+        self._spill_path = spill_path
+        self._batch_size = max(1, batch_size)
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_attempts = max(1, max_attempts)
+        self._retry_delay = retry_delay
+        self._cond = threading.Condition()
+        self._pending = deque()   # ids waiting to be written, in submit order
+        self._unconfirmed = {}    # id -> document; exactly the content of the spill file
+        self._attempts = {}       # id -> failed attempts in this round
+        self._parked = set()      # ids that used up their attempts; retried by flush()
+        self._in_flight = 0
+        self._thread = None
+        self._stopping = False
+        self._written = 0
+        self._failed = 0
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def submit(self, document: dict) -> bool:
+        """Durably queue ``document``; False means the caller must write it synchronously."""
+        if not self.enabled:
+            return False
+        document = dict(document)
+        document.setdefault("id", str(uuid.uuid4()))
+        with self._cond:
+            self._start()
+            try:
+                with open(self._spill_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(document, ensure_ascii=False, default=str) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as exc:
+                logger.warning(f"CommitHistoryWriter: cannot spill to {self._spill_path} ({exc}), writing synchronously")
+                return False
+            self._unconfirmed[document["id"]] = document
+            self._pending.append(document["id"])
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: Optional[float] = COMMIT_HISTORY_FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Retry parked documents and wait until nothing is queued or in flight; True if drained."""
+        if not self.enabled:
+            return True
+        with self._cond:
+            if self._stopping:
+                return not self._unconfirmed
+            self._start()
+            for doc_id in self._parked:
+                self._attempts.pop(doc_id, None)
+                self._pending.append(doc_id)
+            self._parked.clear()
+            self._cond.notify_all()
+            drained = self._cond.wait_for(lambda: not self._pending and self._in_flight == 0, timeout)
+            if not drained:
+                logger.warning(f"CommitHistoryWriter: {len(self._pending) + self._in_flight} documents still queued after {timeout}s")
+            return drained and not self._parked
+
+    def close(self, timeout: Optional[float] = COMMIT_HISTORY_FLUSH_TIMEOUT_SECONDS) -> None:
+        if self._thread is None or self._stopping:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._cond:
+            result = {
+                "written": self._written,
+                "failed": self._failed,
+                "queued": len(self._pending) + self._in_flight,
+                "spilled": len(self._unconfirmed),
+            }
+            if reset:
+                self._written = 0
+                self._failed = 0
+        return result
+
+    # ------------------------------------------------------------------
+    # background flusher
+    # ------------------------------------------------------------------
+    def _start(self) -> None:
+        """Replay the spill file and start the flusher thread (caller holds ``self._cond``)."""
+        if self._thread is not None:
+            return
+        self._replay_spill()
+        self._thread = threading.Thread(target=self._run, name="commit-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _replay_spill(self) -> None:
+        if not os.path.exists(self._spill_path):
+            return
+        try:
+            with open(self._spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        document = json.loads(line)
+                    except ValueError:
+                        continue   # a line cut short by a crash
+                    if document.get("id") not in self._unconfirmed:
+                        self._pending.append(document["id"])
+                    self._unconfirmed[document["id"]] = document
+        except OSError as exc:
+            logger.warning(f"CommitHistoryWriter: cannot read {self._spill_path} ({exc})")
+            return
+        if self._pending:
+            logger.warning(f"CommitHistoryWriter: replaying {len(self._pending)} commit history documents from {self._spill_path}")
+
+    def _rewrite_spill(self) -> None:
+        """Keep only unconfirmed documents in the spill file (caller holds ``self._cond``)."""
+        try:
+            tmp_path = f"{self._spill_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for document in self._unconfirmed.values():
+                    f.write(json.dumps(document, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._spill_path)
+        except OSError as exc:
+            logger.warning(f"CommitHistoryWriter: failed to compact {self._spill_path} ({exc})")
+
+    def _write_one(self, document: dict) -> bool:
+        try:
+            if self._client is None:
+                self._client = self._client_factory()
+            return bool(self._client is not None and self._client.create_commit_history(dict(document)))
+        except Exception as exc:
+            logger.warning(f"CommitHistoryWriter: write of {document.get('commit_url')} failed ({exc})")
+            return False
+
+    def _run(self) -> None:
+        executor = ThreadPoolExecutor(max_workers=self._max_concurrency, thread_name_prefix="commit-history-write")
+        consecutive_failures = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if self._stopping and not self._pending:
+                    break
+                batch = [self._pending.popleft() for _ in range(min(self._batch_size, len(self._pending)))]
+                documents = [self._unconfirmed[doc_id] for doc_id in batch]
+                self._in_flight += len(batch)
+
+            try:
+                results = list(executor.map(self._write_one, documents))
+            except RuntimeError:
+                # The interpreter is exiting and has already shut down executors: finish in this thread.
+                results = [self._write_one(document) for document in documents]
+
+            with self._cond:
+                for doc_id, ok in zip(batch, results):
+                    if ok:
+                        self._unconfirmed.pop(doc_id, None)
+                        self._attempts.pop(doc_id, None)
+                        self._written += 1
+                        continue
+                    self._failed += 1
+                    self._attempts[doc_id] = self._attempts.get(doc_id, 0) + 1
+                    if self._attempts[doc_id] >= self._max_attempts:
+                        logger.error(f"CommitHistoryWriter: giving up on {doc_id} for now, it stays in {self._spill_path}")
+                        self._parked.add(doc_id)
+                    else:
+                        self._pending.append(doc_id)
+                self._in_flight -= len(batch)
+                if any(results):
+                    self._rewrite_spill()
+                self._cond.notify_all()
+
+            if all(results):
+                consecutive_failures = 0
+            else:
+                consecutive_failures += 1
+                time.sleep(min(30.0, self._retry_delay * 2 ** (consecutive_failures - 1)))
+        executor.shutdown(wait=True)
+
+
+# Shared by every target in the process.
+commit_history_writer = CommitHistoryWriter()
@@ -5,6 +5,7 @@ import time  # 时间戳转换库
 from azure.identity import ClientSecretCredential  # Azure身份认证库
 from cosmosdbservice import CosmosConversationClient  # CosmosDB服务客户端
 from logs import logger  # 日志记录器
+from watermark_store import watermark_store  # 每个目标的爬取水位（最后保存的commit时间和SHA）
 from dotenv import load_dotenv  # 环境变量加载器
 
 # 加载环境变量配置文件
@@ -86,6 +87,34 @@ class CosmosDBHandler:
             self.save_commit_history_to_cosmosdb = False
             return None  
    
+    def get_target_start_time(self, cosmosDB_client, topic, language, root_commits_url):
+        """
+        确定目标的起始时间点：优先读取本地水位库中该目标最后保存的commit时间（一次主键查询）；
+        没有水位时（升级后第一次运行）再查询数据库中的最新commit记录和 last_crawl_time.txt，并用结果初始化水位
+
+        Args:
+            cosmosDB_client: initialize_cosmos_client() 返回的客户端，可能为None
+            topic (str): 主题名称
+            language (str): 输出语言
+            root_commits_url (str): commit列表URL
+
+        Returns:
+            datetime: 处理commit的起始时间点
+        """
+        key = (topic, language, root_commits_url)
+        watermark = watermark_store.get(key)
+        if watermark is not None:
+            logger.warning(f"Use crawl watermark as start time: {watermark.commit_time} ({watermark.commit_sha})")
+            return watermark.commit_time
+
+        lastest_commit_in_cosmosdb = None
+        if cosmosDB_client is not None:
+            lastest_commit_in_cosmosdb = cosmosDB_client.get_lastest_commit(topic, language, root_commits_url, sort_order='DESC')
+        start_time = self.get_start_time(lastest_commit_in_cosmosdb)
+        if start_time is not None:
+            watermark_store.advance(key, start_time)
+        return start_time
+
     def get_start_time(self, lastest_commit_in_cosmosdb):  
         """
         获取commit处理的起始时间点
@@ -7,6 +7,75 @@ from collections import Counter  # 计数器库，用于统计数据
 # from flask import Flask, request  # Flask框架（已注释，未使用）
 from azure.identity import DefaultAzureCredential  # Azure默认身份认证
 from azure.cosmos import CosmosClient, PartitionKey, exceptions  # Azure CosmosDB SDK
+from azure.core import MatchConditions  # 按 etag 条件替换
+import threading  # RU统计的锁
+from logs import logger  # 日志记录器
+
+# 分区键字段：每条记录写入 pk = "<topic>|<language>"。
+# 容器以 /pk 为分区键时，按主题的查询只访问一个分区；旧容器（其他分区键）仍走跨分区查询。
+# 已有容器的分区键不能修改，迁移见 migrate_partition_key.py
+PARTITION_KEY_FIELD = "pk"
+PARTITION_KEY_PATH = "/" + PARTITION_KEY_FIELD
+
+
+# 分页查询每页的记录数
+QUERY_PAGE_SIZE = int(os.getenv("COSMOSDB_QUERY_PAGE_SIZE", 100))
+
+_FIELD_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _field_name(name):
+    """校验拼接进SQL的字段名，只允许标识符"""
+    if not _FIELD_NAME_PATTERN.match(str(name)):
+        raise ValueError(f"invalid field name: {name!r}")
+    return name
+
+
+def partition_key_value(topic, language):
+    """某个主题+语言的分区键值，例如 "AML|English" """
+    return f"{topic or ''}|{language or ''}"
+
+
+class RequestChargeStats:
+    """按查询名累计的调用次数和RU消耗（进程内所有客户端共享）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._charges = {}  # name -> [calls, request_charge]
+
+    def record(self, name, request_charge):
+        with self._lock:
+            entry = self._charges.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += request_charge
+
+    def stats(self, reset=False):
+        with self._lock:
+            result = {name: {"calls": calls, "ru": round(ru, 2)} for name, (calls, ru) in self._charges.items()}
+            if reset:
+                self._charges.clear()
+        return result
+
+
+request_charges = RequestChargeStats()
+
+
+class _RequestChargeHook:
+    """query_items 的 response_hook：累加每一页响应头中的 x-ms-request-charge"""
+
+    def __init__(self):
+        self.request_charge = 0.0
+        self.pages = 0
+
+    def __call__(self, headers, result):
+        # query_items 创建迭代器时还会用上一次请求的响应头调用一次（result 不是响应体），忽略
+        if not isinstance(result, dict):
+            return
+        self.pages += 1
+        try:
+            self.request_charge += float((headers or {}).get("x-ms-request-charge", 0))
+        except (TypeError, ValueError):
+            pass
   
 class CosmosConversationClient:
     """
@@ -43,6 +112,101 @@ class CosmosConversationClient:
         self.database_client = self.cosmosdb_client.get_database_client(database_name)
         # 获取容器客户端
         self.container_client = self.database_client.get_container_client(container_name)
+        # 容器的分区键路径，首次按主题查询或点读时读取容器属性确定
+        self._partition_key_paths = None
+
+    # ===========================================
+    # 分区键与RU统计
+    # ===========================================
+
+    def partition_key_paths(self):
+        """
+        容器的分区键路径（只读取一次容器属性）；读取失败时返回空列表，按旧容器处理，使用跨分区查询
+        """
+        if self._partition_key_paths is None:
+            try:
+                self._partition_key_paths = list(self.container_client.read().get("partitionKey", {}).get("paths", []))
+            except Exception as e:
+                logger.warning(f"Failed to read the partition key of container {self.container_name} ({e}), using cross-partition queries")
+                self._partition_key_paths = []
+        return self._partition_key_paths
+
+    def partitioned_by_pk(self):
+        """容器的分区键是否为 /pk"""
+        return self.partition_key_paths() == [PARTITION_KEY_PATH]
+
+    def partition_key_of(self, document):
+        """
+        文档在本容器中的分区键值，用于点读和条件替换；容器分区键未知、是多级分区键或文档缺少该字段时返回None
+        """
+        paths = self.partition_key_paths()
+        if len(paths) != 1:
+            return None
+        value = document
+        for part in paths[0].strip("/").split("/"):
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+    def _partition_options(self, topic, language):
+        """按主题查询的分区参数：新容器只查 pk 所在分区，旧容器跨分区查询"""
+        if self.partitioned_by_pk():
+            return {"partition_key": partition_key_value(topic, language)}
+        return {"enable_cross_partition_query": True}
+
+    def iter_query_pages(self, name, query, parameters=None, page_size=None, continuation_token=None, **options):
+        """
+        逐页执行查询（生成器），内存中只保留当前一页
+
+        Args:
+            name (str): 查询名称，用于日志和统计
+            query (str): SQL语句
+            parameters (list): 查询参数
+            page_size (int): 每页最多返回的记录数，默认 COSMOSDB_QUERY_PAGE_SIZE
+            continuation_token (str): 上次返回的token，从该页之后继续
+            **options: partition_key 或 enable_cross_partition_query 等 query_items 参数
+
+        Yields:
+            tuple: (本页结果列表, 继续读取下一页的continuation token；最后一页为None)
+        """
+        hook = _RequestChargeHook()
+        count = 0
+        pager = self.container_client.query_items(
+            query=query, parameters=parameters, max_item_count=page_size or QUERY_PAGE_SIZE,
+            response_hook=hook, **options,
+        ).by_page(continuation_token)
+        try:
+            for page in pager:
+                items = list(page)
+                count += len(items)
+                yield items, pager.continuation_token
+        finally:
+            # 读完或调用方提前停止时记录本次查询消耗的RU
+            logger.info(f"[cosmos RU] {name}: {hook.request_charge:.2f} RU, {count} items, {hook.pages} pages (paged)")
+            request_charges.record(name, hook.request_charge)
+
+    def iter_query(self, name, query, parameters=None, page_size=None, **options):
+        """按页执行查询，逐条返回结果（生成器）"""
+        for page, _ in self.iter_query_pages(name, query, parameters, page_size, **options):
+            yield from page
+
+    def _query(self, name, query, parameters=None, **options):
+        """
+        执行查询并返回结果列表，记录本次查询消耗的RU
+
+        Args:
+            name (str): 查询名称，用于日志和统计
+            query (str): SQL语句
+            parameters (list): 查询参数
+            **options: partition_key 或 enable_cross_partition_query 等 query_items 参数
+        """
+        hook = _RequestChargeHook()
+        items = list(self.container_client.query_items(query=query, parameters=parameters, response_hook=hook, **options))
+        scope = f"partition {options['partition_key']}" if "partition_key" in options else "cross-partition"
+        logger.info(f"[cosmos RU] {name}: {hook.request_charge:.2f} RU, {len(items)} items, {hook.pages} pages ({scope})")
+        request_charges.record(name, hook.request_charge)
+        return items
 
     # ===========================================
     # 正在使用的方法（项目中有调用）
@@ -108,11 +272,9 @@ class CosmosConversationClient:
                 AND c.log_time <= '{this_sunday_str}'  
             ORDER BY c.log_time {sort_order}  
         """  
-        # 执行查询
-        weekly_summary_list = list(self.container_client.query_items(  
-            query=query,  
-            parameters=parameters,  
-            enable_cross_partition_query=True))  
+        # 执行查询（新容器只查该主题所在的分区）
+        weekly_summary_list = self._query("check_weekly_summary", query, parameters,
+                                          **self._partition_options(topic, language))
 
         # 返回结果
         if len(weekly_summary_list) == 0:
@@ -133,8 +295,10 @@ class CosmosConversationClient:
         Returns:
             dict/bool: 成功时返回数据库响应，失败时返回False
         """
-        # 为记录添加唯一ID和时间戳
-        history_dict['id'] = str(uuid.uuid4())
+        # 为记录添加唯一ID和时间戳（已有ID时保留，重试写入是幂等的upsert，不会产生重复记录）
+        history_dict.setdefault('id', str(uuid.uuid4()))
+        # 分区键：主题+语言
+        history_dict.setdefault(PARTITION_KEY_FIELD, partition_key_value(history_dict.get('topic'), history_dict.get('language')))
         history_dict['log_time'] = datetime.utcnow().isoformat()
         
         # 将记录插入或更新到数据库
@@ -182,48 +346,173 @@ class CosmosConversationClient:
         ]
         
         # 构建查询语句，获取最新的一条记录
-        query = f"SELECT TOP 1 * FROM c where c.topic = @topic and c.root_commits_url = @root_commits_url and c.language = @language order by c.commit_time {sort_order}"
+        query = f"SELECT TOP 1 * FROM c where c.topic = @topic and c.root_commits_url = @root_commits_url and c.language = @language and IS_DEFINED(c.commit_time) order by c.commit_time {sort_order}"
         
         # 执行查询
-        lastest_commit = list(self.container_client.query_items(query=query, parameters=parameters,
-                                                                               enable_cross_partition_query =True))
+        lastest_commit = self._query("get_lastest_commit", query, parameters,
+                                     **self._partition_options(topic, language))
         ## 如果没有找到记录，返回None
         if len(lastest_commit) == 0:
             return None
         else:
             return lastest_commit[0]
 
-    def get_commit_history(self):
+    def get_commit_urls(self, topic, language, root_commits_url, start_time, end_time):
         """
-        获取所有commit历史记录
-        
-        获取数据库中的所有commit历史记录，主要用于数据分析和调试。
-        
+        获取指定时间区间内已成功分析（status 为 post/skip）的commit网页URL，回填时用于跳过这些commit，
+        分析出错的commit不在其中，会被重新处理
+
+        Args:
+            topic (str): 主题名称
+            language (str): 语言
+            root_commits_url (str): commit根URL
+            start_time (datetime): 区间起点（包含）
+            end_time (datetime): 区间终点（不包含，与回填的 [since, until) 区间一致）
+
         Returns:
-            list: 所有commit历史记录的列表
-        """
-        # 废弃的查询代码（保留作为参考）
-        # parameters = [
-        #     {
-        #         'name': '@conversationId',
-        #         'value': conversation_id
-        #     },
-        #     {
-        #         'name': '@userId',
-        #         'value': user_id
-        #     }
-        # ]
-        # query = f"SELECT * FROM c WHERE c.conversationId = @conversationId AND c.type='message' AND c.userId = @userId ORDER BY c.timestamp ASC"
-        
-        # 查询所有记录
-        query = f"SELECT * FROM c"
-        messages = list(self.container_client.query_items(query=query, enable_cross_partition_query =True))
-        
-        ## 如果没有找到消息，返回空列表
-        if len(messages) == 0:
-            return []
-        else:
-            return messages
+            list: commit_url 列表
+        """
+        parameters = [
+            {'name': '@topic', 'value': topic},
+            {'name': '@language', 'value': language},
+            {'name': '@root_commits_url', 'value': root_commits_url},
+            # commit_time 保存为 str(datetime)，即 "YYYY-MM-DD HH:MM:SS"，按相同格式比较
+            {'name': '@start_time', 'value': str(start_time)},
+            {'name': '@end_time', 'value': str(end_time)},
+        ]
+        query = """
+            SELECT VALUE c.commit_url FROM c
+            WHERE c.topic = @topic
+                AND c.root_commits_url = @root_commits_url
+                AND c.language = @language
+                AND c.status IN ("post", "skip")
+                AND c.commit_time >= @start_time
+                AND c.commit_time < @end_time
+        """
+        return self._query("get_commit_urls", query, parameters, **self._partition_options(topic, language))
+
+    def get_important_commits(self, topic, language, root_commits_url, start_time, end_time):
+        """
+        逐条返回指定时间区间内重要（标题以 "1" 开头且已发送）的commit，只取周总结需要的字段（生成器）
+
+        用于新建周汇总文档时补齐该周已有的commit（见 weekly_digest.py）
+
+        Args:
+            topic (str): 主题名称
+            language (str): 语言
+            root_commits_url (str): commit根URL
+            start_time (datetime): 区间起点（包含）
+            end_time (datetime): 区间终点（不包含）
+
+        Yields:
+            dict: commit_url, commit_time, gpt_title_response, gpt_summary_response
+        """
+        parameters = [
+            {'name': '@topic', 'value': topic},
+            {'name': '@language', 'value': language},
+            {'name': '@root_commits_url', 'value': root_commits_url},
+            # commit_time 保存为 str(datetime)，即 "YYYY-MM-DD HH:MM:SS"，按相同格式比较
+            {'name': '@start_time', 'value': str(start_time)},
+            {'name': '@end_time', 'value': str(end_time)},
+        ]
+        query = """
+            SELECT c.commit_url, c.commit_time, c.gpt_title_response, c.gpt_summary_response FROM c
+            WHERE c.topic = @topic
+                AND c.root_commits_url = @root_commits_url
+                AND c.language = @language
+                AND c.status = "post"
+                AND STARTSWITH(c.gpt_title_response, "1")
+                AND c.commit_time >= @start_time
+                AND c.commit_time < @end_time
+        """
+        yield from self.iter_query("get_important_commits", query, parameters, **self._partition_options(topic, language))
+
+    def read_document(self, doc_id, partition_document):
+        """
+        按 id 点读一条文档（不经过查询引擎，RU最低）
+
+        Args:
+            doc_id (str): 文档id
+            partition_document (dict): 含分区键字段的文档（例如要读取的文档的已知字段），用于得到分区键值
+
+        Returns:
+            dict/None: 文档（含 _etag）；不存在或容器分区键无法确定时返回None
+        """
+        partition_key = self.partition_key_of(partition_document)
+        if partition_key is None:
+            return None
+        hook = _RequestChargeHook()
+        try:
+            return self.container_client.read_item(item=doc_id, partition_key=partition_key, response_hook=hook)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        finally:
+            request_charges.record("read_document", hook.request_charge)
+
+    def create_document(self, document):
+        """创建文档；同 id 的文档已存在时返回None（并发创建时由调用方重新读取）"""
+        hook = _RequestChargeHook()
+        try:
+            return self.container_client.create_item(body=document, response_hook=hook)
+        except exceptions.CosmosResourceExistsError:
+            return None
+        finally:
+            request_charges.record("create_document", hook.request_charge)
+
+    def replace_document(self, document):
+        """
+        按 _etag 条件替换文档（乐观并发）：读取之后文档被其他进程修改过时返回None，由调用方重新读取再修改
+        """
+        hook = _RequestChargeHook()
+        try:
+            return self.container_client.replace_item(item=document["id"], body=document, etag=document.get("_etag"),
+                                                      match_condition=MatchConditions.IfNotModified, response_hook=hook)
+        except exceptions.CosmosAccessConditionFailedError:
+            return None
+        finally:
+            request_charges.record("replace_document", hook.request_charge)
+
+    def update_document_fields(self, partition_document, fields, max_attempts=5):
+        """
+        点读文档后按 _etag 条件更新其中几个字段，被并发修改时重新读取再更新
+
+        Args:
+            partition_document (dict): 含 id 和分区键字段的文档
+            fields (dict): 要写入的字段
+
+        Returns:
+            bool/None: 更新成功返回True；文档不存在（例如仍在写入缓冲中）返回None；多次冲突返回False
+        """
+        for _ in range(max_attempts):
+            document = self.read_document(partition_document["id"], partition_document)
+            if document is None:
+                return None
+            document.update(fields)
+            if self.replace_document(document) is not None:
+                return True
+        return False
+
+    def get_commit_history(self, fields=None, page_size=None, continuation_token=None):
+        """
+        逐条返回所有commit历史记录（生成器）
+
+        按页读取（每页 page_size 条，默认 COSMOSDB_QUERY_PAGE_SIZE），内存占用与容器大小无关，
+        主要用于数据分析和调试。
+
+        Args:
+            fields (list): 只返回这些字段（投影），默认返回整条记录
+            page_size (int): 每页记录数
+            continuation_token (str): 从上次中断的位置继续（见 iter_query_pages）
+
+        Yields:
+            dict: commit历史记录
+        """
+        projection = ", ".join(f"c.{_field_name(field)}" for field in fields) if fields else "*"
+        query = f"SELECT {projection} FROM c"
+        for page, _ in self.iter_query_pages("get_commit_history", query, page_size=page_size,
+                                             continuation_token=continuation_token,
+                                             enable_cross_partition_query=True):
+            yield from page
 
     def get_weekly_commit(self, topic, language, root_commits_url, sort_order = 'DESC'):
         """
@@ -290,8 +579,8 @@ class CosmosConversationClient:
         # 废弃的查询语句（保留作为参考）
         # query = f"SELECT TOP 1 *FROM c WHERE c.topic = @topic AND c.root_commits_url = @root_commits_url AND c.language = @language AND c.commit_time >= (DateTimeOffset() - 7) ORDER BY c.commit_time {sort_order}"
         # 执行查询
-        weekly_commit_list = list(self.container_client.query_items(query=query, parameters=parameters,
-                                                                               enable_cross_partition_query =True))
+        weekly_commit_list = self._query("get_weekly_commit", query, parameters,
+                                         **self._partition_options(topic, language))
         ## 如果没有找到记录，返回None
         if len(weekly_commit_list) == 0:
             return None
@@ -300,88 +589,78 @@ class CosmosConversationClient:
 
     def get_value_list(self, name):
         """
-        获取指定字段的唯一值列表（仅在archived/cosmosdb_ui.py中使用）
-        
-        查询数据库中指定字段的所有唯一值，用于统计分析。
-        例如获取所有不同的主题名称、语言等。
-        
+        获取指定字段的唯一值列表及出现次数（仅在archived/cosmosdb_ui.py中使用）
+
+        计数在服务端完成：一条 GROUP BY 查询按页返回每个值及其次数（同一值分多行返回时累加）。
+        SDK 拒绝跨分区 GROUP BY 时退回为一条只投影该字段的分页查询，在本地计数。
+        标签（tag）是从 gpt_title_response 中用正则提取的，只能在本地统计，按页读取该字段并累加计数。
+
         Args:
             name (str): 字段名称
-            
+
         Returns:
-            list: 唯一值列表
+            tuple: (["Select All"] + 按出现次数降序的值列表, 对应的次数列表)；没有记录时返回 ["None"]
         """
         # 特殊处理：如果是获取标签（tag）信息
         if name == "tag":
-            # 查询所有GPT标题响应
-            query = 'SELECT c.gpt_title_response FROM c'  
-            items = list(self.container_client.query_items(  
-                query=query,  
-                enable_cross_partition_query=True  
-            ))  
-            import re
             # 正则表达式，用于匹配括号内的内容（标签）
-            pattern = re.compile(r"\[(.*?)\]")  
-            
-            # 遍历查询结果，提取所有标签
-            extracted_data = []  
-            for item in items:  
-                title_response = item.get('gpt_title_response', '')  
-                matches = pattern.findall(title_response)  
-                if matches:  
-                    # 每个匹配项都是括号内的文本（标签）
-                    extracted_data.extend(matches)
-            
-            # 使用Counter计算每个标签的出现次数，并按计数降序排序  
-            counter = Counter(extracted_data)  
-            sorted_data = counter.most_common()  # 返回一个列表，其中包含出现次数的降序排列的元素和它们的计数
-            sorted_elements = [element for element, count in sorted_data]
-            count = [count for element, count in sorted_data] 
-            return ["Select All"] + sorted_elements, count
+            pattern = re.compile(r"\[(.*?)\]")
+            counter = Counter()
+            query = 'SELECT VALUE c.gpt_title_response FROM c WHERE IS_DEFINED(c.gpt_title_response)'
+            for title_response in self.iter_query("get_value_list.tag", query, enable_cross_partition_query=True):
+                # 每个匹配项都是括号内的文本（标签）
+                counter.update(pattern.findall(title_response or ''))
         else:
-            # 普通字段的处理：获取指定字段的所有唯一值
-            query = f"SELECT c.{name} FROM c"  
-            # 执行查询
-            message = list(self.container_client.query_items(query=query, enable_cross_partition_query=True))
-            if len(message) == 0:
+            field = _field_name(name)
+            counter = Counter()
+            group_query = f"SELECT c.{field} AS value, COUNT(1) AS count FROM c WHERE IS_DEFINED(c.{field}) GROUP BY c.{field}"
+            try:
+                for row in self.iter_query(f"get_value_list.{field}", group_query, enable_cross_partition_query=True):
+                    counter[row.get("value")] += row.get("count", 0)
+            except exceptions.CosmosHttpResponseError as e:
+                logger.warning(f"get_value_list: GROUP BY on {field} failed ({e.status_code}), counting a projected scan instead")
+                counter = Counter(self.iter_query(
+                    f"get_value_list.{field}.scan", f"SELECT VALUE c.{field} FROM c WHERE IS_DEFINED(c.{field})",
+                    enable_cross_partition_query=True,
+                ))
+            if not counter:
                 return ["None"]
-            
-            # 统计每个值的出现次数
-            counts = Counter(item.get(name, '') for item in message if item)  
-
-            # 按出现次数降序排序
-            sorted_value_count_pairs = sorted(counts.items(), key=lambda pair: pair[1], reverse=True)  
-    
-            sorted_values  = [str(name) for name, count in sorted_value_count_pairs]  
-            count  = [count for name, count in sorted_value_count_pairs] 
 
-            return ["Select All"] + sorted_values, count
+        # 按出现次数降序排序
+        sorted_value_count_pairs = counter.most_common()
+        sorted_values = [str(value) for value, count in sorted_value_count_pairs]
+        count = [count for value, count in sorted_value_count_pairs]
+        return ["Select All"] + sorted_values, count
 
     def get_commit_time_list(self):
         """
-        获取所有commit时间的列表（仅在archived/cosmosdb_ui.py中使用）
-        
-        查询数据库中所有commit的时间，按时间升序排列，
-        用于时间筛选功能。
-        
+        按时间升序逐个返回不重复的commit时间（生成器，仅在archived/cosmosdb_ui.py中使用）
+
+        去重和排序在服务端完成（SELECT DISTINCT VALUE ... ORDER BY），按页读取。
+
+        Yields:
+            str: commit时间
+        """
+        query = "SELECT DISTINCT VALUE c.commit_time FROM c WHERE IS_DEFINED(c.commit_time) ORDER BY c.commit_time ASC"
+        for commit_time in self.iter_query("get_commit_time_list", query, enable_cross_partition_query=True):
+            yield str(commit_time)
+
+    def get_commit_time_range(self):
+        """
+        最早和最晚的commit时间（两个服务端 MIN/MAX 聚合，仅在archived/cosmosdb_ui.py中使用）
+
         Returns:
-            list: commit时间列表，如果没有则返回None
+            tuple/None: (最早时间, 最晚时间)，没有记录时返回None
         """
-        # 查询所有commit时间，按时间升序排列
-        query = f"SELECT c.commit_time FROM c ORDER BY c.commit_time ASC"  
-        
-        value_list = []  
-        message = list(self.container_client.query_items(query=query, enable_cross_partition_query=True))
-        if len(message) == 0:
-            return None
-        
-        # 去重处理，构建唯一时间列表
-        for item in message:
-            if item == {}:
-                continue
-            if str(item["commit_time"]) not in value_list: 
-                value_list.append(str(item["commit_time"])) 
-        return value_list
+        bounds = []
+        for aggregate in ("MIN", "MAX"):
+            values = self._query(f"get_commit_time_range.{aggregate.lower()}",
+                                 f"SELECT VALUE {aggregate}(c.commit_time) FROM c WHERE IS_DEFINED(c.commit_time)",
+                                 enable_cross_partition_query=True)
+            if not values or values[0] is None:
+                return None
+            bounds.append(str(values[0]))
+        return tuple(bounds)
 
     def get_current_select(self, topic, language, status, tag, post, start_time, end_time):
         """
@@ -751,10 +1030,8 @@ class CosmosConversationClient:
         
         # 执行查询
         try:  
-            results = list(self.container_client.query_items(  
-                query=query,
-                enable_cross_partition_query=True  
-            ))  
+            # 跨主题统计，只能跨分区查询
+            results = self._query("get_timestamp", query, enable_cross_partition_query=True)
             print(results)
         except exceptions.CosmosHttpResponseError as e:  
             print(f"查询时发生错误: {e.message}")
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark: weekly summary prompt assembly on a synthetic 1,000-commit week.
+
+Compares the previous approach (re-encode the whole growing prompt after
+every commit, with `tiktoken.get_encoding` per call and `list.index`) with
+`CallGPT.generate_weekly_summary_using_weekly_commit_list`, which encodes each
+entry once with a cached encoder and keeps a running total.
+
+Run from the repo root: `python examples/bench_weekly_prompt_assembly.py [commits]`
+The GPT call itself is stubbed out; only prompt assembly is timed.
+"""
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import tiktoken
+
+import call_gpt
+import token_utils
+from call_gpt import CallGPT
+
+SYSTEM_PROMPT = "You are a technical writer summarizing a week of documentation updates. " * 5
+INIT_PROMPT = "Here are the document titles and summaries for this week's updates from Microsoft Learn:\n\n"
+END_PROMPT = "Please format the updates in a numbered list, with each entry containing the title tag, title, summary, and link, prioritized by their significance with the most important updates at the top."
+MAX_INPUT_TOKEN = 10_000_000  # large enough that every commit is included by both versions
+
+
+def synthetic_week(commits):
+    return [
+        {
+            "gpt_title_response": f"1 [Update] Article {i}: new configuration options for feature {i % 37}",
+            "gpt_summary_response": (
+                f"The article about feature {i % 37} now documents the `setting_{i}` option, "
+                "updates the prerequisites section and adds a troubleshooting table. "
+                f"See https://learn.microsoft.com/en-us/azure/feature-{i % 37}/article-{i}."
+            ),
+        }
+        for i in range(commits)
+    ]
+
+
+def legacy_assembly(weekly_commit_list):
+    """The previous loop: O(n^2) tokens encoded."""
+    init_prompt = INIT_PROMPT
+    for commit in weekly_commit_list:
+        title_response = commit["gpt_title_response"]
+        summary_response = commit["gpt_summary_response"]
+        init_prompt += f"{title_response[2:]}\n\n{summary_response}\n\n"
+        encoding = tiktoken.get_encoding("cl100k_base")
+        used_tokens = len(encoding.encode(SYSTEM_PROMPT + init_prompt + END_PROMPT))
+        if used_tokens > MAX_INPUT_TOKEN:
+            weekly_commit_list.index(commit)
+            break
+    return init_prompt + END_PROMPT
+
+
+def current_assembly(weekly_commit_list):
+    captured = {}
+
+    def fake_gpt(messages, max_tokens=None):
+        captured["prompt"] = messages[1]["content"]
+        return "summary", 0, 0, 0
+
+    with patch.object(call_gpt, "get_gpt_response", fake_gpt):
+        CallGPT().generate_weekly_summary_using_weekly_commit_list("English", weekly_commit_list, SYSTEM_PROMPT, MAX_INPUT_TOKEN)
+    return captured["prompt"]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    commits = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    week = synthetic_week(commits)
+
+    if token_utils.get_encoding() is None:
+        print("cl100k_base could not be loaded (offline?); only the approximate counter is available.")
+        _, seconds = timed(current_assembly, week)
+        print(f"incremental assembly, {commits} commits: {seconds * 1000:.1f} ms")
+        return
+
+    legacy_prompt, legacy_seconds = timed(legacy_assembly, week)
+    current_prompt, current_seconds = timed(current_assembly, week)
+    assert legacy_prompt == current_prompt, "both versions must build the same prompt"
+    print(f"commits: {commits}, prompt tokens: {token_utils.count_tokens(current_prompt)}")
+    print(f"re-encode whole prompt per commit: {legacy_seconds * 1000:9.1f} ms")
+    print(f"encode each entry once:            {current_seconds * 1000:9.1f} ms")
+    print(f"speedup: {legacy_seconds / current_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,37 @@ import json
 import time  
 import toml  
 import datetime
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv  
-from threading import Thread
+from threading import Thread, Lock
 
   
 from logs import logger  
 from gpt_reply import *  
 from spyder import *  
+from github_cache import commit_list_validators, commit_details_cache
+from github_http import github_rate_limit
+from llm_cache import response_cache
+from cosmosdb_client import CosmosDBHandler
+from commit_history_writer import commit_history_writer
+from teams_outbox import teams_outbox
+from cosmosdbservice import request_charges
+from repo_crawl import SHARED_REPO_CRAWL, SharedRepoCrawl, group_targets_by_stream
+from scheduler import ADAPTIVE_SCHEDULER, AdaptiveScheduler
+from webhook_receiver import GITHUB_WEBHOOK_ENABLED, WebhookReceiver, WebhookRouter
 
 load_dotenv(override=True)  # 允许覆盖环境变量
+
+# 并行处理的目标数量，1 表示逐个处理
+MAX_PARALLEL_TARGETS = int(os.getenv("MAX_PARALLEL_TARGETS", 4))
+# 单个目标的处理超时时间（秒），0 表示不限制
+TARGET_TIMEOUT_SECONDS = int(os.getenv("TARGET_TIMEOUT_SECONDS", 3600))
+
+# 正在处理中的目标，防止上一轮超时仍在运行的目标被重复提交
+_running_targets = set()
+_running_targets_lock = Lock()
   
 def load_system_prompts(target):  
     """
@@ -39,81 +61,383 @@ def load_targets_config():
     with open('target_config.json', 'r') as f:  
         return json.load(f)  
   
-def process_targets(targets):
+def target_key(target):
     """
-    根據target_config.json的目標依次爬取更新並總結推送至teams的channel
-    並在每週一推送一次上週更新總結
+    用 (topic, language, root_commits_url) 标识一个目标，与CosmosDB中commit记录的查询条件保持一致
     """
-    for target in targets:  
+    return (target['topic_name'], target['language'], target['root_commits_url'])
 
-        try:
-                
-            topic = target['topic_name']  
-            root_commits_url = target['root_commits_url']  
-            language = target['language']  
-            teams_webhook_url = target.get('teams_webhook_url', None)
-            system_prompts = load_system_prompts(target)
-
-            if target.get("show_topic_in_title", "False") in ("True", "true"):
-                show_topic_in_title = True
-            else:
-                show_topic_in_title = False
-            
+def process_target(target, deadline=None, start_time=None, prefetched_commits=None):
+    """
+    处理单个目标：爬取更新、总结推送，并检查是否需要推送上周总结
+    同一个目标内的commit仍按时间顺序依次处理，周总结检查在commit处理完成后进行
 
-            if target.get("push_summary", "False") in ("True", "true"):
-                show_weekly_summary = True
-            else:
-                show_weekly_summary = False
-            
-            url_mapping = target.get("url_mapping", None)
-            
-            # 获取 GPT 分析模式配置，默认为 legacy 模式确保向后兼容
-            gpt_analysis_mode = target.get("gpt_analysis_mode", "legacy")
-
-            logger.warning(f"========================= Start to process topic: {topic} =========================")  
-            logger.info(f"show_topic_in_title: {show_topic_in_title}, show_weekly_summary: {show_weekly_summary}")  
-            logger.info(f"gpt_analysis_mode: {gpt_analysis_mode}")  # 记录使用的分析模式  
-
-            logger.info(f"Root commits url: {root_commits_url}")  
-            logger.info(f"Language: {language}")  
-            if teams_webhook_url:
-                logger.info(f"Teams webhook url: {teams_webhook_url}") 
-            else:
-                logger.info("No Teams webhook url provided, skipping Teams notifications")
-            logger.warning(f"url_mapping: {url_mapping}")  
+    Args:
+        target (dict): target_config.json中的一项配置
+        deadline (float): time.monotonic()下的截止时间，超时后不再处理剩余commit和周总结
+        start_time (datetime): 共享仓库抓取时已确定的起始时间
+        prefetched_commits (dict): 共享仓库抓取分配给该目标的commit，None表示自行抓取
+
+    Returns:
+        tuple: (本次发现的新commit数, 起始时间点)，供自适应调度估计该目标的commit频率
+    """
+    topic = target['topic_name']  
+    root_commits_url = target['root_commits_url']  
+    language = target['language']  
+    teams_webhook_url = target.get('teams_webhook_url', None)
+    system_prompts = load_system_prompts(target)
+
+    if target.get("show_topic_in_title", "False") in ("True", "true"):
+        show_topic_in_title = True
+    else:
+        show_topic_in_title = False
     
 
-            # 最后一个参数是 max_input_token 30000 
-            git_spyder = Spyder(topic, root_commits_url, language, teams_webhook_url, show_topic_in_title, system_prompts, 30000, gpt_analysis_mode)  
-            # all_commits = git_spyder.get_all_commits()  
-            # selected_commits, latest_crawl_time = git_spyder.select_latest_commits(all_commits)  
-            git_spyder.process_commits(git_spyder.latest_commits, url_mapping)  
+    if target.get("push_summary", "False") in ("True", "true"):
+        show_weekly_summary = True
+    else:
+        show_weekly_summary = False
     
-            if show_weekly_summary:
-                # 检查是否已经存在本周的summary
-                this_week_summary = git_spyder.cosmosDB_client.check_weekly_summary(topic, language, root_commits_url)  
-
-                # 获取当前时间
-                now = datetime.datetime.now()
-                # 计算从午夜到现在的秒数
-                seconds_since_midnight = (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()    
-                
-                # 在以下两种情况下生成weekly summary：
-                # 1. 如果是周一(weekday==0)且在   git_spyder.schedule 现在设的是7200秒（2小时） 也就是只有周一的0点到2点之间才会生成weekly summary
-                # 2. 或者没有找到本周的summary
-                if (now.weekday() == 0 and seconds_since_midnight < git_spyder.schedule) or this_week_summary is None:  
-                    git_spyder.generate_weekly_summary()
+    url_mapping = target.get("url_mapping", None)
     
-            logger.warning(f"Finish processing topic: {topic}")  
-        except Exception as e:  
-            logger.exception("Unexpected exception:", e) 
-    return git_spyder.schedule
+    # 获取 GPT 分析模式配置，默认为 legacy 模式确保向后兼容
+    gpt_analysis_mode = target.get("gpt_analysis_mode", "legacy")
+
+    logger.warning(f"========================= Start to process topic: {topic} =========================")  
+    logger.info(f"show_topic_in_title: {show_topic_in_title}, show_weekly_summary: {show_weekly_summary}")  
+    logger.info(f"gpt_analysis_mode: {gpt_analysis_mode}")  # 记录使用的分析模式  
+
+    logger.info(f"Root commits url: {root_commits_url}")  
+    logger.info(f"Language: {language}")  
+    if teams_webhook_url:
+        logger.info(f"Teams webhook url: {teams_webhook_url}") 
+    else:
+        logger.info("No Teams webhook url provided, skipping Teams notifications")
+    logger.warning(f"url_mapping: {url_mapping}")  
+
+
+    # 最后一个参数是 max_input_token 30000 
+    git_spyder = Spyder(topic, root_commits_url, language, teams_webhook_url, show_topic_in_title, system_prompts, 30000, gpt_analysis_mode, deadline=deadline, start_time=start_time, prefetched_commits=prefetched_commits)  
+    # all_commits = git_spyder.get_all_commits()  
+    # selected_commits, latest_crawl_time = git_spyder.select_latest_commits(all_commits)  
+    git_spyder.process_commits(git_spyder.latest_commits, url_mapping)  
+    # 等待排队中的commit记录写入CosmosDB，周总结查询需要看到本目标刚处理的commit
+    commit_history_writer.flush()
+
+    if show_weekly_summary:
+        if git_spyder.deadline_exceeded():
+            # 超时的目标跳过周总结检查，下一轮再处理
+            logger.warning(f"Target timeout reached, skip weekly summary check for topic: {topic}")
+        else:
+            # 检查是否已经存在本周的summary
+            has_weekly_summary = git_spyder.has_weekly_summary()
+
+            # 获取当前时间
+            now = datetime.datetime.now()
+            # 计算从午夜到现在的秒数
+            seconds_since_midnight = (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()    
+            
+            # 在以下两种情况下生成weekly summary：
+            # 1. 如果是周一(weekday==0)且在   git_spyder.schedule 现在设的是7200秒（2小时） 也就是只有周一的0点到2点之间才会生成weekly summary
+            #    （自适应调度下同一目标在这段时间内可能被处理多次，只按第2条判断，避免重复生成）
+            # 2. 或者没有找到本周的summary
+            monday_window = not (ADAPTIVE_SCHEDULER or GITHUB_WEBHOOK_ENABLED) and now.weekday() == 0 and seconds_since_midnight < git_spyder.schedule
+            if monday_window or not has_weekly_summary:  
+                git_spyder.generate_weekly_summary()
+
+    logger.warning(f"Finish processing topic: {topic}")  
+    return len(git_spyder.latest_commits), git_spyder.start_time
+
+def _run_target(target, submitted_at, start_time=None, prefetched_commits=None):
+    """
+    线程池中执行单个目标，记录排队等待时间和实际处理耗时，异常不会影响其他目标
+
+    Returns:
+        tuple: (排队时间, 处理耗时, process_target 的返回值；出错时为None)
+    """
+    started_at = time.monotonic()
+    queue_wait = started_at - submitted_at
+    deadline = started_at + TARGET_TIMEOUT_SECONDS if TARGET_TIMEOUT_SECONDS > 0 else None
+    polled = None
+    try:
+        polled = process_target(target, deadline, start_time, prefetched_commits)
+    except Exception as e:  
+        logger.exception("Unexpected exception:", e) 
+    finally:
+        wall_time = time.monotonic() - started_at
+        logger.info(f"[target pool] topic: {target.get('topic_name')}, queue_wait: {queue_wait:.1f}s, wall_time: {wall_time:.1f}s")
+        with _running_targets_lock:
+            _running_targets.discard(target_key(target))
+    return queue_wait, wall_time, polled
+
+def crawl_shared_stream(stream_url, members, cosmosDB=None, cosmosDB_client=None):
+    """
+    抓取一个仓库commit流并按文件路径分配给其中的目标（在调用线程中执行，不等待其他任务）
+
+    Args:
+        stream_url (str): 目标共享的commit列表URL（见 commit_stream_url）
+        members (list): 读取该commit流的目标
+        cosmosDB / cosmosDB_client: 用于读取各目标的起始时间，未传入时新建
+
+    Returns:
+        dict: target_key -> (start_time, prefetched_commits)；共享抓取失败时为空，目标自行抓取
+    """
+    if cosmosDB is None:
+        cosmosDB = CosmosDBHandler()
+        cosmosDB_client = cosmosDB.initialize_cosmos_client()
+    headers = {"Authorization": "token " + PERSONAL_TOKEN}
+    start_times = {
+        target_key(t): cosmosDB.get_target_start_time(cosmosDB_client, t['topic_name'], t['language'], t['root_commits_url'])
+        for t in members
+    }
+    member_urls = {target_key(t): t['root_commits_url'] for t in members}
+    crawl = SharedRepoCrawl(stream_url, member_urls, start_times, headers)
+    try:
+        routed = crawl.route()
+    except Exception as e:
+        logger.exception(f"Shared crawl of {stream_url} failed, targets will crawl on their own:", e)
+        return {}
+    if routed is None:
+        return {}
+    return {key: (start_times[key], commits) for key, commits in routed.items()}
+
+def plan_shared_crawls(targets, executor):
+    """
+    共享仓库抓取（SHARED_REPO_CRAWL）：监控同一仓库（同一分支）的多个目标只请求一次commit列表，
+    再按文件路径把commit分配给各目标，GitHub请求数随仓库数而不是主题数增长。
+
+    Args:
+        targets (list): 本轮要处理的目标
+        executor (ThreadPoolExecutor): 目标线程池，各仓库的抓取并行执行
+
+    Returns:
+        dict: target_key -> (start_time, prefetched_commits)；
+              未参与共享抓取或共享抓取失败的目标不在其中，由目标自行抓取
+    """
+    if not SHARED_REPO_CRAWL:
+        return {}
+    groups = group_targets_by_stream(targets)
+    if not groups:
+        return {}
+
+    cosmosDB = CosmosDBHandler()
+    cosmosDB_client = cosmosDB.initialize_cosmos_client()
+    crawls = {
+        executor.submit(crawl_shared_stream, stream_url, members, cosmosDB, cosmosDB_client): stream_url
+        for stream_url, members in groups.items()
+    }
+
+    plan = {}
+    for future, stream_url in crawls.items():
+        try:
+            plan.update(future.result(timeout=TARGET_TIMEOUT_SECONDS if TARGET_TIMEOUT_SECONDS > 0 else None))
+        except Exception as e:
+            logger.exception(f"Shared crawl of {stream_url} failed, targets will crawl on their own:", e)
+    logger.warning(f"[shared crawl] {len(groups)} repo streams, {len(plan)} targets served from shared crawls")
+    return plan
+
+def process_targets(targets):
+    """
+    根據target_config.json的目標並行爬取更新並總結推送至teams的channel
+    並在每週一推送一次上週更新總結
+
+    并行度由 MAX_PARALLEL_TARGETS 控制（1 即退化为原来的逐个处理），
+    单个目标的超时时间由 TARGET_TIMEOUT_SECONDS 控制。
+    超时后不再等待该目标，它会在处理完当前commit后自行停止；
+    仍在运行中的目标在下一轮会被跳过，避免同一目标被重复处理。
+    """
+    cycle_start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, MAX_PARALLEL_TARGETS), thread_name_prefix="target")
+    runnable = []
+    for target in targets:
+        key = target_key(target)
+        with _running_targets_lock:
+            if key in _running_targets:
+                logger.warning(f"Topic {target.get('topic_name')} is still running from the previous cycle, skip it")
+                continue
+            _running_targets.add(key)
+        runnable.append(target)
+
+    shared_plan = {}
+    try:
+        shared_plan = plan_shared_crawls(runnable, executor)
+    except Exception as e:
+        logger.exception("Failed to plan shared crawls, every target crawls on its own:", e)
+
+    futures = {}
+    for target in runnable:
+        start_time, prefetched_commits = shared_plan.get(target_key(target), (None, None))
+        futures[executor.submit(_run_target, target, time.monotonic(), start_time, prefetched_commits)] = target
+
+    # 所有目标都已提交，这里的等待上限是：排队时间 + 单目标超时；给一个宽松的总上限，避免卡死整个循环
+    overall_timeout = None
+    if TARGET_TIMEOUT_SECONDS > 0:
+        rounds = -(-len(futures) // max(1, MAX_PARALLEL_TARGETS))
+        overall_timeout = rounds * TARGET_TIMEOUT_SECONDS + 60
+    done, not_done = wait(futures, timeout=overall_timeout)
+    for future in not_done:
+        logger.error(f"Topic {futures[future].get('topic_name')} did not finish within the timeout, leave it running in background")
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = [future.result() for future in done]
+    if results:
+        queue_waits, wall_times, _ = zip(*results)
+        logger.warning(
+            f"[target pool] cycle finished: {len(done)}/{len(futures)} targets, workers: {MAX_PARALLEL_TARGETS}, "
+            f"cycle_time: {time.monotonic() - cycle_start:.1f}s, max_wall_time: {max(wall_times):.1f}s, "
+            f"max_queue_wait: {max(queue_waits):.1f}s"
+        )
+
+    log_cycle_stats()
+    return Spyder.schedule
+
+def log_cycle_stats():
+    """
+    输出并重置各缓存、写入缓冲、RU和GitHub配额的统计（固定调度每轮一次，自适应调度每小时一次）
+    """
+    # 每轮输出commit列表条件请求的命中情况（304 不消耗GitHub API配额）
+    etag_stats = commit_list_validators.stats(reset=True)
+    logger.warning(f"[github etag cache] hits: {etag_stats['hits']}, misses: {etag_stats['misses']}, entries: {etag_stats['entries']}")
+    detail_stats = commit_details_cache.stats(reset=True)
+    logger.warning(f"[commit detail cache] hits: {detail_stats['hits']}, misses: {detail_stats['misses']}, shared downloads: {detail_stats['shared']}")
+    gpt_cache_stats = response_cache.stats(reset=True)
+    logger.warning(f"[gpt response cache] hits: {gpt_cache_stats['hits']}, misses: {gpt_cache_stats['misses']}, stores: {gpt_cache_stats['stores']}")
+    writer_stats = commit_history_writer.stats(reset=True)
+    if commit_history_writer.enabled:
+        logger.warning(
+            f"[commit history writer] written: {writer_stats['written']}, failed attempts: {writer_stats['failed']}, "
+            f"queued: {writer_stats['queued']}, in spill file: {writer_stats['spilled']}"
+        )
+    outbox_stats = teams_outbox.stats(reset=True)
+    if teams_outbox.enabled:
+        logger.warning(
+            f"[teams outbox] delivered: {outbox_stats['delivered']}, retried: {outbox_stats['retried']}, "
+            f"failed: {outbox_stats['failed']}, pending: {outbox_stats['pending']}"
+        )
+    ru_stats = request_charges.stats(reset=True)
+    if ru_stats:
+        logger.warning("[cosmos RU] " + ", ".join(f"{name}: {v['ru']} RU / {v['calls']} calls" for name, v in sorted(ru_stats.items())))
+    quota_stats = github_rate_limit.stats(reset=True)
+    logger.warning(
+        f"[github quota] requests: {quota_stats['requests']}, remaining: {quota_stats['remaining']}/{quota_stats['limit']}, "
+        f"reset_at: {quota_stats['reset_at']}, paused: {quota_stats['paused_seconds']}s"
+    )
+
+def _first_poll_window(start_time):
+    """
+    首次轮询时新commit的到达时间窗口：从起始时间点（上次处理到的commit）到现在，至少一个默认周期
+    """
+    try:
+        return max((datetime.datetime.utcnow() - start_time).total_seconds(), Spyder.schedule)
+    except Exception:
+        return None
+
+def run_adaptive(targets, scheduler=None, stats_interval=3600):
+    """
+    自适应调度（ADAPTIVE_SCHEDULER）：每个目标有自己的下次轮询时间，到期即提交到线程池，
+    轮询间隔按该目标的commit频率调整，总轮询次数不超过固定调度（每 Spyder.schedule 秒全部轮询一次）的预算。
+    开启 GITHUB_WEBHOOK_ENABLED 时，push webhook 涉及的目标会立即到期，定时轮询作为兜底。
+    """
+    keys = {target_key(t): t for t in targets}
+    scheduler = scheduler or AdaptiveScheduler(keys, Spyder.schedule)
+    executor = ThreadPoolExecutor(max_workers=max(1, MAX_PARALLEL_TARGETS), thread_name_prefix="target")
+    finished = queue.Queue()
+    polls = 0
+    polled_once = set()
+    last_stats = time.monotonic()
+
+    def on_done(key, future):
+        try:
+            _, _, polled = future.result()
+        except Exception:
+            polled = None
+        finished.put((key, polled))
+
+    def submit(target, submitted_at, start_time=None, prefetched_commits=None):
+        key = target_key(target)
+        future = executor.submit(_run_target, target, submitted_at, start_time, prefetched_commits)
+        future.add_done_callback(lambda f: on_done(key, f))
+
+    def run_shared_group(stream_url, members, submitted_at):
+        # 共享抓取和成员目标的提交在同一个任务中完成，调度循环不等待任何future
+        plan = {}
+        try:
+            plan = crawl_shared_stream(stream_url, members)
+        except Exception as e:
+            logger.exception(f"Shared crawl of {stream_url} failed, targets will crawl on their own:", e)
+        finally:
+            for target in members:
+                submit(target, submitted_at, *plan.get(target_key(target), (None, None)))
+
+    def on_webhook(affected):
+        for key in affected:
+            scheduler.trigger(key)
+        finished.put(None)  # 唤醒调度循环
+
+    if GITHUB_WEBHOOK_ENABLED:
+        WebhookReceiver(WebhookRouter(targets, key=target_key), on_webhook).start()
+
+    while True:
+        due = []
+        for key in scheduler.pop_due():
+            with _running_targets_lock:
+                if key in _running_targets:
+                    # 超时后仍在后台运行的目标：结束后再重新排期
+                    logger.warning(f"Topic {keys[key].get('topic_name')} is still running, poll it later")
+                    finished.put((key, None))
+                    continue
+                _running_targets.add(key)
+            due.append(keys[key])
+
+        if due:
+            submitted_at = time.monotonic()
+            groups = group_targets_by_stream(due) if SHARED_REPO_CRAWL else {}
+            grouped = {target_key(t) for members in groups.values() for t in members}
+            for stream_url, members in groups.items():
+                executor.submit(run_shared_group, stream_url, members, submitted_at)
+            for target in due:
+                if target_key(target) not in grouped:
+                    submit(target, submitted_at)
+            polls += len(due)
+
+        # 等到下一个目标到期、有目标处理完成需要重新排期，或webhook触发了目标
+        timeout = scheduler.seconds_until_next()
+        try:
+            item = finished.get(timeout=timeout)
+            while True:
+                if item is None:
+                    item = finished.get_nowait()
+                    continue
+                key, polled = item
+                new_commits, window = 0, None
+                if polled is not None:
+                    new_commits, start_time = polled
+                    if key not in polled_once:
+                        window = _first_poll_window(start_time)
+                    polled_once.add(key)
+                interval = scheduler.record(key, new_commits, window)
+                logger.info(f"[scheduler] topic: {keys[key].get('topic_name')}, new commits: {new_commits}, next poll in {interval:.0f}s")
+                item = finished.get_nowait()
+        except queue.Empty:
+            pass
+
+        if time.monotonic() - last_stats >= stats_interval:
+            logger.warning(f"[scheduler] polls in the last {stats_interval}s: {polls}, intervals: {scheduler.snapshot()}")
+            log_cycle_stats()
+            polls = 0
+            last_stats = time.monotonic()
 
 def main():
     """
-    以循環方式固定時間爬取一次檢測是否有文檔更新
+    以循環方式固定時間爬取一次檢測是否有文檔更新；
+    开启 ADAPTIVE_SCHEDULER 或 GITHUB_WEBHOOK_ENABLED 时改为按各目标的commit频率自适应轮询
     """
     targets = load_targets_config()  
+    # 投递上次运行时未发送完的Teams消息
+    teams_outbox.start()
+
+    if ADAPTIVE_SCHEDULER or GITHUB_WEBHOOK_ENABLED:
+        run_adaptive(targets)
   
     while True:  
         try:  
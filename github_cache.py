@@ -0,0 +1,312 @@
+"""
+On-disk caches for GitHub API responses.
+
+ValidatorCache
+--------------
+Stores HTTP validators (``ETag`` / ``Last-Modified``) per request URL so the
+next identical request can be sent as a conditional request
+(``If-None-Match`` / ``If-Modified-Since``). GitHub answers ``304 Not
+Modified`` without a body when nothing changed, and 304 responses do not
+count against the rate limit.
+
+Only responses that carried *no new commits* are recorded. The commit-list
+URL contains ``since=<start_time>``, so it only repeats when the previous
+cycle found nothing new; a 304 for it therefore means "still nothing new"
+and can be skipped without parsing anything. A response that did contain
+new commits is never cached, so a crash before those commits are processed
+can not hide them behind a 304 in the next cycle.
+
+CommitDetailCache
+-----------------
+Commit objects are immutable, so the ``files`` payload of
+``/repos/<owner>/<repo>/commits/<sha>`` can be cached forever under
+``<cache_dir>/<owner>__<repo>/<sha>.json.gz``. Retried runs, reprocessed
+topics and targets watching overlapping paths of the same repo all read
+the same file. Concurrent requests for the same commit are coalesced
+(single-flight), so overlapping targets share one download per commit.
+The directory is bounded by ``max_bytes``; the least recently used files
+are evicted first (hits refresh the file's mtime).
+"""
+import gzip
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from logs import logger
+
+
+# Persistent cache file location; kept alongside `last_crawl_time.txt`.
+DEFAULT_VALIDATOR_CACHE_PATH = os.getenv("GITHUB_ETAG_CACHE_PATH", "github_etag_cache.json")
+DEFAULT_COMMIT_CACHE_DIR = os.getenv("COMMIT_CACHE_DIR", "commit_cache")
+DEFAULT_COMMIT_CACHE_MAX_BYTES = int(os.getenv("COMMIT_CACHE_MAX_MB", 512)) * 1024 * 1024
+
+# https://api.github.com/repos/<owner>/<repo>/commits/<sha>
+COMMIT_API_URL_RE = re.compile(r"^https://api\.github\.com/repos/([^/]+)/([^/]+)/commits/([0-9a-fA-F]{7,40})/?$")
+
+
+def parse_commit_api_url(commit_url: str) -> Optional[tuple]:
+    """Return ``("<owner>/<repo>", "<sha>")`` for a commit API URL, else None."""
+    match = COMMIT_API_URL_RE.match(commit_url or "")
+    if not match:
+        return None
+    return f"{match.group(1)}/{match.group(2)}", match.group(3).lower()
+
+
+class ValidatorCache:
+    """URL -> {"etag": ..., "last_modified": ...} with hit/miss counters."""
+
+    def __init__(self, cache_path: Optional[str] = DEFAULT_VALIDATOR_CACHE_PATH, max_entries: int = 2000):
+        self._cache_path = cache_path
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._load()
+
+    # -- persistence ----------------------------------------------------------
+
+    def _load(self) -> None:
+        if not self._cache_path or not os.path.exists(self._cache_path):
+            return
+        try:
+            with open(self._cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for url, validators in data.items():
+                    if isinstance(url, str) and isinstance(validators, dict):
+                        self._entries[url] = validators
+            logger.info(f"ValidatorCache: loaded {len(self._entries)} entries from {self._cache_path}")
+        except Exception as exc:
+            logger.warning(f"ValidatorCache: cache load failed ({exc}); ignoring")
+
+    def _persist(self) -> None:
+        if not self._cache_path:
+            return
+        try:
+            with self._lock:
+                snapshot = dict(self._entries)
+            tmp_path = f"{self._cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._cache_path)
+        except Exception as exc:
+            logger.warning(f"ValidatorCache: cache persist failed ({exc})")
+
+    # -- public API -----------------------------------------------------------
+
+    def conditional_headers(self, url: str, headers: dict) -> dict:
+        """Return a copy of ``headers`` with the stored validators for ``url``."""
+        with self._lock:
+            validators = self._entries.get(url)
+            if validators is not None:
+                self._entries.move_to_end(url)
+        conditional = dict(headers or {})
+        if validators:
+            if validators.get("etag"):
+                conditional["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                conditional["If-Modified-Since"] = validators["last_modified"]
+        return conditional
+
+    def store(self, url: str, response) -> None:
+        """Remember the validators of ``response`` for ``url``."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            self._entries[url] = {"etag": etag, "last_modified": last_modified}
+            self._entries.move_to_end(url)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        self._persist()
+
+    def discard(self, url: str) -> None:
+        with self._lock:
+            removed = self._entries.pop(url, None)
+        if removed is not None:
+            self._persist()
+
+    def record(self, not_modified: bool) -> None:
+        """Count a 304 as a hit, anything else as a miss."""
+        with self._lock:
+            if not_modified:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._lock:
+            result = {"hits": self._hits, "misses": self._misses, "entries": len(self._entries)}
+            if reset:
+                self._hits = 0
+                self._misses = 0
+        return result
+
+
+class CommitDetailCache:
+    """repo+SHA -> list of changed files, stored as gzip-compressed JSON."""
+
+    def __init__(self, cache_dir: Optional[str] = DEFAULT_COMMIT_CACHE_DIR, max_bytes: int = DEFAULT_COMMIT_CACHE_MAX_BYTES):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> Event set when the in-flight download finishes
+        self._in_flight = {}
+        # key -> files, for commits whose download finished in this process
+        # but could not be written to disk (or caching to disk is disabled)
+        self._memory = OrderedDict()
+        self._total_bytes = None
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+
+    # -- disk layout ----------------------------------------------------------
+
+    def _path(self, key: tuple) -> Optional[str]:
+        if not self._cache_dir:
+            return None
+        repo, sha = key
+        return os.path.join(self._cache_dir, repo.replace("/", "__"), f"{sha}.json.gz")
+
+    def _read(self, key: tuple):
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                files = json.load(f)
+            os.utime(path)  # LRU: refresh mtime on hit
+            return files
+        except Exception as exc:
+            logger.warning(f"CommitDetailCache: failed to read {path} ({exc}); refetching")
+            return None
+
+    def _write(self, key: tuple, files) -> None:
+        path = self._path(key)
+        if not path:
+            self._remember(key, files)
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(files, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as exc:
+            logger.warning(f"CommitDetailCache: failed to write {path} ({exc})")
+            self._remember(key, files)
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        self._evict_if_needed()
+
+    def _remember(self, key: tuple, files) -> None:
+        with self._lock:
+            self._memory[key] = files
+            while len(self._memory) > 256:
+                self._memory.popitem(last=False)
+
+    def _evict_if_needed(self) -> None:
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self._max_bytes:
+                return
+        entries = []
+        for root, _, names in os.walk(self._cache_dir):
+            for name in names:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self._max_bytes:
+            # Evict down to 90% so we do not rescan on every write.
+            target = self._max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError:
+                    continue
+        with self._lock:
+            self._total_bytes = total
+        if evicted:
+            logger.info(f"CommitDetailCache: evicted {evicted} files, size now {total / 1024 / 1024:.1f} MB")
+
+    # -- public API -----------------------------------------------------------
+
+    def get_files(self, commit_url: str, fetch: Callable[[], Optional[list]]) -> Optional[list]:
+        """Return the cached ``files`` list for ``commit_url``, calling
+        ``fetch()`` at most once per commit across all threads when it is
+        not cached. ``fetch`` returning None (request failed) is not cached."""
+        key = parse_commit_api_url(commit_url)
+        if key is None:
+            return fetch()
+
+        while True:
+            files = self._read(key)
+            if files is not None:
+                with self._lock:
+                    self._hits += 1
+                return files
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    owner = True
+                else:
+                    owner = False
+                    self._shared += 1
+            if owner:
+                break
+            # Another target is downloading this commit right now; wait for it
+            # and then read the result from the cache.
+            event.wait()
+            files = self._read(key)
+            if files is not None:
+                return files
+            # The other download failed; try ourselves.
+
+        try:
+            with self._lock:
+                self._misses += 1
+            files = fetch()
+            if files is not None:
+                self._write(key, files)
+            return files
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._lock:
+            result = {"hits": self._hits, "misses": self._misses, "shared": self._shared}
+            if reset:
+                self._hits = 0
+                self._misses = 0
+                self._shared = 0
+        return result
+
+
+# Shared by every CommitFetcher in the process.
+commit_list_validators = ValidatorCache()
+commit_details_cache = CommitDetailCache()
@@ -0,0 +1,146 @@
+"""
+Shared HTTP plumbing for GitHub REST API calls.
+
+* One keep-alive ``requests.Session`` with a connection pool sized for the
+  target/commit worker pools, so calls reuse TCP+TLS connections instead of
+  paying a new handshake per request.
+* A process-wide ``RateLimitGate`` that reads GitHub's rate-limit headers
+  from every response. When the remaining quota drops to
+  ``GITHUB_RATE_LIMIT_RESERVE`` or below, *every* caller (all targets) pauses
+  until ``X-RateLimit-Reset`` instead of each thread burning retries.
+* ``retry_delay`` honours ``Retry-After`` (secondary rate limits) and the
+  primary reset time, falling back to capped exponential backoff with jitter.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logs import logger
+
+
+GITHUB_HTTP_POOL_SIZE = int(os.getenv("GITHUB_HTTP_POOL_SIZE", 20))
+GITHUB_REQUEST_TIMEOUT_SECONDS = int(os.getenv("GITHUB_REQUEST_TIMEOUT_SECONDS", 30))
+# Pause all GitHub calls when the remaining quota falls to this value.
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 50))
+# Never sleep longer than this for a single retry / pause (GitHub resets hourly).
+GITHUB_MAX_BACKOFF_SECONDS = int(os.getenv("GITHUB_MAX_BACKOFF_SECONDS", 3600))
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GITHUB_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+github_session = _build_session()
+
+
+def is_rate_limited(response) -> bool:
+    """True for GitHub primary/secondary rate-limit responses."""
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    if response.headers.get("Retry-After") or response.headers.get("X-RateLimit-Remaining") == "0":
+        return True
+    return "rate limit" in (response.text or "").lower()
+
+
+def is_retryable(response) -> bool:
+    return response.status_code >= 500 or is_rate_limited(response)
+
+
+class RateLimitGate:
+    """Tracks GitHub quota across all threads and pauses callers globally."""
+
+    def __init__(self, reserve: int = GITHUB_RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._pause_until = 0.0
+        self._remaining = None
+        self._limit = None
+        self._reset_at = None
+        self._requests = 0
+        self._paused_seconds = 0.0
+
+    def wait_if_paused(self) -> float:
+        """Block while a global pause is in effect. Returns seconds waited."""
+        with self._lock:
+            wait_seconds = self._pause_until - time.time()
+        if wait_seconds <= 0:
+            return 0.0
+        wait_seconds = min(wait_seconds, GITHUB_MAX_BACKOFF_SECONDS)
+        logger.warning(f"GitHub rate limit pause: waiting {wait_seconds:.0f}s before next request")
+        time.sleep(wait_seconds)
+        with self._lock:
+            self._paused_seconds += wait_seconds
+        return wait_seconds
+
+    def pause_until(self, timestamp: float) -> None:
+        with self._lock:
+            if timestamp > self._pause_until:
+                self._pause_until = timestamp
+
+    def observe(self, response) -> None:
+        """Record quota headers; start a global pause when nearly exhausted."""
+        headers = response.headers
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_at = headers.get("X-RateLimit-Reset")
+        with self._lock:
+            self._requests += 1
+            if remaining is None:
+                return
+            try:
+                self._remaining = int(remaining)
+                self._limit = int(headers.get("X-RateLimit-Limit", 0)) or self._limit
+                self._reset_at = int(reset_at) if reset_at else self._reset_at
+            except ValueError:
+                return
+            near_zero = self._remaining <= self.reserve and self._reset_at
+            should_pause = near_zero and self._reset_at + 1 > self._pause_until
+            if should_pause:
+                self._pause_until = self._reset_at + 1
+        logger.debug(f"GitHub quota remaining: {remaining}/{headers.get('X-RateLimit-Limit')} (resource: {headers.get('X-RateLimit-Resource')})")
+        if should_pause:
+            logger.warning(f"GitHub quota nearly exhausted ({remaining} left), pausing all GitHub calls until reset at {self._reset_at}")
+
+    def retry_delay(self, response, attempt: int, base_delay: float) -> float:
+        """Seconds to wait before retrying ``response``'s request."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), GITHUB_MAX_BACKOFF_SECONDS)
+                except ValueError:
+                    pass
+            if is_rate_limited(response) and response.headers.get("X-RateLimit-Remaining") == "0":
+                reset_at = response.headers.get("X-RateLimit-Reset")
+                if reset_at:
+                    wait_seconds = max(0.0, int(reset_at) + 1 - time.time())
+                    self.pause_until(time.time() + wait_seconds)
+                    return min(wait_seconds, GITHUB_MAX_BACKOFF_SECONDS)
+        # Capped exponential backoff with full jitter
+        return random.uniform(0, min(60.0, base_delay * (2 ** attempt))) + base_delay / 2
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._lock:
+            result = {
+                "requests": self._requests,
+                "remaining": self._remaining,
+                "limit": self._limit,
+                "reset_at": self._reset_at,
+                "paused_seconds": round(self._paused_seconds, 1),
+            }
+            if reset:
+                self._requests = 0
+                self._paused_seconds = 0.0
+        return result
+
+
+github_rate_limit = RateLimitGate()
@@ -0,0 +1,235 @@
+"""
+Batch API mode for GPT analysis that does not need real-time latency.
+
+Backfills and weekly summaries can wait hours for their results, and the
+Azure OpenAI / OpenAI Batch API answers within a 24h window at roughly half
+the price of the interactive endpoint, on a separate quota. This module runs
+such work offline without a second code path for building prompts:
+
+1. **Collect**: the caller's analysis function runs inside
+   ``gpt_reply.collect_gpt_requests``. Every GPT request that misses the
+   response cache is recorded instead of sent, and the call returns None.
+2. **Submit**: the collected requests are written as a JSONL file (one
+   ``/chat/completions`` request per line, ``custom_id`` = response cache
+   key), uploaded with ``purpose="batch"`` and submitted as a batch.
+3. **Poll** the batch until it reaches a terminal status.
+4. **Hydrate**: successful results are stored in ``llm_cache`` under their
+   ``custom_id``, so the identical interactive request becomes a cache hit.
+
+Requests that depend on earlier answers (the legacy title prompt is built
+from the summary) only appear once those answers are cached, so collection
+is repeated for up to ``GPT_BATCH_MAX_ROUNDS`` rounds. The caller then runs
+its normal pipeline, which is served from the cache; anything the batch did
+not answer goes to the interactive endpoint as usual.
+
+``GPT_BATCH_MODE=true`` only batches weekly summaries; live commit analysis
+always uses the interactive endpoint, and commits are batched only by
+``backfill.py --batch``. The response cache must be enabled, and only
+successful lines are stored in it.
+"""
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from gpt_reply import AZURE_OPENAI_DEPLOYMENT, client, collect_gpt_requests
+from llm_cache import LLMResponseCache, response_cache
+from logs import logger
+
+
+GPT_BATCH_MODE = os.getenv("GPT_BATCH_MODE", "False") in ("True", "true")
+# Azure requires a Global-Batch / Data-Zone-Batch deployment for batch jobs.
+GPT_BATCH_DEPLOYMENT = os.getenv("GPT_BATCH_DEPLOYMENT", "").strip() or AZURE_OPENAI_DEPLOYMENT
+# "/chat/completions" for the Azure v1 API, "/v1/chat/completions" for OpenAI.
+GPT_BATCH_ENDPOINT = os.getenv("GPT_BATCH_ENDPOINT", "/chat/completions")
+GPT_BATCH_DIR = os.getenv("GPT_BATCH_DIR", "gpt_batches")
+GPT_BATCH_POLL_SECONDS = float(os.getenv("GPT_BATCH_POLL_SECONDS", 60))
+GPT_BATCH_TIMEOUT_HOURS = float(os.getenv("GPT_BATCH_TIMEOUT_HOURS", 24))
+GPT_BATCH_MAX_ROUNDS = int(os.getenv("GPT_BATCH_MAX_ROUNDS", 3))
+GPT_BATCH_MAX_REQUESTS = int(os.getenv("GPT_BATCH_MAX_REQUESTS", 50000))
+
+_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchCollector:
+    """Requests that missed the response cache, keyed by their cache key (duplicates collapse)."""
+
+    def __init__(self):
+        self.requests: Dict[str, dict] = {}
+
+    def add(self, cache_key: str, request: dict) -> None:
+        self.requests.setdefault(cache_key, request)
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+
+def batch_request_line(custom_id: str, request: dict, deployment: str = GPT_BATCH_DEPLOYMENT,
+                       endpoint: str = GPT_BATCH_ENDPOINT) -> dict:
+    """One line of a batch input file. Only ``model`` changes, so the cache key stays valid."""
+    body = dict(request)
+    if deployment:
+        body["model"] = deployment
+    return {"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}
+
+
+def parse_result_line(line: str, requests: Dict[str, dict]) -> Optional[tuple]:
+    """
+    Parse one line of a batch output file.
+
+    Returns ``(custom_id, content, prompt_tokens, completion_tokens, total_tokens)``
+    or None if the request failed or the content is not cacheable.
+    """
+    record = json.loads(line)
+    custom_id = record.get("custom_id")
+    response = record.get("response") or {}
+    if custom_id not in requests or record.get("error") or response.get("status_code") != 200:
+        return None
+    body = response.get("body") or {}
+    choices = body.get("choices") or []
+    content = (choices[0].get("message") or {}).get("content") if choices else None
+    if not content:
+        return None
+    if requests[custom_id].get("response_format") is not None:
+        try:
+            json.loads(content)
+        except ValueError:
+            return None
+    usage = body.get("usage") or {}
+    return custom_id, content, usage.get("prompt_tokens"), usage.get("completion_tokens"), usage.get("total_tokens")
+
+
+class GPTBatchRunner:
+    """Submits collected requests as batch jobs and stores the results in the response cache."""
+
+    def __init__(self, openai_client=None, cache: LLMResponseCache = None,
+                 deployment: str = GPT_BATCH_DEPLOYMENT, endpoint: str = GPT_BATCH_ENDPOINT,
+                 batch_dir: str = GPT_BATCH_DIR, poll_seconds: float = GPT_BATCH_POLL_SECONDS,
+                 timeout_seconds: float = GPT_BATCH_TIMEOUT_HOURS * 3600,
+                 max_requests: int = GPT_BATCH_MAX_REQUESTS):
+        self.client = openai_client if openai_client is not None else client
+        self.cache = cache if cache is not None else response_cache
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.batch_dir = batch_dir
+        self.poll_seconds = poll_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_requests = max(1, max_requests)
+
+    def write_input_file(self, requests: Dict[str, dict], part: int = 0) -> str:
+        """Write the JSONL input file (kept in ``batch_dir`` for auditing) and return its path."""
+        os.makedirs(self.batch_dir, exist_ok=True)
+        path = os.path.join(self.batch_dir, f"batch_{time.strftime('%Y%m%d_%H%M%S')}_{part}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for custom_id, request in requests.items():
+                line = batch_request_line(custom_id, request, self.deployment, self.endpoint)
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return path
+
+    def submit(self, requests: Dict[str, dict], part: int = 0) -> str:
+        path = self.write_input_file(requests, part)
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window="24h",
+            metadata={"source": "eyes-on-docs"},
+        )
+        logger.warning(f"GPT batch {batch.id}: submitted {len(requests)} requests ({path})")
+        return batch.id
+
+    def wait(self, batch_ids: List[str]) -> list:
+        """Poll until every batch is terminal or the timeout passes; unfinished batches are cancelled."""
+        deadline = time.monotonic() + self.timeout_seconds
+        pending = list(batch_ids)
+        finished = []
+        while pending:
+            for batch_id in list(pending):
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in _TERMINAL_STATUSES:
+                    counts = getattr(batch, "request_counts", None)
+                    logger.warning(f"GPT batch {batch_id}: {batch.status} {counts or ''}")
+                    finished.append(batch)
+                    pending.remove(batch_id)
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                for batch_id in pending:
+                    logger.error(f"GPT batch {batch_id}: not finished within {self.timeout_seconds:.0f}s, cancelling")
+                    try:
+                        self.client.batches.cancel(batch_id)
+                    except Exception as exc:
+                        logger.warning(f"GPT batch {batch_id}: cancel failed ({exc})")
+                break
+            time.sleep(self.poll_seconds)
+        return finished
+
+    def hydrate(self, batch, requests: Dict[str, dict]) -> int:
+        """Store the successful results of a finished batch in the response cache."""
+        if not batch.output_file_id:
+            return 0
+        stored = 0
+        failed = 0
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            try:
+                result = parse_result_line(line, requests)
+            except ValueError:
+                result = None
+            if result is None:
+                failed += 1
+                continue
+            self.cache.put(*result)
+            stored += 1
+        if failed:
+            logger.warning(f"GPT batch {batch.id}: {failed} results failed or were not cacheable")
+        return stored
+
+    def run(self, requests: Dict[str, dict]) -> int:
+        """Submit, wait and hydrate; returns the number of responses stored in the cache."""
+        items = list(requests.items())
+        chunks = [dict(items[i:i + self.max_requests]) for i in range(0, len(items), self.max_requests)]
+        batch_ids = [self.submit(chunk, part) for part, chunk in enumerate(chunks)]
+        return sum(self.hydrate(batch, requests) for batch in self.wait(batch_ids))
+
+
+def run_batch_rounds(analyze: Callable[[], object], runner: GPTBatchRunner = None,
+                     max_rounds: int = GPT_BATCH_MAX_ROUNDS) -> dict:
+    """
+    Pre-answer the GPT requests made by ``analyze`` through the Batch API.
+
+    ``analyze`` must be free of side effects (no Teams posts, no CosmosDB
+    writes): it runs once per round with GPT calls collected instead of sent,
+    and its return value is ignored. Afterwards the caller runs the real
+    pipeline, which is served from the response cache.
+    """
+    runner = runner or GPTBatchRunner()
+    stats = {"rounds": 0, "requests": 0, "stored": 0}
+    if not runner.cache.enabled or runner.cache.bypass:
+        logger.warning("GPT batch mode needs the response cache (GPT_CACHE_PATH, no GPT_CACHE_BYPASS); using interactive calls")
+        return stats
+    for _ in range(max_rounds):
+        collector = BatchCollector()
+        try:
+            with collect_gpt_requests(collector):
+                analyze()
+        except Exception as exc:
+            logger.exception("GPT batch: collecting requests failed:", exc)
+            break
+        if not collector:
+            break
+        stats["rounds"] += 1
+        stats["requests"] += len(collector)
+        try:
+            stored = runner.run(collector.requests)
+        except Exception as exc:
+            logger.exception("GPT batch: batch job failed, remaining requests use interactive calls:", exc)
+            break
+        stats["stored"] += stored
+        if stored == 0:
+            break
+    logger.warning(f"GPT batch: {stats}")
+    return stats
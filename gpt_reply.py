@@ -1,15 +1,20 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import openai
+import asyncio
+import contextvars
+import email.utils
+import json
 import os
+import random
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from logs import logger
+from rate_limiter import TokenBucket
+from llm_cache import response_cache, request_cache_key
 # import traceback
 
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_random_exponential,
-)  # for exponential backoff
-
 load_dotenv(override=True)  # 允许覆盖环境变量
 
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY", "").strip()
@@ -26,65 +31,338 @@ client = OpenAI(
     default_headers={"api-key": AZURE_OPENAI_KEY}
 )
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(1))
+# 异步客户端：所有GPT请求都经由它发出，同步函数只是把协程提交到后台事件循环的薄封装
+# 关闭SDK内置的重试，由 chat_completion_with_backoff_async 统一处理（区分可重试错误、遵守 retry-after、统计指标）
+async_client = AsyncOpenAI(
+    api_key=AZURE_OPENAI_KEY,
+    base_url=base_url,
+    default_headers={"api-key": AZURE_OPENAI_KEY},
+    max_retries=0,
+)
+
+# 部署的每分钟token配额（TPM）和每分钟请求数（RPM），所有目标和并发调用共享，0 表示不限制
+GPT_TOKENS_PER_MINUTE = int(os.getenv("GPT_TOKENS_PER_MINUTE", 0))
+GPT_REQUESTS_PER_MINUTE = int(os.getenv("GPT_REQUESTS_PER_MINUTE", 0))
+# 同时进行中的GPT请求上限，0 表示不限制
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", 8))
+tpm_budget = TokenBucket(GPT_TOKENS_PER_MINUTE)
+rpm_budget = TokenBucket(GPT_REQUESTS_PER_MINUTE)
+
+# 可重试错误（429 / 5xx / 超时 / 连接错误）的最大重试次数
+GPT_MAX_RETRIES = int(os.getenv("GPT_MAX_RETRIES", 5))
+# 同一个commit的所有GPT调用累计的退避等待上限（秒），超出后不再重试
+GPT_MAX_RETRY_WAIT_SECONDS = float(os.getenv("GPT_MAX_RETRY_WAIT_SECONDS", 120))
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+class GPTCallMetrics:
+    """
+    一组GPT调用（通常是一个commit的摘要+标题）的重试统计，同时承载这组调用共享的退避等待上限
+    """
+    def __init__(self, max_wait_seconds=GPT_MAX_RETRY_WAIT_SECONDS):
+        self.max_wait_seconds = max_wait_seconds
+        self.calls = 0  # 实际发出的请求数（包括重试）
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.errors = {}  # 状态码/异常类型 -> 次数
+
+    def remaining_wait(self):
+        return max(0.0, self.max_wait_seconds - self.backoff_seconds)
+
+    def record_error(self, exc):
+        key = str(getattr(exc, "status_code", None) or type(exc).__name__)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "backoff_seconds": round(self.backoff_seconds, 2),
+            "errors": dict(self.errors),
+        }
+
+_current_metrics = contextvars.ContextVar("gpt_call_metrics", default=None)
+
+@contextmanager
+def track_gpt_calls(max_wait_seconds=GPT_MAX_RETRY_WAIT_SECONDS):
+    """
+    with 块内（当前线程）发出的GPT调用共享一个退避等待上限，并把重试次数、退避时间汇总到返回的 GPTCallMetrics
+
+    例：
+        with track_gpt_calls() as metrics:
+            summary = get_gpt_response(...)
+            title = get_gpt_response(...)
+        commit_history["gpt_call_metrics"] = metrics.as_dict()
+    """
+    metrics = GPTCallMetrics(max_wait_seconds)
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+class GPTRequestDeferred(Exception):
+    """批量收集模式下请求没有命中缓存：请求已交给 collector 记录，等 Batch API 的结果写入缓存后再处理"""
+
+_batch_collector = contextvars.ContextVar("gpt_batch_collector", default=None)
+
+@contextmanager
+def collect_gpt_requests(collector):
+    """
+    with 块内（当前线程）未命中响应缓存的GPT请求不会发送，而是通过 collector.add(cache_key, request)
+    记录下来并让调用返回失败（None）。gpt_batch 用它收集一轮需要的请求，经 Batch API 处理后写入缓存
+    """
+    token = _batch_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _batch_collector.reset(token)
+
+def collecting_gpt_requests():
+    """当前是否处于 collect_gpt_requests() 的收集模式"""
+    return _batch_collector.get() is not None
+
+def is_retryable_error(exc):
+    """429、408/409、5xx、超时和连接错误可以重试；400（含内容过滤）、401/403、404 等不重试"""
+    if isinstance(exc, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS_CODES or exc.status_code >= 500
+    return False
+
+def retry_after_seconds(exc):
+    """
+    读取 Azure OpenAI 返回的 retry-after-ms / retry-after 响应头，没有时返回None
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            # HTTP-date 格式
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    粗略估算一次请求会消耗的token数（约4个字符1个token），用于在发请求前预占TPM额度
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + (max_tokens or 1000)
+
+def _reserve_budget(messages, max_tokens=None):
+    """
+    预占一次请求的RPM和TPM额度（不阻塞），返回 (估算的token数, 需要等待的秒数)
+    """
+    estimated_tokens = estimate_tokens(messages, max_tokens)
+    wait_seconds = max(rpm_budget.reserve(1), tpm_budget.reserve(estimated_tokens))
+    return estimated_tokens, wait_seconds
+
+async def _acquire_budget_async(messages, max_tokens=None):
+    """
+    发请求前按估算值预占RPM/TPM额度，额度不足时异步等待（不占用线程），返回估算的token数
+    """
+    estimated_tokens, wait_seconds = _reserve_budget(messages, max_tokens)
+    if wait_seconds > 0:
+        logger.info(f"Waited {wait_seconds:.1f}s for GPT requests/tokens-per-minute budget")
+        await asyncio.sleep(wait_seconds)
+    return estimated_tokens
+
+def _settle_budget(estimated_tokens, response):
+    """
+    请求完成后按实际用量补扣TPM额度（只补扣超出估算的部分）
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None and usage.total_tokens and usage.total_tokens > estimated_tokens:
+        tpm_budget.consume(usage.total_tokens - estimated_tokens)
+
+# ---------------------------------------------------------------------------
+# 后台事件循环：同步调用方（线程池中的目标/commit）把协程提交到这里执行
+# ---------------------------------------------------------------------------
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+_concurrency = None  # asyncio.Semaphore，只在后台事件循环中使用
+
+def _get_loop():
+    """懒启动后台事件循环线程（守护线程，随进程退出）"""
+    global _loop, _loop_thread, _concurrency
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="gpt-event-loop", daemon=True)
+            thread.start()
+            _concurrency = asyncio.Semaphore(GPT_MAX_CONCURRENCY) if GPT_MAX_CONCURRENCY > 0 else None
+            _loop, _loop_thread = loop, thread
+        return _loop
+
+async def _with_call_context(coro, metrics, collector):
+    """在事件循环的任务中恢复调用方线程的 GPTCallMetrics 和批量收集器（子任务会继承）"""
+    if metrics is not None:
+        _current_metrics.set(metrics)
+    if collector is not None:
+        _batch_collector.set(collector)
+    return await coro
+
+def run_sync(coro):
+    """
+    在后台事件循环中执行协程并阻塞等待结果，供同步代码调用异步GPT接口
+    调用方线程中 track_gpt_calls() 的统计对象和 collect_gpt_requests() 的收集器会一并传给协程
+    """
+    loop = _get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() called from the GPT event loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(
+        _with_call_context(coro, _current_metrics.get(), _batch_collector.get()), loop
+    ).result()
+
+async def gather_gpt_calls(*coros):
+    """
+    并发执行多个GPT协程（受RPM/TPM与并发上限约束），按传入顺序返回结果，
+    例：run_sync(gather_gpt_calls(get_gpt_response_async(m1), get_gpt_response_async(m2)))
+    """
+    return await asyncio.gather(*coros)
+
+async def _create_chat_completion(**kwargs):
+    if _concurrency is None:
+        return await async_client.chat.completions.create(**kwargs)
+    async with _concurrency:
+        return await async_client.chat.completions.create(**kwargs)
+
+async def chat_completion_with_backoff_async(**kwargs):
+    """
+    发送请求，遇到可重试错误时按 retry-after-ms / retry-after（没有则指数退避加随机抖动）等待后重试
+
+    重试次数受 GPT_MAX_RETRIES 限制，累计等待时间受当前 GPTCallMetrics 的上限限制
+    （track_gpt_calls 之外的调用每次单独计算上限）。等待期间不占用并发名额。
+    """
+    metrics = _current_metrics.get() or GPTCallMetrics()
+    attempt = 0
+    while True:
+        metrics.calls += 1
+        try:
+            return await _create_chat_completion(**kwargs)
+        except Exception as exc:
+            metrics.record_error(exc)
+            if not is_retryable_error(exc):
+                raise
+            if attempt >= GPT_MAX_RETRIES:
+                logger.error(f"GPT request failed after {attempt} retries: {exc}")
+                raise
+            delay = retry_after_seconds(exc)
+            if delay is None:
+                delay = random.uniform(0, min(60.0, 2 ** attempt)) + 0.5
+            if delay > metrics.remaining_wait():
+                logger.error(f"GPT retry wait {delay:.1f}s exceeds the remaining budget {metrics.remaining_wait():.1f}s, giving up: {exc}")
+                raise
+            attempt += 1
+            metrics.retries += 1
+            metrics.backoff_seconds += delay
+            logger.warning(f"GPT request failed ({type(exc).__name__}: {getattr(exc, 'status_code', '')}), retry {attempt}/{GPT_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
 def chat_completion_with_backoff(**kwargs):
-    return client.chat.completions.create(**kwargs)
+    return run_sync(chat_completion_with_backoff_async(**kwargs))
+
+async def cached_chat_completion_async(use_cache=True, **request):
+    """
+    先查本地响应缓存，未命中再调用 Azure OpenAI（temperature=0，相同请求的结果可以复用）
+
+    Returns:
+        tuple: (content, prompt_tokens, completion_tokens, total_tokens, cache_key)
+               命中缓存或不使用缓存时 cache_key 为 None；
+               否则调用方确认响应可用后再（在线程池中）调用 response_cache.put(cache_key, ...) 写入缓存
+    """
+    cache_key = request_cache_key(request) if use_cache and response_cache.enabled else None
+    if cache_key is not None:
+        # SQLite读写是阻塞调用，放到线程池中执行，避免阻塞事件循环上其他并发的GPT请求
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"GPT response cache hit: {cache_key[:12]}")
+            return (*cached, None)
 
-def get_gpt_response(messages, max_tokens=1000):
+    collector = _batch_collector.get()
+    if collector is not None:
+        # 收集模式：不发送请求，记录下来交给 Batch API（不使用缓存的请求无法回填，只是跳过）
+        if cache_key is not None:
+            collector.add(cache_key, request)
+        raise GPTRequestDeferred(cache_key)
+
+    estimated_tokens = await _acquire_budget_async(request["messages"], request.get("max_tokens"))
+    response = await chat_completion_with_backoff_async(**request)
+    _settle_budget(estimated_tokens, response)
+    usage = response.usage
+    return response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens, usage.total_tokens, cache_key
+
+async def get_gpt_response_async(messages, max_tokens=1000, use_cache=True):
     try:
-        response = chat_completion_with_backoff(
+        gpt_response, prompt_tokens, completion_tokens, total_tokens, cache_key = await cached_chat_completion_async(
+            use_cache,
             model=AZURE_OPENAI_DEPLOYMENT,  # deployment_name
             messages=messages,
             temperature=0,
             # request_timeout=300,
             max_tokens=max_tokens,
         )
-
-        gpt_response = response.choices[0].message.content
-        prompt_tokens = response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
+        if gpt_response:
+            await asyncio.to_thread(response_cache.put, cache_key, gpt_response, prompt_tokens, completion_tokens, total_tokens)
         return gpt_response, prompt_tokens, completion_tokens, total_tokens
-    
+
+    except GPTRequestDeferred:
+        return None, None, None, None
     except Exception as e:
-        logger.exception("get_gpt_response Exception:", e)          
+        logger.exception("get_gpt_response Exception:", e)
         return None, None, None, None
 
-def get_gpt_structured_response(messages, response_format):
+def get_gpt_response(messages, max_tokens=1000, use_cache=True):
+    return run_sync(get_gpt_response_async(messages, max_tokens, use_cache))
+
+async def get_gpt_structured_response_async(messages, response_format, use_cache=True):
     """
     使用 OpenAI structured output 获取格式化的 GPT 响应
-    
+
     Args:
         messages: 消息列表
         response_format: 响应格式定义 (JSON schema)
-        
+        use_cache: 是否使用本地响应缓存
+
     Returns:
         tuple: (parsed_response_dict, prompt_tokens, completion_tokens, total_tokens)
-    
+
     Note:
         不设置max_tokens，使用OpenAI API默认行为（上下文窗口减去prompt tokens）
     """
     try:
-        response = chat_completion_with_backoff(
+        # structured output 返回的是 JSON 格式的字符串
+        gpt_response_content, prompt_tokens, completion_tokens, total_tokens, cache_key = await cached_chat_completion_async(
+            use_cache,
             model=AZURE_OPENAI_DEPLOYMENT,
             messages=messages,
             temperature=0,
             response_format=response_format
         )
 
-        # structured output 返回的是 JSON 格式的字符串
-        gpt_response_content = response.choices[0].message.content
-        
         # 记录响应内容以便调试
         logger.debug(f"GPT structured response content: {gpt_response_content}")
-        
+
         # 检查响应是否为空
         if not gpt_response_content:
             logger.error("GPT returned empty response content")
             return None, None, None, None
-        
+
         # 解析 JSON 响应
-        import json
         try:
             parsed_response = json.loads(gpt_response_content)
         except json.JSONDecodeError as json_error:
@@ -94,17 +372,20 @@ def get_gpt_structured_response(messages, response_format):
             if len(gpt_response_content) > 0 and not gpt_response_content.rstrip().endswith('}'):
                 logger.error("Response appears to be truncated. Consider increasing max_tokens.")
             return None, None, None, None
-        
-        prompt_tokens = response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
-        
+
+        # 只缓存能正确解析的响应
+        await asyncio.to_thread(response_cache.put, cache_key, gpt_response_content, prompt_tokens, completion_tokens, total_tokens)
+
         return parsed_response, prompt_tokens, completion_tokens, total_tokens
-    
+
+    except GPTRequestDeferred:
+        return None, None, None, None
     except Exception as e:
-        logger.exception("get_gpt_structured_response Exception:", e)          
+        logger.exception("get_gpt_structured_response Exception:", e)
         return None, None, None, None
 
-
-
-    
+def get_gpt_structured_response(messages, response_format, use_cache=True):
+    """
+    get_gpt_structured_response_async 的同步封装，参数和返回值相同
+    """
+    return run_sync(get_gpt_structured_response_async(messages, response_format, use_cache))
@@ -0,0 +1,153 @@
+"""
+Persistent cache of Azure OpenAI chat completion responses.
+
+Every GPT call in this project uses ``temperature=0``, so an identical
+request (same deployment, messages, temperature, max_tokens and
+response_format) can be answered from disk. This saves cost and latency
+when a crashed run is restarted halfway through ``process_commits`` or a
+commit is reprocessed after a prompt-version rollback.
+
+Entries live in a small SQLite database keyed by the SHA-256 of the
+canonical JSON of the request. The value is the message content plus the
+token usage reported when it was generated.
+
+Entries expire after ``GPT_CACHE_TTL_DAYS`` and are evicted least recently
+used first above ``GPT_CACHE_MAX_ENTRIES``. ``GPT_CACHE_PATH=`` (empty)
+disables the cache; ``GPT_CACHE_BYPASS=true`` skips lookups but still
+refreshes entries.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from logs import logger
+
+
+GPT_CACHE_PATH = os.getenv("GPT_CACHE_PATH", "gpt_response_cache.sqlite3")
+GPT_CACHE_TTL_DAYS = float(os.getenv("GPT_CACHE_TTL_DAYS", 30))
+GPT_CACHE_MAX_ENTRIES = int(os.getenv("GPT_CACHE_MAX_ENTRIES", 20000))
+GPT_CACHE_BYPASS = os.getenv("GPT_CACHE_BYPASS", "False") in ("True", "true")
+
+# Run expiry/size eviction every N writes.
+_EVICT_EVERY = 100
+
+
+def request_cache_key(request: dict) -> str:
+    """SHA-256 of the fields that determine the response of a temperature-0 request."""
+    material = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "temperature": request.get("temperature"),
+        "max_tokens": request.get("max_tokens"),
+        "response_format": request.get("response_format"),
+    }
+    canonical = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """key -> (content, prompt_tokens, completion_tokens, total_tokens)."""
+
+    def __init__(self, path: Optional[str] = GPT_CACHE_PATH, ttl_seconds: float = GPT_CACHE_TTL_DAYS * 86400,
+                 max_entries: int = GPT_CACHE_MAX_ENTRIES, bypass: bool = GPT_CACHE_BYPASS):
+        self._path = path
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._path)
+
+    def _connection(self):
+        """Open the database lazily (caller holds ``self._lock``)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, content TEXT NOT NULL,"
+                " prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER,"
+                " created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used_at)")
+            conn.commit()
+            self._conn = conn
+            self._evict(conn)
+        return self._conn
+
+    def _evict(self, conn) -> None:
+        now = time.time()
+        if self._ttl_seconds > 0:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self._ttl_seconds,))
+        if self._max_entries > 0:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            )
+        conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return ``(content, prompt_tokens, completion_tokens, total_tokens)`` or None."""
+        if not self.enabled or self.bypass:
+            return None
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT content, prompt_tokens, completion_tokens, total_tokens, created_at FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None or (self._ttl_seconds > 0 and row[4] < time.time() - self._ttl_seconds):
+                    self._misses += 1
+                    return None
+                conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                self._hits += 1
+                return row[:4]
+        except Exception as exc:
+            logger.warning(f"LLMResponseCache: lookup failed ({exc}); calling the API")
+            return None
+
+    def put(self, key: str, content: str, prompt_tokens, completion_tokens, total_tokens) -> None:
+        if not self.enabled or key is None or content is None:
+            return
+        try:
+            with self._lock:
+                conn = self._connection()
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, content, prompt_tokens, completion_tokens, total_tokens, now, now),
+                )
+                conn.commit()
+                self._stores += 1
+                self._writes += 1
+                if self._writes % _EVICT_EVERY == 0:
+                    self._evict(conn)
+        except Exception as exc:
+            logger.warning(f"LLMResponseCache: store failed ({exc})")
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._lock:
+            result = {"hits": self._hits, "misses": self._misses, "stores": self._stores}
+            if reset:
+                self._hits = 0
+                self._misses = 0
+                self._stores = 0
+        return result
+
+
+# Shared by every GPT call in the process.
+response_cache = LLMResponseCache()
@@ -6,6 +6,9 @@ import os
 import requests
 from collections import deque
 import time
+import atexit
+import queue
+import threading
 
 # from metagpt.const import PROJECT_ROOT
 
@@ -17,12 +20,41 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # 从环境变量读取日志级别
 ERROR_WINDOW_SECONDS = int(os.getenv('ERROR_WINDOW_SECONDS', 120))  # 时间窗口（秒）
 ERROR_THRESHOLD = int(os.getenv('ERROR_THRESHOLD', 20))  # 阈值
 
+# 异步发送配置：error通知放入队列由后台线程发送，相同的异常在去重窗口内只发送一次，多条error合并为一条消息
+ERROR_WEBHOOK_DEDUPE_SECONDS = float(os.getenv('ERROR_WEBHOOK_DEDUPE_SECONDS', 300))  # 去重窗口（秒）
+ERROR_WEBHOOK_BATCH_SECONDS = float(os.getenv('ERROR_WEBHOOK_BATCH_SECONDS', 5))  # 收集一批error的最长等待时间（秒）
+ERROR_WEBHOOK_BATCH_SIZE = int(os.getenv('ERROR_WEBHOOK_BATCH_SIZE', 10))  # 每条消息最多合并的error数
+ERROR_WEBHOOK_QUEUE_SIZE = int(os.getenv('ERROR_WEBHOOK_QUEUE_SIZE', 1000))  # 队列满时丢弃新的error并计数
+ERROR_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('ERROR_WEBHOOK_TIMEOUT_SECONDS', 10))  # 发送请求超时（秒）
+# 单条error在消息中保留的最大字符数（Teams消息大小有限制）
+ERROR_WEBHOOK_MAX_ENTRY_CHARS = 4000
+
 class WebhookHandler:
-    def __init__(self, webhook_url):
+    """
+    loguru的ERROR级别sink：记录日志的线程只做熔断计数和入队（不会因webhook缓慢而阻塞），
+    后台线程负责去重、合并和发送，进程退出时（atexit）把队列中剩余的error发送完
+    """
+    _STOP = object()
+
+    def __init__(self, webhook_url, post=None,
+                 dedupe_seconds=None, batch_seconds=None, batch_size=None, queue_size=None):
         self.webhook_url = webhook_url
         self.error_timestamps = deque()  # 记录error发送时间戳
         self.window_seconds = ERROR_WINDOW_SECONDS
         self.threshold = ERROR_THRESHOLD
+        self.dedupe_seconds = ERROR_WEBHOOK_DEDUPE_SECONDS if dedupe_seconds is None else dedupe_seconds
+        self.batch_seconds = ERROR_WEBHOOK_BATCH_SECONDS if batch_seconds is None else batch_seconds
+        self.batch_size = max(1, ERROR_WEBHOOK_BATCH_SIZE if batch_size is None else batch_size)
+        self._post = post or self._post_with_session
+        self._session = None
+        self._queue = queue.Queue(maxsize=ERROR_WEBHOOK_QUEUE_SIZE if queue_size is None else queue_size)
+        self._last_sent = {}     # 去重键 -> 最近一次发送时间
+        self._suppressed = {}    # 去重键 -> 窗口内被去重的次数，随下一次发送一起报告
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.sent_messages = 0
+        self._thread = None
+        self._closed = False
 
     def _cleanup_old_timestamps(self):
         """清理超出时间窗口的旧时间戳"""
@@ -38,9 +70,10 @@ class WebhookHandler:
             print(f"[熔断机制触发] 在 {self.window_seconds} 秒内发送了 {len(self.error_timestamps)} 次error通知")
             print(f"超过阈值 {self.threshold}，程序将退出以防止通知风暴")
             print(f"{'='*60}\n")
-            # 发送最后一条通知告知熔断
+            # 先尽量发送队列中的error，再发送最后一条通知告知熔断
+            self.close(timeout=5)
             try:
-                requests.post(self.webhook_url, json={
+                self._post(self.webhook_url, {
                     'text': f"⚠️ 熔断机制触发：{self.window_seconds}秒内发送了{len(self.error_timestamps)}次error通知，程序已自动退出。请检查系统状态。"
                 })
             except:
@@ -58,9 +91,108 @@ class WebhookHandler:
                 # 检查是否触发熔断
                 self._check_circuit_breaker()
                 
-                # 发送异常通知到webhook URL
-                # print(f"检测到异常：\n{message}")
-                requests.post(self.webhook_url, json={'text': f"检测到异常：\n{message}"})
+                # 放入队列由后台线程发送，队列满时丢弃（不阻塞记录日志的线程）
+                self._start()
+                try:
+                    self._queue.put_nowait((time.time(), str(message)))
+                except queue.Full:
+                    with self._lock:
+                        self.dropped += 1
+        except Exception as e:
+            # 处理webhook发送失败的情况
+            print(f"发送webhook通知失败: {str(e)}")
+
+    def _post_with_session(self, url, payload):
+        if self._session is None:
+            self._session = requests.Session()
+        response = self._session.post(url, json=payload, timeout=ERROR_WEBHOOK_TIMEOUT_SECONDS)
+        response.raise_for_status()
+
+    def _start(self):
+        if self._thread is not None or self._closed:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="error-webhook", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self, timeout=10):
+        """停止后台线程，先把队列中的error发送完（最多等待timeout秒）"""
+        if self._thread is None or self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout=timeout)
+
+    @staticmethod
+    def dedupe_key(message):
+        """去掉行首的时间戳，其余内容（级别、位置、消息和traceback）相同的error视为同一个"""
+        first_line, _, rest = message.partition("\n")
+        return first_line.split(" | ", 1)[-1] + "\n" + rest
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            stopping = item is self._STOP
+            batch = [] if stopping else [item]
+            # 在 batch_seconds 内收集更多error，合并为一条消息
+            deadline = time.monotonic() + self.batch_seconds
+            while not stopping and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if stopping:
+                # 退出前把剩余的error也发送出去
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not self._STOP:
+                        batch.append(item)
+            for start in range(0, len(batch), self.batch_size):
+                self._send(batch[start:start + self.batch_size])
+            if stopping:
+                return
+
+    def _send(self, batch):
+        entries = []
+        for logged_at, message in batch:
+            key = self.dedupe_key(message)
+            last_sent = self._last_sent.get(key)
+            if last_sent is not None and logged_at - last_sent < self.dedupe_seconds:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                continue
+            self._last_sent[key] = logged_at
+            suppressed = self._suppressed.pop(key, 0)
+            note = f"\n（此前 {self.dedupe_seconds:.0f} 秒内重复 {suppressed} 次，已省略）" if suppressed else ""
+            entries.append(message[:ERROR_WEBHOOK_MAX_ENTRY_CHARS] + note)
+        if len(self._last_sent) > 1000:
+            # 清理已过去重窗口的键，避免长时间运行时无限增长
+            now = time.time()
+            for key in [k for k, t in self._last_sent.items() if now - t >= self.dedupe_seconds and k not in self._suppressed]:
+                del self._last_sent[key]
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            entries.append(f"（队列已满，丢弃了 {dropped} 条error）")
+        if not entries:
+            return
+        header = "检测到异常：" if len(entries) == 1 else f"检测到 {len(entries)} 条异常："
+        try:
+            self._post(self.webhook_url, {'text': header + "\n" + "\n\n---\n\n".join(entries)})
+            self.sent_messages += 1
         except Exception as e:
             # 处理webhook发送失败的情况
             print(f"发送webhook通知失败: {str(e)}")
@@ -0,0 +1,137 @@
+"""
+Copy the commit history container into a container partitioned by ``/pk``.
+
+Every per-topic query in ``CosmosConversationClient`` used to run with
+``enable_cross_partition_query=True``, which fans out to every physical
+partition. Documents now carry ``pk = "<topic>|<language>"`` and, when the
+container's partition key path is ``/pk``, those queries are scoped to a
+single partition. A container's partition key cannot be changed in place,
+so this tool re-keys the existing documents into a new container:
+
+1. Creates the target container with partition key ``/pk`` if it does not
+   exist (an existing target must already be partitioned by ``/pk``).
+2. Reads the source container page by page and upserts every document into
+   the target with its ``pk`` set; the ``id`` is kept, so rerunning after an
+   interruption simply overwrites what was already copied.
+3. Logs documents copied and the RU charge of reads and writes.
+
+Afterwards point ``AZURE_COSMOSDB_CONVERSATIONS_CONTAINER`` (and the web
+app's container setting) at the new container.
+
+Usage:
+    python migrate_partition_key.py --target commit-history-pk --dry-run
+    python migrate_partition_key.py --target commit-history-pk
+
+The source container is only read.
+"""
+import argparse
+import time
+from collections import Counter
+from typing import Optional
+
+from azure.cosmos import PartitionKey
+
+from cosmosdb_client import CosmosDBHandler
+from cosmosdbservice import PARTITION_KEY_FIELD, PARTITION_KEY_PATH, partition_key_value
+from logs import logger
+
+
+# Properties generated by CosmosDB; the target container assigns its own.
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+
+def rekey_document(document: dict) -> dict:
+    """Copy of ``document`` without system properties and with ``pk`` derived from topic and language."""
+    rekeyed = {k: v for k, v in document.items() if k not in SYSTEM_PROPERTIES}
+    rekeyed[PARTITION_KEY_FIELD] = partition_key_value(document.get("topic"), document.get("language"))
+    return rekeyed
+
+
+def _request_charge(container) -> float:
+    headers = container.client_connection.last_response_headers or {}
+    try:
+        return float(headers.get("x-ms-request-charge", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def ensure_target_container(database, name: str, create: bool = True):
+    """Target container client; created with ``/pk`` when missing, refused if partitioned otherwise."""
+    container = database.get_container_client(name)
+    try:
+        paths = container.read().get("partitionKey", {}).get("paths", [])
+    except Exception:
+        if not create:
+            return None
+        logger.warning(f"[migrate] creating container {name} with partition key {PARTITION_KEY_PATH}")
+        return database.create_container_if_not_exists(id=name, partition_key=PartitionKey(path=PARTITION_KEY_PATH))
+    if paths != [PARTITION_KEY_PATH]:
+        raise ValueError(f"container {name} is partitioned by {paths}, expected [{PARTITION_KEY_PATH!r}]")
+    return container
+
+
+def migrate(source, target, dry_run: bool = False, page_size: int = 100, limit: Optional[int] = None) -> dict:
+    """Upsert every document of ``source`` into ``target`` with its ``pk`` set; returns counts and RU."""
+    stats = {"read": 0, "written": 0, "failed": 0, "read_ru": 0.0, "write_ru": 0.0}
+    partitions = Counter()
+    started_at = time.monotonic()
+    pages = source.query_items(query="SELECT * FROM c", enable_cross_partition_query=True,
+                               max_item_count=page_size).by_page()
+    for page in pages:
+        documents = list(page)
+        stats["read_ru"] += _request_charge(source)
+        for document in documents:
+            if limit is not None and stats["read"] >= limit:
+                break
+            stats["read"] += 1
+            rekeyed = rekey_document(document)
+            partitions[rekeyed[PARTITION_KEY_FIELD]] += 1
+            if dry_run:
+                continue
+            try:
+                target.upsert_item(rekeyed)
+                stats["written"] += 1
+                stats["write_ru"] += _request_charge(target)
+            except Exception as exc:
+                stats["failed"] += 1
+                logger.warning(f"[migrate] failed to copy {document.get('id')} ({exc})")
+        if limit is not None and stats["read"] >= limit:
+            break
+        logger.warning(f"[migrate] {stats['read']} documents read, {stats['written']} written, {stats['failed']} failed "
+                       f"({time.monotonic() - started_at:.1f}s)")
+
+    stats["read_ru"] = round(stats["read_ru"], 2)
+    stats["write_ru"] = round(stats["write_ru"], 2)
+    stats["partitions"] = len(partitions)
+    for pk, count in partitions.most_common():
+        logger.info(f"[migrate] {pk}: {count} documents")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Copy the commit history container into a container partitioned by {PARTITION_KEY_PATH}.")
+    parser.add_argument("--source", help="source container (default: AZURE_COSMOSDB_CONVERSATIONS_CONTAINER)")
+    parser.add_argument("--target", required=True, help=f"target container, created with partition key {PARTITION_KEY_PATH} if missing")
+    parser.add_argument("--dry-run", action="store_true", help="only read the source and report the partition key distribution")
+    parser.add_argument("--page-size", type=int, default=100, help="documents per source page")
+    parser.add_argument("--limit", type=int, help="stop after this many documents (for a trial run)")
+    args = parser.parse_args(argv)
+
+    handler = CosmosDBHandler()
+    client = handler.initialize_cosmos_client()
+    if client is None:
+        parser.error("failed to connect to CosmosDB, check the AZURE_COSMOSDB_* settings")
+    source_name = args.source or handler.container
+    if source_name == args.target:
+        parser.error("--target must differ from the source container")
+
+    database = client.database_client
+    source = database.get_container_client(source_name)
+    target = ensure_target_container(database, args.target, create=not args.dry_run)
+    stats = migrate(source, target, dry_run=args.dry_run, page_size=args.page_size, limit=args.limit)
+    logger.warning(f"[migrate] {source_name} -> {args.target}{' (dry run)' if args.dry_run else ''}: {stats}")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
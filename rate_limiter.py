@@ -0,0 +1,66 @@
+"""
+Thread-safe token bucket used to keep concurrent callers under a per-minute
+budget (e.g. the Azure OpenAI deployment's tokens-per-minute quota).
+
+The bucket never blocks while holding its lock: ``reserve`` books the amount
+immediately (the bucket may go into debt) and returns how long the caller has
+to wait before using it. ``acquire`` is the blocking convenience wrapper.
+This keeps the ordering fair — callers are served in the order they reserved —
+and lets an asyncio caller await the same delay instead of sleeping a thread.
+
+A bucket created with ``rate_per_minute <= 0`` is unlimited and never waits,
+so call sites can use it unconditionally.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """Refill ``rate_per_minute`` units per minute up to ``capacity``."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_minute = float(rate_per_minute or 0)
+        self.capacity = float(capacity) if capacity else self.rate_per_minute
+        self._available = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate_per_minute <= 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._available = min(self.capacity, self._available + elapsed * self.rate_per_minute / 60.0)
+
+    def reserve(self, amount: float) -> float:
+        """Book ``amount`` units and return the number of seconds to wait
+        before they may be used. Requests larger than the capacity are
+        clamped to the capacity so they can still go through eventually."""
+        if self.unlimited or amount <= 0:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._available -= amount
+            if self._available >= 0:
+                return 0.0
+            return -self._available * 60.0 / self.rate_per_minute
+
+    def acquire(self, amount: float) -> float:
+        """Blocking variant of ``reserve``. Returns the time spent waiting."""
+        wait_seconds = self.reserve(amount)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        return wait_seconds
+
+    def consume(self, amount: float) -> None:
+        """Charge extra units without waiting, e.g. when the real usage
+        reported by the API turned out larger than the estimate."""
+        if self.unlimited or amount <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= float(amount)
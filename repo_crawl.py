@@ -0,0 +1,173 @@
+"""
+Shared repository-level crawl for targets that watch the same repo.
+
+Many targets point at the same repository (e.g. ``MicrosoftDocs/azure-docs``)
+with different ``path=`` filters, and each one used to list commits and
+fetch commit details on its own. The planner groups those targets by
+*commit stream* — the commits URL without ``path`` (other query parameters
+such as ``sha=live`` are kept, because they select a different stream) —
+and fetches each stream once:
+
+1. List the stream's commits since the earliest start time in the group.
+   Members whose start time lags the group's median by more than
+   ``SHARED_REPO_CRAWL_MAX_LAG_SECONDS`` (e.g. a new target) are left out
+   and crawl on their own, so one stale watermark does not make the whole
+   group download the repository's history.
+2. Fetch each commit's changed files through the SHA-keyed commit detail
+   cache, so the targets' own ``get_change_from_each_url`` calls later are
+   cache hits.
+3. Route every changed file (and the old path of renames) through a
+   character-level prefix trie of the targets' ``topic_path`` values. A
+   lookup costs O(len(filename)) regardless of how many targets watch the
+   repo and keeps the ``str.startswith`` semantics the per-target filter
+   uses.
+
+GitHub list calls then scale with repos instead of topics. Detail calls
+scale with the commits of the whole repo, not just the watched paths, which
+is why the shared crawl is opt-in (``SHARED_REPO_CRAWL``) and only used for
+streams watched by at least ``SHARED_REPO_CRAWL_MIN_TARGETS`` targets.
+
+If the listing is truncated or any commit detail fails, the group's targets
+crawl on their own for that cycle.
+"""
+import os
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from commit_fetch import CommitFetcher, parse_topic_path
+from logs import logger
+
+
+SHARED_REPO_CRAWL = os.getenv("SHARED_REPO_CRAWL", "False") in ("True", "true")
+SHARED_REPO_CRAWL_MIN_TARGETS = int(os.getenv("SHARED_REPO_CRAWL_MIN_TARGETS", 2))
+# Members more than this far behind the group's median start time crawl on their own (default: one schedule).
+SHARED_REPO_CRAWL_MAX_LAG_SECONDS = int(os.getenv("SHARED_REPO_CRAWL_MAX_LAG_SECONDS", 7200))
+
+# Query parameters that do not change which commits the stream contains.
+_NON_STREAM_PARAMS = ("path", "per_page", "page", "since")
+
+
+class PathPrefixTrie:
+    """Character trie mapping path prefixes to the values registered for them."""
+
+    _VALUES = None  # key of the value set inside a node; never a path character
+
+    def __init__(self):
+        self._root: dict = {}
+        self._match_all: Set[Hashable] = set()
+
+    def add(self, prefix: Optional[str], value: Hashable) -> None:
+        """Register ``value`` for ``prefix``; an empty/None prefix matches every path."""
+        if not prefix:
+            self._match_all.add(value)
+            return
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(self._VALUES, set()).add(value)
+
+    def match(self, path: str) -> Set[Hashable]:
+        """Return every value whose prefix is a prefix of ``path``."""
+        found = set(self._match_all)
+        node = self._root
+        for char in path or "":
+            node = node.get(char)
+            if node is None:
+                break
+            found.update(node.get(self._VALUES, ()))
+        return found
+
+
+def commit_stream_url(root_commits_url: str) -> str:
+    """The commits URL without ``path`` (and paging) parameters.
+
+    Targets with the same stream URL read the same commit history and can
+    share one listing.
+    """
+    parsed = urlparse(root_commits_url)
+    query = parse_qs(parsed.query, keep_blank_values=True)
+    kept = sorted((k, v) for k, v in query.items() if k not in _NON_STREAM_PARAMS)
+    return parsed._replace(query=urlencode(kept, doseq=True, safe="/:")).geturl()
+
+
+def group_targets_by_stream(targets: Iterable[dict], min_targets: int = SHARED_REPO_CRAWL_MIN_TARGETS) -> Dict[str, List[dict]]:
+    """Group targets by commit stream; only groups with ``min_targets`` or more are returned."""
+    groups = defaultdict(list)
+    for target in targets:
+        groups[commit_stream_url(target["root_commits_url"])].append(target)
+    return {stream: members for stream, members in groups.items() if len(members) >= max(1, min_targets)}
+
+
+def stale_members(start_times: Dict[Hashable, object], max_lag_seconds: int) -> Set[Hashable]:
+    """Keys whose start time is more than ``max_lag_seconds`` older than the (upper) median start time."""
+    if len(start_times) < 2:
+        return set()
+    median = sorted(start_times.values())[len(start_times) // 2]
+    return {key for key, start in start_times.items() if (median - start).total_seconds() > max_lag_seconds}
+
+
+class SharedRepoCrawl(CommitFetcher):
+    """Fetch one commit stream and route its commits to the member targets."""
+
+    def __init__(self, stream_url: str, member_urls: Dict[Hashable, str], start_times: Dict[Hashable, object], headers: dict,
+                 max_lag_seconds: int = SHARED_REPO_CRAWL_MAX_LAG_SECONDS):
+        """
+        Args:
+            stream_url: commits URL shared by the members (see ``commit_stream_url``).
+            member_urls: target key -> the target's ``root_commits_url``.
+            start_times: target key -> datetime; only newer commits are routed.
+            headers: GitHub request headers.
+            max_lag_seconds: members whose start time is further behind the
+                median are excluded (``stale``) and not routed.
+        """
+        self.stream_url = stream_url
+        self.stale = stale_members(start_times, max_lag_seconds)
+        self.start_times = {key: start for key, start in start_times.items() if key not in self.stale}
+        self.headers = headers
+        self.trie = PathPrefixTrie()
+        for key, root_commits_url in member_urls.items():
+            if key in self.start_times:
+                self.trie.add(parse_topic_path(root_commits_url), key)
+
+    def _match_files(self, files: list) -> Set[Hashable]:
+        matched = set()
+        for item in files:
+            for name in (item.get("filename"), item.get("previous_filename")):
+                if name:
+                    matched |= self.trie.match(name)
+        return matched
+
+    def route(self) -> Optional[Dict[Hashable, dict]]:
+        """
+        Returns:
+            target key -> ``{datetime: commit_url}`` of commits touching that
+            target's path (stale members are not included), or None if the
+            stream could not be fetched completely (members should crawl on
+            their own).
+        """
+        if self.stale:
+            logger.warning(f"Shared crawl of {self.stream_url}: {len(self.stale)} members lag behind the group and crawl on their own")
+        since = min(self.start_times.values())
+        commits = self.list_commits(self.stream_url, self.headers, since=since)
+        if self.commits_truncated:
+            logger.warning(f"Shared crawl of {self.stream_url} hit the page limit before {since}, falling back to per-target crawl")
+            return None
+        routed = {key: {} for key in self.start_times}
+        fetched = 0
+        for commit_time, commit_url in sorted(commits):
+            if commit_time <= since:
+                continue
+            files = self.get_commit_files(commit_url, self.headers)
+            if files is None:
+                logger.warning(f"Shared crawl of {self.stream_url} could not fetch {commit_url}, falling back to per-target crawl")
+                return None
+            fetched += 1
+            for key in self._match_files(files):
+                if commit_time > self.start_times[key]:
+                    routed[key][commit_time] = commit_url
+        logger.info(
+            f"Shared crawl of {self.stream_url}: {fetched} commits since {since}, "
+            f"routed {sum(len(v) for v in routed.values())} to {len(routed)} targets"
+        )
+        return routed
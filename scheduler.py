@@ -0,0 +1,176 @@
+"""
+Adaptive per-target polling schedule.
+
+``eyes_on_docs.main`` used to sweep every target and then sleep for
+``Spyder.schedule`` (7200 s), so a busy topic waited up to two hours for a
+notification while a dormant one was polled just as often. With
+``ADAPTIVE_SCHEDULER=true`` each target instead has its own next-due time in
+a priority queue (``heapq``), and due targets are handed to the worker pool
+as soon as they are due:
+
+1. After every poll the target's commit rate (commits per hour) is updated
+   as an exponentially weighted moving average of ``commits / window``.
+2. Its next interval aims for ``SCHEDULER_COMMITS_PER_POLL`` commits per
+   poll (``commits_per_poll / rate``), clamped to
+   ``[SCHEDULER_MIN_INTERVAL_SECONDS, SCHEDULER_MAX_INTERVAL_SECONDS]``;
+   targets without commits drift towards the maximum.
+3. The intervals of all targets are scaled up together whenever their
+   combined poll rate would exceed the poll budget, which defaults to what
+   the fixed schedule spent (one poll per target per ``Spyder.schedule``),
+   so hot topics are polled more often without raising total GitHub calls.
+4. ``SCHEDULER_JITTER`` spreads polls so targets do not synchronise.
+5. ``trigger`` makes a target due immediately, e.g. when the push webhook
+   receiver (``webhook_receiver``) reports a change under its path.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+
+ADAPTIVE_SCHEDULER = os.getenv("ADAPTIVE_SCHEDULER", "False") in ("True", "true")
+SCHEDULER_MIN_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_MIN_INTERVAL_SECONDS", 600))
+SCHEDULER_MAX_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_MAX_INTERVAL_SECONDS", 21600))
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", 0.1))
+SCHEDULER_EWMA_ALPHA = float(os.getenv("SCHEDULER_EWMA_ALPHA", 0.3))
+SCHEDULER_COMMITS_PER_POLL = float(os.getenv("SCHEDULER_COMMITS_PER_POLL", 1.0))
+# 0 means "the same number of polls as the fixed schedule"
+SCHEDULER_POLL_BUDGET_PER_HOUR = float(os.getenv("SCHEDULER_POLL_BUDGET_PER_HOUR", 0))
+
+
+class _TargetState:
+    __slots__ = ("rate", "interval", "last_poll")
+
+    def __init__(self, interval: float):
+        self.rate = None          # EWMA of commits per hour; None until the first poll
+        self.interval = interval
+        self.last_poll = None
+
+
+class AdaptiveScheduler:
+    """Next-due times per target in a heap; intervals adapt to each target's commit rate."""
+
+    def __init__(self, keys: Iterable[Hashable], default_interval: float,
+                 min_interval: float = SCHEDULER_MIN_INTERVAL_SECONDS,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL_SECONDS,
+                 jitter: float = SCHEDULER_JITTER,
+                 alpha: float = SCHEDULER_EWMA_ALPHA,
+                 commits_per_poll: float = SCHEDULER_COMMITS_PER_POLL,
+                 poll_budget_per_hour: float = SCHEDULER_POLL_BUDGET_PER_HOUR,
+                 clock: Callable[[], float] = time.monotonic,
+                 rng: Callable[[], float] = random.random):
+        keys = list(dict.fromkeys(keys))
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.default_interval = min(max(default_interval, self.min_interval), self.max_interval)
+        self.jitter = max(0.0, min(jitter, 0.9))
+        self.alpha = alpha
+        self.commits_per_poll = commits_per_poll
+        self.poll_budget_per_hour = poll_budget_per_hour or len(keys) * 3600.0 / self.default_interval
+        self._clock = clock
+        self._rng = rng
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._heap = []
+        self._next_due: Dict[Hashable, float] = {}   # targets waiting in the heap; absent while running
+        self._triggered = set()                      # triggered while running: due again right after ``record``
+        self._state: Dict[Hashable, _TargetState] = {key: _TargetState(self.default_interval) for key in keys}
+        now = clock()
+        for key in keys:
+            # The first sweep polls every target right away, like the fixed schedule did.
+            self._push(key, now)
+
+    def _push(self, key: Hashable, due: float) -> None:
+        self._next_due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+
+    # ------------------------------------------------------------------
+    # queue
+    # ------------------------------------------------------------------
+    def pop_due(self, now: Optional[float] = None) -> List[Hashable]:
+        """Remove and return the targets that are due; they are scheduled again by ``record``."""
+        now = self._clock() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, _, key = heapq.heappop(self._heap)
+                if self._next_due.get(key) != when:
+                    continue    # superseded by ``trigger``
+                del self._next_due[key]
+                due.append(key)
+        return due
+
+    def trigger(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """
+        Make ``key`` due now (e.g. a push webhook reported a change). A target that is running is
+        due again as soon as its current poll is recorded. Returns False for unknown targets.
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            if key not in self._state:
+                return False
+            if key not in self._next_due:
+                self._triggered.add(key)
+            elif self._next_due[key] > now:
+                self._push(key, now)
+        return True
+
+    def seconds_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next target is due; None while every target is running."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            while self._heap and self._next_due.get(self._heap[0][2]) != self._heap[0][0]:
+                heapq.heappop(self._heap)   # superseded by ``trigger``
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - now)
+
+    # ------------------------------------------------------------------
+    # adaptation
+    # ------------------------------------------------------------------
+    def record(self, key: Hashable, commits: int, window_seconds: Optional[float] = None,
+               now: Optional[float] = None) -> float:
+        """
+        Update ``key``'s commit rate after a poll that found ``commits`` new commits and schedule it again.
+
+        ``window_seconds`` is the period those commits arrived in; it defaults to the time since the
+        previous poll (or the default interval for the first poll). Returns the new interval.
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            state = self._state[key]
+            if window_seconds is None:
+                window_seconds = now - state.last_poll if state.last_poll is not None else self.default_interval
+            sample = max(0, commits) * 3600.0 / max(window_seconds, 1.0)
+            state.rate = sample if state.rate is None else self.alpha * sample + (1 - self.alpha) * state.rate
+            state.last_poll = now
+
+            desired = {k: self._desired_interval(s) for k, s in self._state.items()}
+            polls_per_hour = sum(3600.0 / interval for interval in desired.values())
+            scale = max(1.0, polls_per_hour / self.poll_budget_per_hour)
+            interval = min(desired[key] * scale, self.max_interval)
+            state.interval = interval
+            jittered = interval * (1 + self.jitter * (2 * self._rng() - 1))
+            if key in self._triggered:
+                self._triggered.discard(key)
+                jittered = 0.0
+            self._push(key, now + jittered)
+        return interval
+
+    def _desired_interval(self, state: _TargetState) -> float:
+        if state.rate is None:
+            return self.default_interval
+        if state.rate <= 0:
+            return self.max_interval
+        return min(max(self.commits_per_poll * 3600.0 / state.rate, self.min_interval), self.max_interval)
+
+    def snapshot(self) -> Dict[Hashable, dict]:
+        """Rate (commits/hour) and current interval per target, for logging."""
+        with self._lock:
+            return {
+                key: {"rate": round(state.rate, 3) if state.rate is not None else None, "interval": round(state.interval)}
+                for key, state in self._state.items()
+            }
@@ -1,17 +1,34 @@
 # 导入必要的库和模块
 import requests
+import contextvars
 import datetime
 import os  
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv  
 from logs import logger  
-from commit_fetch import CommitFetcher  # GitHub提交数据获取器
+from commit_fetch import CommitFetcher, parse_topic_path  # GitHub提交数据获取器
 from cosmosdb_client import CosmosDBHandler  # CosmosDB数据库操作处理器
 from call_gpt import CallGPT  # GPT模型调用器
 from teams_notifier import TeamsNotifier  # Teams通知发送器
+from gpt_reply import track_gpt_calls, collecting_gpt_requests  # 按commit统计GPT重试
+from gpt_batch import GPT_BATCH_MODE, run_batch_rounds  # Batch API离线模式
+from watermark_store import watermark_store  # 每个目标的爬取水位
+from commit_history_writer import commit_history_writer  # commit记录的异步批量写入
+from weekly_digest import WeeklyDigestStore, is_important, last_week_start  # 按周增量维护的周汇总文档
 
 # 加载环境变量
 load_dotenv(override=True)  # 允许覆盖环境变量  
 PERSONAL_TOKEN = os.getenv("PERSONAL_TOKEN")  # GitHub访问令牌  
+# 并行分析commit（获取patch + GPT分析）的线程数，1 表示逐个处理
+COMMIT_PIPELINE_WORKERS = int(os.getenv("COMMIT_PIPELINE_WORKERS", 1))
+
+# 周总结的 Batch API 任务：(topic, language, root_commits_url, 周) -> 后台线程
+# 轮询可能持续 GPT_BATCH_TIMEOUT_HOURS，放在目标线程池之外执行，不占用处理实时commit的工作线程
+_weekly_batch_threads = {}
+_weekly_batch_lock = threading.Lock()
   
 class Spyder(CommitFetcher, CallGPT, TeamsNotifier):  
     """
@@ -21,7 +38,16 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
     - CallGPT: GPT模型调用功能  
     - TeamsNotifier: Teams通知发送功能
     """
-    def __init__(self, topic, root_commits_url, language, teams_webhook_url, show_topic_in_title, system_prompt_dict, max_input_token, gpt_analysis_mode="legacy"):  
+    # 设置调度间隔为7200秒（2小时）
+    schedule = 7200
+    # 是否先经 Batch API 离线生成GPT结果；实时commit分析始终走交互式调用，仅回填（--batch）时打开
+    gpt_batch_mode = False
+    # commit记录上传成功后是否推进该目标的爬取水位（回填历史区间时关闭）
+    update_watermark = True
+    # 本目标的周汇总文档（WEEKLY_DIGEST_ENABLED 关闭时不读写）
+    weekly_digest = None
+
+    def __init__(self, topic, root_commits_url, language, teams_webhook_url, show_topic_in_title, system_prompt_dict, max_input_token, gpt_analysis_mode="legacy", deadline=None, start_time=None, prefetched_commits=None):  
         """
         初始化爬虫实例
         
@@ -34,6 +60,10 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             system_prompt_dict (dict): GPT系统提示词字典
             max_input_token (int): GPT输入的最大token数量限制
             gpt_analysis_mode (str): GPT分析模式，"legacy"或"structured"，默认"legacy"
+            deadline (float, optional): time.monotonic()下的截止时间，超过后停止处理剩余commit
+            start_time (datetime, optional): 已确定的起始时间点（共享仓库抓取时由planner计算），为None时查询数据库
+            prefetched_commits (dict, optional): 共享仓库抓取已分配给本目标的commit {datetime: url}，
+                                                 为None时自行请求commit列表
         """
         # 保存配置参数
         self.topic = topic
@@ -44,34 +74,44 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
         self.max_input_token = max_input_token
         self.show_topic_in_title = show_topic_in_title
         self.gpt_analysis_mode = gpt_analysis_mode  # 新增：GPT分析模式
+        self.deadline = deadline
+        self.pipeline_workers = COMMIT_PIPELINE_WORKERS
 
         # 设置GitHub API请求头，包含认证令牌
         self.headers = {"Authorization": "token " + PERSONAL_TOKEN}
         # api_url = 'https://api.github.com/repos/MicrosoftDocs/azure-docs/commits'
         
-        # 设置调度间隔为7200秒（2小时）
-        self.schedule = 7200
-        
         # 初始化CosmosDB处理器和客户端
         self.cosmosDB = CosmosDBHandler()
         self.cosmosDB_client = self.cosmosDB.initialize_cosmos_client()
+        self.weekly_digest = WeeklyDigestStore(self.cosmosDB_client, self.topic, self.language, self.root_commits_url)
         
-        # 从数据库获取最新的提交记录，用于确定起始时间点
-        lastest_commit_in_cosmosdb = self.cosmosDB_client.get_lastest_commit(self.topic, self.language, self.root_commits_url, sort_order = 'DESC')
-
-        # 确定爬取的起始时间点，避免重复处理已处理的提交
-        self.start_time = self.cosmosDB.get_start_time(lastest_commit_in_cosmosdb)
+        # 根据数据库中的最新提交记录确定爬取的起始时间点，避免重复处理已处理的提交
+        if start_time is None:
+            start_time = self.cosmosDB.get_target_start_time(self.cosmosDB_client, self.topic, self.language, self.root_commits_url)
+        self.start_time = start_time
         
-        # 获取所有提交记录
-        all_commits = self.get_all_commits(self.root_commits_url, self.headers)
+        if prefetched_commits is not None:
+            # 同一仓库的commit已由共享抓取统一获取并按路径分配，不再单独请求commit列表
+            self.topic_path = parse_topic_path(self.root_commits_url)
+            all_commits = prefetched_commits
+        else:
+            # 获取起始时间之后的所有提交记录（自动翻页）
+            all_commits = self.get_all_commits(self.root_commits_url, self.headers, since=self.start_time)
         
         # 筛选出需要处理的最新提交记录
         self.latest_commits, self.latest_time = self.select_latest_commits(all_commits, self.start_time)  
 
         logger.info(f"Only get changes after the time point: {self.start_time}")
-        
-        # 初始化提交历史记录字典，用于临时存储处理过程中的数据
-        self.commit_history = {}
+
+    def deadline_exceeded(self):
+        """
+        判断是否已超过本目标的处理截止时间（由eyes_on_docs中的线程池设置）
+
+        Returns:
+            bool: 超时返回True，未设置截止时间时始终返回False
+        """
+        return self.deadline is not None and time.monotonic() > self.deadline
 
     def determine_status(self, gpt_title):  
         """
@@ -87,6 +127,9 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
         Returns:
             str: 'skip' 表示跳过，'post' 表示发送通知
         """
+        if gpt_title is None and collecting_gpt_requests():
+            # Batch API 收集阶段标题请求只是被记录下来，还没有可判断的标题
+            return None
         # 检查标题是否以'0 '开头来决定是否跳过此次提交
         if gpt_title.startswith('0 '):  
             status = 'skip'  
@@ -96,7 +139,7 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             logger.info(f"GPT title (without first 2 chars): {gpt_title[2:]}")  
         return status  
 
-    def generate_gpt_responses(self, commit_patch_data, language, prompts, url_mapping):  
+    def generate_gpt_responses(self, commit_patch_data, language, prompts, url_mapping, commit_history):  
         """
         使用GPT生成提交的摘要、标题和状态
         
@@ -109,6 +152,7 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             language (str): 输出语言
             prompts (dict): GPT提示词字典
             url_mapping (dict): URL映射配置，用于修正文档链接
+            commit_history (dict): 本commit的处理记录，token用量等中间结果写入其中
             
         Returns:
             tuple: (gpt_summary, gpt_title, status) 
@@ -117,39 +161,42 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
         if self.gpt_analysis_mode == "structured":
             # 新的 structured output 模式
             logger.info("Using structured output mode for GPT analysis")
-            return self._generate_gpt_responses_structured(commit_patch_data, language, prompts, url_mapping)
+            return self._generate_gpt_responses_structured(commit_patch_data, language, prompts, url_mapping, commit_history)
         else:
             # 传统的 legacy 模式
             logger.info("Using legacy mode for GPT analysis")
-            return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping)
+            return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping, commit_history)
     
-    def _generate_gpt_responses_legacy(self, commit_patch_data, language, prompts, url_mapping):
+    def _generate_gpt_responses_legacy(self, commit_patch_data, language, prompts, url_mapping, commit_history):
         """
         传统的两次GPT调用模式
         """
         # 第一步：使用GPT生成提交内容摘要
         gpt_summary, gpt_summary_tokens, commit_patch_data = self.gpt_summary(commit_patch_data, language, prompts["GPT_SUMMARY_PROMPT"], url_mapping)  
+        if gpt_summary is None and collecting_gpt_requests():
+            # Batch API 收集阶段：标题依赖摘要，等下一轮摘要命中缓存后再收集标题请求
+            return None, None, None
         # self.update_commit_history("gpt_summary_response", gpt_summary)  # 注释掉的代码保留
         
         # 记录摘要生成消耗的token数
-        self.update_commit_history("gpt_summary_tokens", gpt_summary_tokens)
+        self.update_commit_history(commit_history, "gpt_summary_tokens", gpt_summary_tokens)
         
         # 记录处理后的提交补丁数据
-        self.update_commit_history("commit_patch_data", commit_patch_data)
+        self.update_commit_history(commit_history, "commit_patch_data", commit_patch_data)
         
         # 第二步：基于摘要生成标题
         gpt_title, gpt_title_tokens = self.gpt_title(gpt_summary, language, prompts["GPT_TITLE_PROMPT"])  
         # self.update_commit_history("gpt_title_response", gpt_title)  # 注释掉的代码保留
         
         # 记录标题生成消耗的token数
-        self.update_commit_history("gpt_title_tokens", gpt_title_tokens)
+        self.update_commit_history(commit_history, "gpt_title_tokens", gpt_title_tokens)
         
         # 第三步：根据生成的标题判断处理状态
         status = self.determine_status(gpt_title)  
         
         return gpt_summary, gpt_title, status
         
-    def _generate_gpt_responses_structured(self, commit_patch_data, language, prompts, url_mapping):
+    def _generate_gpt_responses_structured(self, commit_patch_data, language, prompts, url_mapping, commit_history):
         """
         新的 structured output 一次调用模式
         """
@@ -160,9 +207,12 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             )
             
             if gpt_summary is None or gpt_title is None or importance_score is None:
+                if collecting_gpt_requests():
+                    # Batch API 收集阶段请求只是被记录下来，不能当作失败去收集 legacy 模式的请求
+                    return None, None, None
                 # 如果 structured 模式失败，fallback 到 legacy 模式
                 logger.warning("Structured output failed, falling back to legacy mode")
-                return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping)
+                return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping, commit_history)
             
             # 根据 importance_score 直接确定状态，不需要调用 determine_status
             if importance_score == 0:
@@ -177,23 +227,23 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             formatted_gpt_title = f"{importance_score} {gpt_title}"
             
             # 记录token使用情况（structured模式只有一次调用的token）
-            self.update_commit_history("gpt_structured_tokens", gpt_tokens)
+            self.update_commit_history(commit_history, "gpt_structured_tokens", gpt_tokens)
             # 为了保持兼容性，也记录到原有的字段中
-            self.update_commit_history("gpt_summary_tokens", gpt_tokens)
-            self.update_commit_history("gpt_title_tokens", {"prompt": 0, "completion": 0, "total": 0})  # 标题是同时生成的，所以为0
+            self.update_commit_history(commit_history, "gpt_summary_tokens", gpt_tokens)
+            self.update_commit_history(commit_history, "gpt_title_tokens", {"prompt": 0, "completion": 0, "total": 0})  # 标题是同时生成的，所以为0
             
             # 记录处理后的提交补丁数据
-            self.update_commit_history("commit_patch_data", processed_patch_data)
+            self.update_commit_history(commit_history, "commit_patch_data", processed_patch_data)
             
             # 记录额外的 structured 模式特有信息
-            self.update_commit_history("importance_score", importance_score)
-            self.update_commit_history("importance_score_reasoning", importance_score_reasoning)
+            self.update_commit_history(commit_history, "importance_score", importance_score)
+            self.update_commit_history(commit_history, "importance_score_reasoning", importance_score_reasoning)
             
             return gpt_summary, formatted_gpt_title, status
             
         except Exception as e:
             logger.exception("Exception in structured mode, falling back to legacy mode:", e)
-            return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping)  
+            return self._generate_gpt_responses_legacy(commit_patch_data, language, prompts, url_mapping, commit_history)  
     
     def generate_weekly_summary(self):
         """
@@ -210,20 +260,32 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
         - 周一的前2小时内（避免重复生成）
         - 或者数据库中没有本周的总结记录
         """
-        # 清空提交历史记录，为周总结生成做准备
-        self.commit_history.clear()
+        # 周总结使用独立的记录字典
+        commit_history = {}
         logger.warning(f"Get last week summary from CosmosDB")
         
-        # 从数据库获取上周的所有相关提交记录
-        weekly_commit_list = self.cosmosDB_client.get_weekly_commit(self.topic, self.language, self.root_commits_url, sort_order = 'DESC')
+        # 优先点读上周的周汇总文档；没有时（功能开启前的周）从数据库查询上周的所有相关提交记录
+        last_week = last_week_start()
+        digest = self.weekly_digest.load(last_week) if self.weekly_digest is not None else None
+        if digest is not None:
+            logger.info(f"Use weekly digest of {last_week}: {len(digest.get('entries', []))} commits, {digest.get('total_tokens', 0)} tokens")
+            weekly_commit_list = WeeklyDigestStore.commit_list(digest)
+        else:
+            weekly_commit_list = self.cosmosDB_client.get_weekly_commit(self.topic, self.language, self.root_commits_url, sort_order = 'DESC')
         
         if weekly_commit_list:
             logger.info(f"Find {len(weekly_commit_list)} last week summary in CosmosDB")
             
-            # 使用GPT基于上周的提交列表生成周总结
-            gpt_weekly_summary_response, gpt_weekly_summary_tokens = self.generate_weekly_summary_using_weekly_commit_list(
+            summarize = lambda: self.generate_weekly_summary_using_weekly_commit_list(
                 self.language, weekly_commit_list, self.system_prompt_dict["GPT_WEEKLY_SUMMARY_PROMPT"], self.max_input_token
                 )
+            if (self.gpt_batch_mode or GPT_BATCH_MODE) and not self.weekly_batch_finished(last_week, summarize):
+                # 周总结不需要实时返回：等 Batch API 的结果写入响应缓存后，由之后某一轮生成
+                logger.warning(f"Weekly summary of {last_week} is waiting for Batch API results, check again next cycle")
+                return
+
+            # 使用GPT基于上周的提交列表生成周总结
+            gpt_weekly_summary_response, gpt_weekly_summary_tokens = summarize()
             try:
                 # 获取当前UTC时间作为周总结的时间戳
                 time = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
@@ -240,7 +302,7 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
                     if self.teams_webhook_url:
                         logger.warning(f"Push weekly summary report to teams")
                         # 发送周总结消息到Teams频道
-                        teams_message_jsondata, post_status, error_message = self.post_teams_message(gpt_weekly_summary_title, time, gpt_weekly_summary_response, self.teams_webhook_url)
+                        teams_message_jsondata, post_status, error_message = self.send_teams_message(gpt_weekly_summary_title, time, gpt_weekly_summary_response, self.teams_webhook_url, commit_history=commit_history)
                         logger.debug(f"Teams Message jsonData: {teams_message_jsondata}")
                     else:
                         logger.warning(f"Skip sending weekly summary to teams: no webhook URL configured")
@@ -251,18 +313,19 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
                         }
 
                     # 保存周总结记录到数据库
-                    self.save_commit_history(time, "", "", teams_message_jsondata, post_status, error_message)
+                    self.save_commit_history(commit_history, time, "", "", teams_message_jsondata, post_status, error_message)
                     
                     # 记录周总结生成消耗的token数
-                    self.update_commit_history("gpt_weekly_summary_tokens", gpt_weekly_summary_tokens)
-                    self.update_commit_history("teams_message_webhook_url", self.teams_webhook_url)
+                    self.update_commit_history(commit_history, "gpt_weekly_summary_tokens", gpt_weekly_summary_tokens)
+                    self.update_commit_history(commit_history, "teams_message_webhook_url", self.teams_webhook_url)
                 else:
                     logger.warning(f"No weekly summary report to teams")
                     # 如果没有生成有效的周总结，记录失败状态
-                    self.save_commit_history(time, "", "", "", "failed", "No important update last week")
+                    self.save_commit_history(commit_history, time, "", "", "", "failed", "No important update last week")
                 
-                # 上传提交历史到数据库
-                self.upload_commit_history()
+                # 上传提交历史到数据库，周总结已保存时在周汇总文档上记录，之后的检查只需一次点读
+                if self.upload_commit_history(commit_history) and gpt_weekly_summary_response and self.weekly_digest is not None:
+                    self.weekly_digest.mark_summarized(last_week, "post")
 
             except requests.exceptions.HTTPError as err:
                 logger.error(f"Error occured while sending message to Teams: {err}")
@@ -272,6 +335,50 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
                 logger.exception("Unknown Exception in post_teams_message:", err)
         else:
             logger.warning(f"Last week summary in CosmosDB is empty")
+            # 上周没有重要更新，记录下来，避免每轮都重新检查
+            if self.weekly_digest is not None:
+                self.weekly_digest.mark_summarized(last_week, "empty")
+
+    def weekly_batch_finished(self, week, analyze):
+        """
+        本目标 week 周的周总结 Batch API 任务是否已结束
+
+        第一次调用时在后台线程中启动 run_batch_rounds(analyze) 并返回False；线程结束前一直返回False，
+        之后返回True，调用方再走正常流程，命中缓存的请求不再调用实时接口（失败的部分照常实时调用）
+
+        Returns:
+            bool: 已结束返回True
+        """
+        key = (self.topic, self.language, self.root_commits_url, week)
+        with _weekly_batch_lock:
+            thread = _weekly_batch_threads.get(key)
+            if thread is None:
+                thread = threading.Thread(target=run_batch_rounds, args=(analyze,), name=f"weekly-batch-{self.topic}", daemon=True)
+                _weekly_batch_threads[key] = thread
+                thread.start()
+                return False
+        return not thread.is_alive()
+
+    def has_weekly_summary(self):
+        """
+        本周是否已经生成过周总结（汇总的是上周的commit）
+
+        开启周汇总文档时先点读上周的汇总文档，已记录 summary_status 时直接返回；
+        没有汇总文档或尚未记录状态时（例如周总结已保存但写回状态失败）退回 check_weekly_summary 查询，
+        查到周总结时补写汇总文档的状态，之后的检查又只需点读
+
+        Returns:
+            bool: 已生成返回True
+        """
+        digest = None
+        if self.weekly_digest is not None:
+            digest = self.weekly_digest.load(last_week_start())
+            if digest is not None and digest.get("summary_status"):
+                return True
+        found = self.cosmosDB_client.check_weekly_summary(self.topic, self.language, self.root_commits_url) is not None
+        if found and digest is not None:
+            self.weekly_digest.mark_summarized(last_week_start(), "post")
+        return found
 
     def generate_weekly_title(self):
         """
@@ -302,115 +409,189 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
         3. 判断是否需要发送通知
         4. 发送Teams通知（如果需要）
         5. 保存处理结果到数据库
+
+        步骤1-3（analyze_commit）可以由 COMMIT_PIPELINE_WORKERS 个线程并行执行，
+        步骤4-5（publish_commit）始终在当前线程中按commit时间顺序执行，
+        因此Teams消息和CosmosDB记录的顺序与串行处理时一致。
         
         Args:
             selected_commits (dict): 筛选出的提交字典，格式为{时间: API_URL}
             url_mapping (dict): URL映射配置，用于修正文档链接
         """
-        # 遍历每个选中的提交记录
-        for key in selected_commits:
+        # 按时间顺序遍历每个分析完成的提交记录
+        for analyzed_commit in self._iter_analyzed_commits(selected_commits, url_mapping):
             try:
-                # 初始化变量，避免在异常情况下变量未定义
-                time_, commit_url, status, teams_message_jsondata, post_status, error_message, gpt_title, gpt_summary = None, None, None, None, None, None, None, None
-
-                # 从字典中提取时间和API URL
-                time_, url = key, selected_commits[key]
-
-                # 将GitHub API URL转换为网页URL，便于用户点击查看
-                # 例如：从 https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/abc123
-                # 转换为：https://github.com/MicrosoftDocs/azure-docs/commit/abc123
-                commit_url = url.replace("https://api.github.com/repos", "https://github.com").replace("commits", "commit")
-                logger.warning(f"Getting changes from html_url: {commit_url}")  
-
-                try:
-                    # 获取提交的详细变更数据（补丁数据）
-                    # input_dic, time_, summary, commit_url = self.get_change_from_each_url(time_, url, self.max_input_token)  # 旧版本代码注释
-                    commit_patch_data = self.get_change_from_each_url(time_, url, self.max_input_token, self.headers)
-                except Exception as e:
-                    logger.error(f"Error getting change from url: {url}, Exception: {e}")
-                    logger.exception("Exception in process_each_commit:", e)
-                    
-                # 初始化Teams消息相关变量
-                teams_message_jsondata = None
-                post_status = None
-                error_message = None
+                self.publish_commit(*analyzed_commit)
+            except Exception as e:  
+                logger.exception("Unexpected exception:", e)  
+
+    def _iter_analyzed_commits(self, selected_commits, url_mapping):
+        """
+        按commit时间顺序产出分析结果
+
+        并行模式下最多同时有 2 * COMMIT_PIPELINE_WORKERS 个commit在分析中，
+        GPT调用的总速率由 gpt_reply 中共享的TPM额度限制。
+        超时后停止提交新的commit，已在分析中的commit结果也不再发布，下一轮会重新处理。
+        """
+        workers = self.pipeline_workers
+        if workers <= 1:
+            for time_, url in selected_commits.items():
+                # 超时后停止处理剩余commit；未处理的commit没有写入CosmosDB，下一轮会从最新记录之后继续
+                if self.deadline_exceeded():
+                    logger.warning(f"Target timeout reached, stop processing remaining commits for topic: {self.topic}")
+                    return
+                yield self.analyze_commit(time_, url, url_mapping)
+            return
+
+        logger.info(f"Analyzing {len(selected_commits)} commits with {workers} pipeline workers")
+        pending = deque()
+        commits = iter(selected_commits.items())
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="commit") as executor:
+            try:
+                while True:
+                    # 保持分析窗口填满，窗口大小限制内存中等待发布的commit数量
+                    while len(pending) < workers * 2 and not self.deadline_exceeded():
+                        next_commit = next(commits, None)
+                        if next_commit is None:
+                            break
+                        # 在当前上下文的副本中执行，collect_gpt_requests() 的收集器随之传给工作线程
+                        pending.append(executor.submit(contextvars.copy_context().run, self.analyze_commit,
+                                                       next_commit[0], next_commit[1], url_mapping))
+                    if not pending:
+                        break
+                    if self.deadline_exceeded():
+                        logger.warning(f"Target timeout reached, stop processing remaining commits for topic: {self.topic}")
+                        break
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
 
-                # commit_patch_data = input_dic.get("commits")  # 旧版本代码注释
+    def analyze_commit(self, time_, url, url_mapping):
+        """
+        获取单个commit的变更数据并调用GPT生成摘要和标题（可在工作线程中并行执行）
+
+        所有中间结果都写入本commit独立的 commit_history 字典，不修改实例状态。
+
+        Args:
+            time_ (datetime): commit时间
+            url (str): commit的API URL
+            url_mapping (dict): URL映射配置，用于修正文档链接
+
+        Returns:
+            tuple: (time_, commit_url, gpt_summary, gpt_title, status, commit_history)
+        """
+        # 本commit的处理记录，最终会上传到CosmosDB
+        commit_history = {}
+        # 初始化变量，避免在异常情况下变量未定义
+        commit_url, status, gpt_title, gpt_summary = None, None, None, None
+        try:
+            # 将GitHub API URL转换为网页URL，便于用户点击查看
+            # 例如：从 https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/abc123
+            # 转换为：https://github.com/MicrosoftDocs/azure-docs/commit/abc123
+            commit_url = url.replace("https://api.github.com/repos", "https://github.com").replace("commits", "commit")
+            logger.warning(f"Getting changes from html_url: {commit_url}")  
+
+            try:
+                # 获取提交的详细变更数据（补丁数据）
+                commit_patch_data = self.get_change_from_each_url(time_, url, self.max_input_token, self.headers)
+            except Exception as e:
+                logger.error(f"Error getting change from url: {url}, Exception: {e}")
+                logger.exception("Exception in process_each_commit:", e)
+                commit_patch_data = "Error"
+
+            # 检查是否成功获取到补丁数据
+            if commit_patch_data == "Error":
+                # 如果获取补丁数据失败，设置错误消息
+                logger.error(f"Error getting patch data from url: {commit_url}")
+                gpt_summary = "Too many changes in one commit.🤦‍♂️ \n\nThe bot isn't smart enough to handle temporarily.😢 \n\nPlease check the update via commit page button.🤪"
+                gpt_title = "Error in Getting Patch Data"
+                status = "Error in Getting Patch Data"
+            else:
+                # 使用GPT模型生成摘要和标题，同一commit的GPT调用共享重试等待上限，重试统计随记录保存
+                with track_gpt_calls() as gpt_call_metrics:
+                    gpt_summary, gpt_title, status = self.generate_gpt_responses(commit_patch_data, self.language, self.system_prompt_dict, url_mapping, commit_history)  
+                self.update_commit_history(commit_history, "gpt_call_metrics", gpt_call_metrics.as_dict())
                 
-                # 检查是否成功获取到补丁数据
-                if commit_patch_data == "Error":
-                    # 如果获取补丁数据失败，设置错误消息
-                    logger.error(f"Error getting patch data from url: {commit_url}")
-                    gpt_summary = "Too many changes in one commit.🤦‍♂️ \n\nThe bot isn't smart enough to handle temporarily.😢 \n\nPlease check the update via commit page button.🤪"
-                    gpt_title = "Error in Getting Patch Data"
-                    status = "Error in Getting Patch Data"
-                else:
-                    # 使用GPT模型生成摘要和标题
-                    gpt_summary, gpt_title, status = self.generate_gpt_responses(commit_patch_data, self.language, self.system_prompt_dict, url_mapping)  
-                    # Save commit history to CosmosDB  
-                    
-                    # 检查GPT是否成功生成摘要
-                    if gpt_summary == None:
-                        gpt_summary = "Something went wrong when generating Summary😂.\n\n You can report the issue(\"...\" -> Copy link) to zehua@micrsoft.com, thanks."
-                        gpt_title = "Error in getting Summary"
-                        status = "Error in getting Summary"
-                    else:
-                        # 检查GPT是否成功生成标题
-                        if gpt_title == None:
-                            gpt_title = "Error in getting Title"
-                            status = "Error in getting Title"
-                        else:
-                            # 根据GPT生成的标题判断是否需要发送通知
-                            if status == "skip":
-                                logger.info(f"Skip this commit: {gpt_title}")
-                            else:
-                                # 准备发送Teams通知
-                                # lastest_commit_in_cosmosdb = cosmos_conversation_client.get_lastest_commit(self.topic, self.language, self.root_commits_url, sort_order = 'DESC')  # 旧版本代码注释
-                                # if self.get_similarity(input_dic, self.language, lastest_commit_in_cosmosdb, self.system_prompt_dict["GPT_SIMILARITL_PROMPT"]).split("\n")[1][0] == "1":  # 旧版本相似性检查代码注释
-                                #     logger.error(f"Error detected content as similar to the previous entry, therefore skipping.")
-                                # else:
-                                
-                                # 记录标题（去掉前两个字符，通常是数字和空格）
-                                logger.warning(f"GPT_Title without first 2 chars: {gpt_title[2:]}")
-                                
-                                # 根据配置决定是否在通知中显示主题名称
-                                if self.show_topic_in_title:
-                                    time = self.topic + "\n\n" + str(time_)
-                                else:
-                                    time = time_
-                                    
-                                # 如果配置了Teams webhook，发送通知
-                                if self.teams_webhook_url:
-                                    teams_message_jsondata, post_status, error_message = self.post_teams_message(gpt_title[2:], time, gpt_summary, self.teams_webhook_url, commit_url)
-                                    # print(gpt_title[2:]+"\n\n"+gpt_summary+"\n\n")  # 调试代码注释
+                # 检查GPT是否成功生成摘要
+                if gpt_summary == None:
+                    gpt_summary = "Something went wrong when generating Summary😂.\n\n You can report the issue(\"...\" -> Copy link) to zehua@micrsoft.com, thanks."
+                    gpt_title = "Error in getting Summary"
+                    status = "Error in getting Summary"
+                elif gpt_title == None:
+                    # 检查GPT是否成功生成标题
+                    gpt_title = "Error in getting Title"
+                    status = "Error in getting Title"
+        except Exception as e:  
+            logger.exception("Unexpected exception:", e)  
 
-            except Exception as e:  
-                logger.exception("Unexpected exception:", e)  
+        return time_, commit_url, gpt_summary, gpt_title, status, commit_history
 
-            try: 
-                # 上传提交历史到CosmosDB数据库
-                self.update_commit_history("gpt_summary_response", gpt_summary)
-                self.update_commit_history("gpt_title_response", gpt_title)
+    def publish_commit(self, time_, commit_url, gpt_summary, gpt_title, status, commit_history):
+        """
+        发送Teams通知（如果需要）并把commit记录上传到CosmosDB，必须按commit时间顺序调用
+
+        Args:
+            time_ (datetime): commit时间
+            commit_url (str): commit的网页URL
+            gpt_summary (str): GPT生成的摘要
+            gpt_title (str): GPT生成的标题
+            status (str): analyze_commit得到的处理状态
+            commit_history (dict): 本commit的处理记录
+        """
+        # 初始化Teams消息相关变量
+        teams_message_jsondata = None
+        post_status = None
+        error_message = None
 
-                # 保存本次处理的完整历史记录
-                self.save_commit_history(time_, commit_url, status, teams_message_jsondata, post_status, error_message) 
+        try:
+            # 根据GPT生成的标题判断是否需要发送通知
+            if status == "skip":
+                logger.info(f"Skip this commit: {gpt_title}")
+            elif status == "post":
+                # 记录标题（去掉前两个字符，通常是数字和空格）
+                logger.warning(f"GPT_Title without first 2 chars: {gpt_title[2:]}")
                 
-                # 将记录上传到数据库
-                self.upload_commit_history()
-            except Exception as e:  
-                logger.exception("Unexpected exception:", e)                  
+                # 根据配置决定是否在通知中显示主题名称
+                if self.show_topic_in_title:
+                    time = self.topic + "\n\n" + str(time_)
+                else:
+                    time = time_
+                    
+                # 如果配置了Teams webhook，发送通知（开启 TEAMS_OUTBOX_ENABLED 时放入发件箱异步发送）
+                if self.teams_webhook_url:
+                    teams_message_jsondata, post_status, error_message = self.send_teams_message(gpt_title[2:], time, gpt_summary, self.teams_webhook_url, commit_url, commit_history)
+        except Exception as e:  
+            logger.exception("Unexpected exception:", e)  
 
-            # 清空提交历史记录，为下一个提交的处理做准备
-            self.commit_history.clear()
+        try: 
+            # 上传提交历史到CosmosDB数据库
+            self.update_commit_history(commit_history, "gpt_summary_response", gpt_summary)
+            self.update_commit_history(commit_history, "gpt_title_response", gpt_title)
+
+            # 保存本次处理的完整历史记录
+            self.save_commit_history(commit_history, time_, commit_url, status, teams_message_jsondata, post_status, error_message) 
+            
+            # 将记录上传到数据库，成功后推进水位，崩溃重启后从这个commit之后继续
+            if self.upload_commit_history(commit_history):
+                if self.update_watermark:
+                    commit_sha = commit_url.rstrip("/").rsplit("/", 1)[-1] if commit_url else None
+                    watermark_store.advance((self.topic, self.language, self.root_commits_url), time_, commit_sha)
+                # 重要commit加入所在周的周汇总文档
+                if self.weekly_digest is not None and is_important(status, gpt_title):
+                    self.weekly_digest.add_commit(time_, commit_url, gpt_title, gpt_summary)
+        except Exception as e:  
+            logger.exception("Unexpected exception:", e)                  
   
-    def save_commit_history(self, commit_time, commit_url=None, status=None, teams_message_jsondata=None, post_status=None, error_message=None):  
+    def save_commit_history(self, commit_history, commit_time, commit_url=None, status=None, teams_message_jsondata=None, post_status=None, error_message=None):  
         """
         保存提交历史记录到内存字典
         
-        这个方法将处理结果保存到 self.commit_history 字典中，
+        这个方法将处理结果保存到本commit的 commit_history 字典中，
         稍后会通过 upload_commit_history() 方法上传到CosmosDB数据库
         
         Args:
+            commit_history (dict): 本commit的处理记录
             commit_time (str): 提交时间
             commit_url (str, optional): 提交的网页URL
             status (str, optional): 处理状态（'post', 'skip', 'error'等）
@@ -418,42 +599,52 @@ class Spyder(CommitFetcher, CallGPT, TeamsNotifier):
             post_status (str, optional): Teams消息发送状态（'success', 'failed'）
             error_message (str, optional): 错误消息（如果有）
         """
-        self.update_commit_history("commit_time", str(commit_time)) 
-        self.update_commit_history("commit_url", str(commit_url)) 
-        self.update_commit_history("status", status) 
-        self.update_commit_history("topic", self.topic) 
-        self.update_commit_history("language", self.language) 
-        self.update_commit_history("root_commits_url", self.root_commits_url) 
-        self.update_commit_history("teams_message_webhook_url", self.teams_webhook_url)
-        self.update_commit_history("teams_message_jsondata", teams_message_jsondata) 
-        self.update_commit_history("post_status", post_status) 
-        self.update_commit_history("error_message", error_message) 
-
-    def update_commit_history(self, key, value):  
+        self.update_commit_history(commit_history, "commit_time", str(commit_time)) 
+        self.update_commit_history(commit_history, "commit_url", str(commit_url)) 
+        self.update_commit_history(commit_history, "status", status) 
+        self.update_commit_history(commit_history, "topic", self.topic) 
+        self.update_commit_history(commit_history, "language", self.language) 
+        self.update_commit_history(commit_history, "root_commits_url", self.root_commits_url) 
+        self.update_commit_history(commit_history, "teams_message_webhook_url", self.teams_webhook_url)
+        self.update_commit_history(commit_history, "teams_message_jsondata", teams_message_jsondata) 
+        self.update_commit_history(commit_history, "post_status", post_status) 
+        self.update_commit_history(commit_history, "error_message", error_message) 
+
+    def update_commit_history(self, commit_history, key, value):  
         """  
         更新提交历史记录字典中的单个字段
         
-        这是一个通用的字段更新方法，用于向 self.commit_history 字典添加或更新数据
+        这是一个通用的字段更新方法，用于向本commit的 commit_history 字典添加或更新数据。
+        每个commit使用独立的字典，因此多个commit可以在不同线程中同时分析。
         
         Args:
+            commit_history (dict): 本commit的处理记录
             key (str): 记录的键名
             value: 记录的值（可以是任意类型）
         """  
-        self.commit_history[key] = value  
+        commit_history[key] = value  
 
-    def upload_commit_history(self):
+    def upload_commit_history(self, commit_history):
         """
-        将内存中的提交历史记录上传到CosmosDB数据库
+        将提交历史记录上传到CosmosDB数据库
         
-        这个方法将 self.commit_history 字典中的数据保存到数据库，
-        成功或失败都会记录相应的日志，处理完成后清空内存中的历史记录
+        这个方法将 commit_history 字典中的数据保存到数据库，
+        成功或失败都会记录相应的日志。
+        开启 COMMIT_HISTORY_WRITE_BEHIND 时记录先写入本地落盘文件并排队，由后台线程批量写入CosmosDB，
+        落盘成功即视为上传成功；落盘失败时退回同步写入
+        
+        Args:
+            commit_history (dict): 本commit的处理记录
+
+        Returns:
+            bool: 是否上传成功
         """
-        if self.cosmosDB_client.create_commit_history(self.commit_history):  
+        if commit_history_writer.submit(commit_history):
+            logger.info("Queued commit history for CosmosDB (write-behind)")
+            return True
+        if self.cosmosDB_client.create_commit_history(commit_history):  
             logger.info("Successfully created commit history in CosmosDB!")  
+            return True
         else:  
-            logger.error("Failed to create commit history in CosmosDB!")  
-        
-        # 清空提交历史记录，为下一次处理做准备
-        self.commit_history.clear()
-    
-    
\ No newline at end of file
+            logger.error("Failed to create commit history in CosmosDB!")
+            return False  
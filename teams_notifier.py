@@ -1,32 +1,47 @@
+import uuid
+
 import requests
 from logs import logger  
+from cosmosdbservice import PARTITION_KEY_FIELD, partition_key_value
+from teams_outbox import QUEUED, TEAMS_POST_TIMEOUT_SECONDS, build_message_card, teams_outbox
 
 class TeamsNotifier:
     def post_teams_message(self, title, time, summary, teams_webhook_url, commit_url=None):
-        if commit_url:
-            message_data = {
-                "@type": "MessageCard",
-                "themeColor": "0076D7",
-                "title": title,
-                "text": str(time) + "\n\n" + str(summary),
-                "potentialAction": [{
-                    "@type": "OpenUri",
-                    "name": "Go to commit page",
-                    "targets": [{"os": "default", "uri": commit_url}],
-                }],
-            }
-        else:
-            message_data = {
-                    "@type": "MessageCard",
-                    "themeColor": "0076D7",
-                    "title": title,
-                    "text": str(summary),
-                }
+        message_data = build_message_card(title, time, summary, commit_url)
         try:
-            response = requests.post(teams_webhook_url, json=message_data)
+            response = requests.post(teams_webhook_url, json=message_data, timeout=TEAMS_POST_TIMEOUT_SECONDS)
             response.raise_for_status()
             logger.info("Post message to Teams successfully!")
             return [message_data, "success", ""]
         except Exception as err:
             logger.error(f"An error occurred while sending message to Teams: {err}")
-            return [message_data, "failed", str(err)]
\ No newline at end of file
+            return [message_data, "failed", str(err)]
+
+    def send_teams_message(self, title, time, summary, teams_webhook_url, commit_url=None, commit_history=None):
+        """
+        发送Teams消息：开启 TEAMS_OUTBOX_ENABLED 时放入发件箱由后台线程发送（post_status 为 queued，
+        发送结果稍后写回 commit_history 对应的数据库记录），否则同步发送；
+        短时间内同一主题的多条commit卡片可能被合并为一张摘要卡片
+
+        Returns:
+            list: [message_data, post_status, error_message]，与 post_teams_message 相同
+        """
+        if teams_outbox.enabled:
+            message_data = build_message_card(title, time, summary, commit_url)
+            record = None
+            if commit_history is not None:
+                # 预先确定记录的id和分区键，发送结果可以按id点读并更新这条记录
+                commit_history.setdefault('id', str(uuid.uuid4()))
+                commit_history.setdefault(PARTITION_KEY_FIELD, partition_key_value(self.topic, self.language))
+                record = {
+                    "id": commit_history['id'],
+                    PARTITION_KEY_FIELD: commit_history[PARTITION_KEY_FIELD],
+                    "topic": self.topic,
+                    "language": self.language,
+                }
+            # commit卡片按主题合并（TEAMS_COALESCE_WINDOW_SECONDS），周总结单独发送
+            coalesce_key = self.topic if commit_url else None
+            if teams_outbox.enqueue(teams_webhook_url, message_data, record, coalesce_key) is not None:
+                logger.info("Queued message for Teams")
+                return [message_data, QUEUED, ""]
+        return self.post_teams_message(title, time, summary, teams_webhook_url, commit_url)
@@ -0,0 +1,484 @@
+"""
+Durable, throttled outbox for Teams webhook messages.
+
+``TeamsNotifier.post_teams_message`` used to call ``requests.post`` inline
+in the commit pipeline, without a timeout or retry: a slow or throttled
+connector stalled the crawl, and a single failure was recorded as
+permanently ``failed``. With ``TEAMS_OUTBOX_ENABLED=true`` a message is
+instead:
+
+1. stored in a local SQLite outbox and recorded on the commit as
+   ``post_status: queued`` (the call returns right away),
+2. delivered by ``TEAMS_OUTBOX_WORKERS`` background threads through one
+   pooled ``requests.Session`` with a timeout, at most
+   ``TEAMS_WEBHOOK_RATE_PER_MINUTE`` messages per webhook (Teams throttles
+   each connector), one message in flight per webhook so a channel still
+   receives its messages in commit order,
+3. retried with exponential backoff on throttling (429, including the
+   ``HTTP error 429`` text Teams connectors return with status 200),
+   timeouts, connection errors and 5xx, honouring ``Retry-After``; other
+   4xx responses fail at once,
+4. written back to the commit record (``post_status`` ``success`` /
+   ``failed``, ``error_message``, ``post_attempts``) once it resolves. A
+   record that is not in CosmosDB yet (write-behind buffer) is retried
+   later.
+
+With ``TEAMS_COALESCE_WINDOW_SECONDS`` > 0, commit cards are held for that
+window. When a held card becomes due and more than
+``TEAMS_COALESCE_THRESHOLD`` cards of the same topic for the same webhook
+arrived within its window, they are replaced by one digest card listing
+their titles and links (``build_digest_card``); otherwise the cards are
+sent one by one as before. A burst of merged PRs then costs one webhook
+call instead of one per commit. Each commit record keeps its own card in
+``teams_message_jsondata`` and gets ``teams_digest_size`` on write-back.
+
+Messages left in the outbox when the process stops are delivered on the
+next start (at-least-once).
+
+If a message cannot be stored, ``enqueue`` returns None and the caller
+posts synchronously as before.
+"""
+import atexit
+import email.utils
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logs import logger
+from rate_limiter import TokenBucket
+
+
+TEAMS_OUTBOX_ENABLED = os.getenv("TEAMS_OUTBOX_ENABLED", "False") in ("True", "true")
+TEAMS_OUTBOX_DB_PATH = os.getenv("TEAMS_OUTBOX_DB_PATH", "teams_outbox.sqlite3")
+TEAMS_OUTBOX_WORKERS = int(os.getenv("TEAMS_OUTBOX_WORKERS", 2))
+TEAMS_OUTBOX_MAX_ATTEMPTS = int(os.getenv("TEAMS_OUTBOX_MAX_ATTEMPTS", 8))
+TEAMS_OUTBOX_MAX_RETRY_DELAY_SECONDS = float(os.getenv("TEAMS_OUTBOX_MAX_RETRY_DELAY_SECONDS", 900))
+TEAMS_WEBHOOK_RATE_PER_MINUTE = float(os.getenv("TEAMS_WEBHOOK_RATE_PER_MINUTE", 30))
+TEAMS_POST_TIMEOUT_SECONDS = float(os.getenv("TEAMS_POST_TIMEOUT_SECONDS", 30))
+TEAMS_COALESCE_WINDOW_SECONDS = float(os.getenv("TEAMS_COALESCE_WINDOW_SECONDS", 0))
+TEAMS_COALESCE_THRESHOLD = int(os.getenv("TEAMS_COALESCE_THRESHOLD", 3))
+# Teams rejects cards above ~28 KB; longer bursts are split into several digests.
+TEAMS_COALESCE_MAX_ITEMS = 40
+
+# Status written back for a message that is still in the outbox.
+QUEUED = "queued"
+# Write-back attempts per message before the record is left at ``queued``.
+_MAX_REPORT_ATTEMPTS = 20
+
+
+def build_message_card(title, time, summary, commit_url=None) -> dict:
+    """The MessageCard posted to a Teams channel (stored on the commit as ``teams_message_jsondata``)."""
+    if commit_url:
+        return {
+            "@type": "MessageCard",
+            "themeColor": "0076D7",
+            "title": title,
+            "text": str(time) + "\n\n" + str(summary),
+            "potentialAction": [{
+                "@type": "OpenUri",
+                "name": "Go to commit page",
+                "targets": [{"os": "default", "uri": commit_url}],
+            }],
+        }
+    return {
+        "@type": "MessageCard",
+        "themeColor": "0076D7",
+        "title": title,
+        "text": str(summary),
+    }
+
+
+def build_digest_card(topic, cards) -> dict:
+    """One MessageCard listing the titles and commit links of several ``build_message_card`` cards."""
+    lines = []
+    for index, card in enumerate(cards, 1):
+        uri = next((target.get("uri") for action in card.get("potentialAction", [])
+                    for target in action.get("targets", [])), None)
+        title = card.get("title") or ""
+        lines.append(f"{index}. [{title}]({uri})" if uri else f"{index}. {title}")
+    return {
+        "@type": "MessageCard",
+        "themeColor": "0076D7",
+        "title": f"[{topic}] {len(cards)} updates",
+        "text": "\n\n".join(lines),
+    }
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, TEAMS_OUTBOX_WORKERS))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_response(response) -> Optional[str]:
+    """None if Teams accepted the message, ``retry`` for transient failures, ``fail`` otherwise."""
+    status = response.status_code
+    if status == 429 or status == 408 or status >= 500:
+        return "retry"
+    if status >= 400:
+        return "fail"
+    # Incoming-webhook connectors report throttling as 200 with an error text.
+    if "HTTP error 429" in (response.text or ""):
+        return "retry"
+    return None
+
+
+def _default_reporter(record: dict, fields: dict) -> Optional[bool]:
+    global _report_client
+    if _report_client is None:
+        from cosmosdb_client import CosmosDBHandler
+        _report_client = CosmosDBHandler().initialize_cosmos_client()
+    if _report_client is None:
+        return False
+    return _report_client.update_document_fields(record, fields)
+
+
+_report_client = None
+
+
+class TeamsOutbox:
+    """SQLite-backed queue of Teams messages delivered by background workers."""
+
+    def __init__(self, path: Optional[str] = TEAMS_OUTBOX_DB_PATH,
+                 enabled: bool = TEAMS_OUTBOX_ENABLED,
+                 workers: int = TEAMS_OUTBOX_WORKERS,
+                 rate_per_minute: float = TEAMS_WEBHOOK_RATE_PER_MINUTE,
+                 max_attempts: int = TEAMS_OUTBOX_MAX_ATTEMPTS,
+                 base_delay: float = 5.0,
+                 max_delay: float = TEAMS_OUTBOX_MAX_RETRY_DELAY_SECONDS,
+                 timeout: float = TEAMS_POST_TIMEOUT_SECONDS,
+                 reporter: Callable[[dict, dict], Optional[bool]] = _default_reporter,
+                 session: Optional[requests.Session] = None,
+                 clock: Callable[[], float] = time.time,
+                 coalesce_window: float = TEAMS_COALESCE_WINDOW_SECONDS,
+                 coalesce_threshold: int = TEAMS_COALESCE_THRESHOLD):
+        self.enabled = enabled and bool(path)
+        self._path = path
+        self._workers = max(1, workers)
+        self._rate_per_minute = rate_per_minute
+        self._max_attempts = max(1, max_attempts)
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._timeout = timeout
+        self._reporter = reporter
+        self._session = session
+        self._clock = clock
+        self._coalesce_window = max(0.0, coalesce_window)
+        self._coalesce_threshold = max(1, coalesce_threshold)
+        self._cond = threading.Condition()
+        self._conn = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight = set()   # webhooks with a message being sent
+        self._threads = []
+        self._stopping = False
+        self._counts = {"delivered": 0, "retried": 0, "failed": 0, "digests": 0, "coalesced": 0}
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def enqueue(self, webhook_url: str, message: dict, record: Optional[dict] = None,
+                coalesce_key: Optional[str] = None) -> Optional[int]:
+        """
+        Store ``message`` for delivery to ``webhook_url``; ``record`` (``id`` plus the partition key fields of
+        the commit document) receives the delivery status. Messages with the same ``coalesce_key`` (the topic
+        of a commit card) may be merged into a digest card. Returns the message id, or None if the caller
+        must post synchronously.
+        """
+        if not self.enabled:
+            return None
+        coalesce_key = coalesce_key if self._coalesce_window > 0 else None
+        now = self._clock()
+        try:
+            with self._cond:
+                self._start()
+                cursor = self._connection().execute(
+                    "INSERT INTO messages (webhook_url, payload, record, status, attempts, next_attempt_at, created_at, coalesce_key)"
+                    " VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)",
+                    (webhook_url, json.dumps(message, ensure_ascii=False, default=str),
+                     json.dumps(record, default=str) if record else None,
+                     now + self._coalesce_window if coalesce_key else now, now, coalesce_key),
+                )
+                self._conn.commit()
+                self._cond.notify_all()
+                return cursor.lastrowid
+        except sqlite3.Error as exc:
+            logger.warning(f"TeamsOutbox: cannot store message in {self._path} ({exc}), posting synchronously")
+            return None
+
+    def start(self) -> None:
+        """Start the workers, e.g. to deliver messages left by a previous run."""
+        if self.enabled:
+            with self._cond:
+                self._start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no message is pending (due or backing off) or in flight; True if drained."""
+        if not self.enabled or self._conn is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending_count() or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=min(1.0, remaining) if remaining is not None else 1.0)
+        return True
+
+    def close(self, timeout: float = 10) -> None:
+        """Stop the workers after their current send; undelivered messages stay for the next start."""
+        with self._cond:
+            if not self._threads or self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def stats(self, reset: bool = False) -> dict:
+        with self._cond:
+            result = dict(self._counts, pending=self._pending_count() if self._conn is not None else 0)
+            if reset:
+                self._counts = dict.fromkeys(self._counts, 0)
+        return result
+
+    # ------------------------------------------------------------------
+    # storage (caller holds ``self._cond``)
+    # ------------------------------------------------------------------
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, webhook_url TEXT NOT NULL, payload TEXT NOT NULL,"
+                " record TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL, next_attempt_at REAL NOT NULL,"
+                " last_error TEXT, created_at REAL NOT NULL, reported INTEGER NOT NULL DEFAULT 0,"
+                " report_attempts INTEGER NOT NULL DEFAULT 0, coalesce_key TEXT)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+            if "coalesce_key" not in columns:
+                conn.execute("ALTER TABLE messages ADD COLUMN coalesce_key TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_pending ON messages (status, webhook_url, id)")
+            # Write-backs claimed by a process that stopped before finishing them.
+            conn.execute("UPDATE messages SET reported = 0 WHERE reported = -1")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _pending_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'pending'").fetchone()[0]
+
+    def _claim(self, now: float):
+        """Oldest pending message of a webhook that is idle and not backing off; else (None, next due time)."""
+        rows = self._connection().execute(
+            "SELECT id, webhook_url, payload, attempts, next_attempt_at, coalesce_key, created_at FROM messages WHERE id IN"
+            " (SELECT MIN(id) FROM messages WHERE status = 'pending' GROUP BY webhook_url)"
+            " ORDER BY next_attempt_at"
+        ).fetchall()
+        next_due = None
+        for row in rows:
+            if row[1] in self._in_flight:
+                continue
+            if row[4] <= now:
+                self._in_flight.add(row[1])
+                return self._coalesce(row), None
+            next_due = row[4] if next_due is None else min(next_due, row[4])
+        return None, next_due
+
+    def _coalesce(self, row):
+        """Replace a due commit card and the cards of the same topic within its window by one digest card."""
+        message_id, webhook_url, payload, attempts, next_attempt_at, coalesce_key, created_at = row
+        if not coalesce_key or attempts:
+            return row
+        members = self._conn.execute(
+            "SELECT id, payload, record FROM messages WHERE status = 'pending' AND webhook_url = ? AND coalesce_key = ?"
+            " AND attempts = 0 AND created_at <= ? ORDER BY id LIMIT ?",
+            (webhook_url, coalesce_key, created_at + self._coalesce_window, TEAMS_COALESCE_MAX_ITEMS),
+        ).fetchall()
+        if len(members) <= self._coalesce_threshold:
+            return row
+        digest = build_digest_card(coalesce_key, [json.loads(member[1]) for member in members])
+        records = [json.loads(member[2]) for member in members if member[2]]
+        payload = json.dumps(digest, ensure_ascii=False)
+        # The digest takes the place (and id) of the oldest card, so the webhook's order is kept.
+        self._conn.execute(
+            "UPDATE messages SET payload = ?, record = ?, coalesce_key = NULL WHERE id = ?",
+            (payload, json.dumps(records) if records else None, message_id),
+        )
+        self._conn.executemany("DELETE FROM messages WHERE id = ?", [(member[0],) for member in members[1:]])
+        self._conn.commit()
+        self._counts["digests"] += 1
+        self._counts["coalesced"] += len(members)
+        logger.warning(f"TeamsOutbox: merged {len(members)} updates of {coalesce_key} into one digest card")
+        return message_id, webhook_url, payload, attempts, next_attempt_at, None, created_at
+
+    def _next_report_due(self) -> Optional[float]:
+        try:
+            return self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM messages WHERE status IN ('success', 'failed') AND reported = 0 AND record IS NOT NULL"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _resolve(self, message_id: int, status: str, attempts: int, error: Optional[str], next_attempt_at: float = 0.0) -> None:
+        self._conn.execute(
+            "UPDATE messages SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            (status, attempts, error, next_attempt_at, message_id),
+        )
+        if status == "success":
+            # Delivered messages without a record to update are done (failed ones are kept for inspection).
+            self._conn.execute("DELETE FROM messages WHERE id = ? AND record IS NULL", (message_id,))
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # workers
+    # ------------------------------------------------------------------
+    def _start(self) -> None:
+        if self._threads:
+            return
+        self._connection()
+        for index in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f"teams-outbox-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.close)
+
+    def _bucket(self, webhook_url: str) -> TokenBucket:
+        with self._cond:
+            if webhook_url not in self._buckets:
+                # A small burst capacity: a connector that was idle can take a few messages at once.
+                self._buckets[webhook_url] = TokenBucket(self._rate_per_minute, capacity=min(self._rate_per_minute, 4) or None)
+            return self._buckets[webhook_url]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                try:
+                    row, next_due = self._claim(self._clock())
+                except sqlite3.Error as exc:
+                    logger.warning(f"TeamsOutbox: cannot read {self._path} ({exc})")
+                    row, next_due = None, None
+            if row is None:
+                # Idle: retry deferred write-backs, then wait for a new message or the next retry.
+                self._report_resolved()
+                with self._cond:
+                    if not self._stopping:
+                        due_times = [t for t in (next_due, self._next_report_due()) if t is not None]
+                        wait = max(0.05, min(due_times) - self._clock()) if due_times else 30.0
+                        self._cond.wait(timeout=min(wait, 30.0))
+                continue
+            message_id, webhook_url, payload, attempts = row[:4]
+            try:
+                self._bucket(webhook_url).acquire(1)
+                self._deliver(message_id, webhook_url, json.loads(payload), attempts + 1)
+            finally:
+                with self._cond:
+                    self._in_flight.discard(webhook_url)
+                    self._cond.notify_all()
+            self._report_resolved()
+
+    def _send(self, webhook_url: str, message: dict):
+        if self._session is None:
+            self._session = _build_session()
+        return self._session.post(webhook_url, json=message, timeout=self._timeout)
+
+    def _deliver(self, message_id: int, webhook_url: str, message: dict, attempt: int) -> None:
+        response, error = None, None
+        try:
+            response = self._send(webhook_url, message)
+            outcome = classify_response(response)
+            if outcome is not None:
+                error = f"HTTP {response.status_code}: {(response.text or '')[:200]}"
+        except (requests.Timeout, requests.ConnectionError) as exc:
+            outcome, error = "retry", str(exc)
+        except Exception as exc:
+            outcome, error = "fail", str(exc)
+
+        with self._cond:
+            if outcome is None:
+                logger.info("Post message to Teams successfully!")
+                self._counts["delivered"] += 1
+                self._resolve(message_id, "success", attempt, None)
+            elif outcome == "retry" and attempt < self._max_attempts:
+                delay = _retry_after(response)
+                if delay is None:
+                    delay = self._base_delay * 2 ** (attempt - 1)
+                delay = min(delay, self._max_delay)
+                logger.warning(f"TeamsOutbox: message {message_id} attempt {attempt} failed ({error}), retrying in {delay:.0f}s")
+                self._counts["retried"] += 1
+                self._resolve(message_id, "pending", attempt, error, self._clock() + delay)
+            else:
+                logger.error(f"An error occurred while sending message to Teams: {error}")
+                self._counts["failed"] += 1
+                self._resolve(message_id, "failed", attempt, error)
+
+    def _report_resolved(self) -> None:
+        """Write the outcome of resolved messages back to their commit records."""
+        with self._cond:
+            if self._conn is None:
+                return
+            rows = self._conn.execute(
+                "SELECT id, record, status, attempts, last_error, report_attempts FROM messages"
+                " WHERE status IN ('success', 'failed') AND reported = 0 AND record IS NOT NULL"
+                " AND next_attempt_at <= ? ORDER BY id LIMIT 20",
+                (self._clock(),),
+            ).fetchall()
+            # Claim them so another worker does not report the same rows.
+            self._conn.executemany("UPDATE messages SET reported = -1 WHERE id = ?", [(row[0],) for row in rows])
+            self._conn.commit()
+
+        for message_id, record, status, attempts, error, report_attempts in rows:
+            fields = {"post_status": status, "error_message": error or "", "post_attempts": attempts}
+            records = json.loads(record)
+            if isinstance(records, list):
+                # A digest card: every merged commit gets the digest's outcome.
+                fields["teams_digest_size"] = len(records)
+            else:
+                records = [records]
+            try:
+                written = all([self._reporter(item, fields) for item in records])
+            except Exception as exc:
+                logger.warning(f"TeamsOutbox: failed to record the status of message {message_id} ({exc})")
+                written = False
+            with self._cond:
+                if written or report_attempts + 1 >= _MAX_REPORT_ATTEMPTS:
+                    if not written:
+                        logger.warning(f"TeamsOutbox: giving up on recording the status of message {message_id}")
+                    self._conn.execute("UPDATE messages SET reported = 1 WHERE id = ?", (message_id,))
+                    self._conn.execute("DELETE FROM messages WHERE id = ? AND status = 'success'", (message_id,))
+                else:
+                    # Not in CosmosDB yet (write-behind) or a transient error: try again later.
+                    delay = min(self._max_delay, self._base_delay * 2 ** report_attempts)
+                    self._conn.execute(
+                        "UPDATE messages SET reported = 0, report_attempts = report_attempts + 1, next_attempt_at = ? WHERE id = ?",
+                        (self._clock() + delay, message_id),
+                    )
+                self._conn.commit()
+
+
+# Shared by every target in the process.
+teams_outbox = TeamsOutbox()
@@ -0,0 +1,152 @@
+"""
+Local stand-in for the OpenAI / Azure OpenAI v1 Files + Batch endpoints.
+
+Implements just enough of the API for `gpt_batch.GPTBatchRunner`:
+
+    POST /files                      multipart upload (purpose=batch)
+    GET  /files/{id}/content         download an input/output file
+    POST /batches                    create a batch for an uploaded file
+    GET  /batches/{id}               in_progress on the first poll, then completed
+    POST /batches/{id}/cancel        cancel a batch
+
+Every chat request in a batch is answered by `responder(body) -> content`
+(default: echo the last user message), or fails with 500 when the responder
+returns None. Used by test/test_gpt_batch.py; can also be run on its own to
+try the batched weekly summary (GPT_BATCH_MODE) end to end without Azure:
+
+    python test/batch_stub_server.py 8089
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089 GPT_BATCH_MODE=true GPT_BATCH_POLL_SECONDS=1 python eyes_on_docs.py
+"""
+import email.parser
+import email.policy
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def echo_responder(body):
+    return "stub: " + body["messages"][-1]["content"]
+
+
+class BatchStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, responder=echo_responder, polls_before_complete=1):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.responder = responder
+        self.polls_before_complete = polls_before_complete
+        self.files = {}      # id -> bytes
+        self.batches = {}    # id -> dict
+        self.requests = []   # chat request bodies seen in batch input files
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def _run_batch(self, batch):
+        lines = []
+        for raw in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not raw.strip():
+                continue
+            request = json.loads(raw)
+            self.requests.append(request["body"])
+            content = self.responder(request["body"])
+            if content is None:
+                response = {"status_code": 500, "request_id": "stub", "body": {"error": {"message": "stub failure"}}}
+            else:
+                response = {"status_code": 200, "request_id": "stub", "body": {
+                    "id": "chatcmpl-stub", "object": "chat.completion", "model": request["body"].get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                }}
+            lines.append(json.dumps({"id": self.new_id("batch_req"), "custom_id": request["custom_id"],
+                                     "response": response, "error": None}))
+        output_id = self.new_id("file")
+        self.files[output_id] = ("\n".join(lines) + "\n").encode("utf-8")
+        batch.update(status="completed", output_file_id=output_id, completed_at=int(time.time()),
+                     request_counts={"total": len(lines), "completed": len(lines), "failed": 0})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: BatchStubServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, status=200, raw=None):
+        data = raw if raw is not None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/files"):
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + self._body())
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                      for part in message.iter_parts()}
+            file_id = server.new_id("file")
+            server.files[file_id] = fields["file"]
+            return self._send({"id": file_id, "object": "file", "bytes": len(fields["file"]),
+                               "created_at": int(time.time()), "filename": "input.jsonl",
+                               "purpose": fields["purpose"].decode("utf-8"), "status": "processed"})
+        if path.endswith("/batches"):
+            params = json.loads(self._body())
+            batch_id = server.new_id("batch")
+            server.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": params["endpoint"],
+                "input_file_id": params["input_file_id"], "completion_window": params["completion_window"],
+                "created_at": int(time.time()), "status": "validating", "output_file_id": None,
+                "metadata": params.get("metadata"), "polls": 0,
+            }
+            return self._send(server.batches[batch_id])
+        match = re.search(r"/batches/([^/]+)/cancel$", path)
+        if match and match.group(1) in server.batches:
+            server.batches[match.group(1)]["status"] = "cancelled"
+            return self._send(server.batches[match.group(1)])
+        self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match and match.group(1) in server.batches:
+            batch = server.batches[match.group(1)]
+            if batch["status"] not in ("completed", "cancelled"):
+                batch["polls"] += 1
+                batch["status"] = "in_progress"
+                if batch["polls"] > server.polls_before_complete:
+                    server._run_batch(batch)
+            return self._send(batch)
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match and match.group(1) in server.files:
+            return self._send(None, raw=server.files[match.group(1)])
+        self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+
+if __name__ == "__main__":
+    stub = BatchStubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8089)
+    print(f"Batch stub listening on {stub.base_url}")
+    stub.serve_forever()
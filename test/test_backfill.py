@@ -0,0 +1,175 @@
+"""
+Unit tests for the historical backfill entry point (`backfill.py`).
+
+GitHub, CosmosDB and GPT are faked, so no network call is made.
+Run: `python -m pytest test/test_backfill.py -v`
+"""
+import datetime
+import os
+import re
+import sys
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import backfill
+import gpt_batch
+import gpt_reply
+import spyder
+from llm_cache import LLMResponseCache
+from spyder import Spyder
+from backfill import BackfillCheckpoint, BackfillSpyder, backfill_target, commit_sha, parse_date, select_targets
+
+API = "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits"
+WEB = "https://github.com/MicrosoftDocs/azure-docs/commit"
+TARGET = {"topic_name": "AML", "language": "English", "root_commits_url": f"{API}?path=articles/machine-learning",
+          "teams_webhook_url": "https://example.invalid/webhook"}
+
+
+class _FakeCosmosClient:
+    def __init__(self, stored_urls=(), fail_on=()):
+        self.stored_urls = list(stored_urls)
+        self.fail_on = set(fail_on)
+        self.records = []
+        self.queries = []
+
+    def get_commit_urls(self, topic, language, root_commits_url, start_time, end_time):
+        self.queries.append((topic, language, root_commits_url, start_time, end_time))
+        return self.stored_urls
+
+    def create_commit_history(self, history_dict):
+        if commit_sha(history_dict["commit_url"]) in self.fail_on:
+            return False
+        self.records.append(dict(history_dict))
+        return True
+
+
+@pytest.fixture
+def env():
+    """Fake GitHub listing, CosmosDB and GPT; yields (cosmos client, listed commits)."""
+    cosmos = _FakeCosmosClient()
+    listed = []
+
+    class _Handler:
+        def initialize_cosmos_client(self):
+            return cosmos
+
+    def analyse(self, patch_data, language, prompts, url_mapping, commit_history):
+        return f"summary of {patch_data}", "1 [New] title", "post"
+
+    def no_teams(*args, **kwargs):
+        raise AssertionError("backfill must not post to Teams")
+
+    with patch.object(spyder, "CosmosDBHandler", _Handler), \
+         patch.object(spyder, "PERSONAL_TOKEN", "token"), \
+         patch.object(backfill, "PERSONAL_TOKEN", "token"), \
+         patch.object(backfill, "load_system_prompts", return_value={}), \
+         patch.object(backfill.CommitFetcher, "list_commits", side_effect=lambda *a, **k: list(listed)) as list_commits, \
+         patch.object(BackfillSpyder, "get_change_from_each_url", lambda self, t, url, m, h: f"patch {commit_sha(url)}"), \
+         patch.object(BackfillSpyder, "generate_gpt_responses", analyse), \
+         patch.object(BackfillSpyder, "post_teams_message", no_teams):
+        yield cosmos, listed, list_commits
+
+
+def _day(day, hour=12):
+    return datetime.datetime(2026, 1, day, hour)
+
+
+def test_parse_date_and_target_selection():
+    assert parse_date("2026-01-02") == datetime.datetime(2026, 1, 2)
+    assert parse_date("2026-01-02T08:30:00Z") == datetime.datetime(2026, 1, 2, 8, 30)
+    assert parse_date("2026-01-02T08:30:00+08:00") == datetime.datetime(2026, 1, 2, 0, 30)
+
+    targets = [TARGET, {**TARGET, "language": "Chinese"}, {**TARGET, "topic_name": "Other"}]
+    assert select_targets(targets, "AML") == targets[:2]
+    assert select_targets(targets, "AML", "Chinese") == [targets[1]]
+
+
+def test_range_is_processed_in_order_without_teams(env, tmp_path):
+    cosmos, listed, list_commits = env
+    listed.extend([(_day(d), f"{API}/sha{d}") for d in (9, 5, 3, 1)])
+
+    result = backfill_target(TARGET, _day(2, 0), _day(9, 0), BackfillCheckpoint(str(tmp_path / "cp.json")), workers=4)
+
+    assert result == {"listed": 2, "skipped": 0, "processed": 2}
+    assert list_commits.call_args.kwargs["since"] == _day(2, 0)
+    assert list_commits.call_args.kwargs["until"] == _day(9, 0)
+    assert [r["commit_url"] for r in cosmos.records] == [f"{WEB}/sha3", f"{WEB}/sha5"]
+    assert all(r["teams_message_jsondata"] is None for r in cosmos.records)
+
+
+def test_commits_in_cosmos_or_checkpoint_are_skipped(env, tmp_path):
+    cosmos, listed, _ = env
+    listed.extend([(_day(d), f"{API}/sha{d}") for d in (1, 2, 3, 4)])
+    cosmos.stored_urls = [f"{WEB}/sha1"]
+    checkpoint = BackfillCheckpoint(str(tmp_path / "cp.json"))
+    checkpoint.mark(BackfillCheckpoint.key(TARGET), "sha2")
+
+    result = backfill_target(TARGET, _day(1, 0), _day(10, 0), checkpoint)
+
+    assert result == {"listed": 4, "skipped": 2, "processed": 2}
+    assert [r["commit_url"] for r in cosmos.records] == [f"{WEB}/sha3", f"{WEB}/sha4"]
+
+
+def test_checkpoint_resumes_after_failed_uploads(env, tmp_path):
+    cosmos, listed, _ = env
+    listed.extend([(_day(d), f"{API}/sha{d}") for d in (1, 2, 3)])
+    path = str(tmp_path / "cp.json")
+    cosmos.fail_on = {"sha2"}
+
+    backfill_target(TARGET, _day(1, 0), _day(10, 0), BackfillCheckpoint(path))
+    assert BackfillCheckpoint(path).done(BackfillCheckpoint.key(TARGET)) == {"sha1", "sha3"}
+
+    cosmos.fail_on = set()
+    result = backfill_target(TARGET, _day(1, 0), _day(10, 0), BackfillCheckpoint(path))
+    assert result == {"listed": 3, "skipped": 2, "processed": 1}
+    assert [r["commit_url"] for r in cosmos.records][-1] == f"{WEB}/sha2"
+
+
+class _CacheFillingRunner:
+    """Stands in for the Batch API: answers every collected request straight into the response cache."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.rounds = []
+
+    def run(self, requests):
+        self.rounds.append(len(requests))
+        for key, request in requests.items():
+            system, user = (message["content"] for message in request["messages"])
+            answer = "1 [New] title" if system.startswith("Title") else "summary of " + re.search(r"sha\d", user).group()
+            self.cache.put(key, answer, 1, 1, 2)
+        return len(requests)
+
+
+def test_batch_mode_collects_legacy_requests_round_by_round(env, tmp_path):
+    cosmos, listed, _ = env
+    listed.extend([(_day(d), f"{API}/sha{d}") for d in (1, 2, 3)])
+    cache = LLMResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    runner = _CacheFillingRunner(cache)
+    prompts = {"GPT_SUMMARY_PROMPT": "Summarize", "GPT_TITLE_PROMPT": "Title"}
+
+    with patch.object(BackfillSpyder, "generate_gpt_responses", Spyder.generate_gpt_responses), \
+         patch.object(backfill, "load_system_prompts", return_value=prompts), \
+         patch.object(gpt_reply, "response_cache", cache), \
+         patch.object(gpt_batch, "GPTBatchRunner", lambda: runner), \
+         patch.object(gpt_reply, "chat_completion_with_backoff_async", side_effect=AssertionError("interactive call")), \
+         patch.object(spyder.logger, "exception") as logged:
+        result = backfill_target(TARGET, _day(1, 0), _day(10, 0), BackfillCheckpoint(str(tmp_path / "cp.json")),
+                                 workers=2, batch=True)
+
+    # Summaries first, then the titles built from them; the real pass is served from the cache.
+    assert runner.rounds == [3, 3]
+    assert result["processed"] == 3
+    assert [(r["gpt_summary_response"], r["status"]) for r in cosmos.records] == [(f"summary of sha{d}", "post") for d in (1, 2, 3)]
+    assert not logged.called
+
+
+def test_main_rejects_unknown_topic_and_empty_range():
+    with patch.object(backfill, "load_targets_config", return_value=[TARGET]):
+        with pytest.raises(SystemExit):
+            backfill.main(["--topic", "Nope", "--since", "2026-01-01", "--until", "2026-01-02"])
+        with pytest.raises(SystemExit):
+            backfill.main(["--topic", "AML", "--since", "2026-01-02", "--until", "2026-01-01"])
@@ -0,0 +1,125 @@
+"""
+Unit tests for the SHA-keyed commit detail cache (`github_cache.CommitDetailCache`)
+and its use in `CommitFetcher.get_change_from_each_url`.
+
+No GitHub API call is made: the fetch callable / `_make_request_to_json` is faked.
+Run: `python -m pytest test/test_commit_detail_cache.py -v`
+"""
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import commit_fetch
+from commit_fetch import CommitFetcher
+from github_cache import CommitDetailCache, parse_commit_api_url
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+COMMIT_URL = f"https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/{SHA}"
+FILES = [
+    {"filename": "articles/machine-learning/a.md", "patch": "@@ -1 +1 @@\n-old\n+new"},
+    {"filename": "articles/storage/b.md", "patch": "@@ -1 +1 @@\n-x\n+y"},
+]
+
+
+def test_parse_commit_api_url():
+    assert parse_commit_api_url(COMMIT_URL) == ("MicrosoftDocs/azure-docs", SHA)
+    assert parse_commit_api_url("https://github.com/MicrosoftDocs/azure-docs/commit/abc") is None
+
+
+def test_second_read_comes_from_disk(tmp_path):
+    calls = []
+    cache = CommitDetailCache(cache_dir=str(tmp_path))
+    fetch = lambda: calls.append(1) or FILES
+
+    assert cache.get_files(COMMIT_URL, fetch) == FILES
+    # A fresh instance (next run) reads the persisted file.
+    assert CommitDetailCache(cache_dir=str(tmp_path)).get_files(COMMIT_URL, fetch) == FILES
+    assert len(calls) == 1
+    assert (tmp_path / "MicrosoftDocs__azure-docs" / f"{SHA}.json.gz").exists()
+
+
+def test_failed_fetch_is_not_cached(tmp_path):
+    cache = CommitDetailCache(cache_dir=str(tmp_path))
+    assert cache.get_files(COMMIT_URL, lambda: None) is None
+    assert cache.get_files(COMMIT_URL, lambda: FILES) == FILES
+
+
+def test_corrupt_file_is_refetched(tmp_path):
+    cache = CommitDetailCache(cache_dir=str(tmp_path))
+    cache.get_files(COMMIT_URL, lambda: FILES)
+    (tmp_path / "MicrosoftDocs__azure-docs" / f"{SHA}.json.gz").write_bytes(b"not gzip")
+    assert CommitDetailCache(cache_dir=str(tmp_path)).get_files(COMMIT_URL, lambda: FILES) == FILES
+
+
+def test_concurrent_requests_share_one_download(tmp_path):
+    cache = CommitDetailCache(cache_dir=str(tmp_path))
+    calls = []
+    started = threading.Event()
+
+    def slow_fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return FILES
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_files(COMMIT_URL, slow_fetch)))
+    owner.start()
+    started.wait(1)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_files(COMMIT_URL, slow_fetch))) for _ in range(3)]
+    for t in waiters:
+        t.start()
+    for t in [owner] + waiters:
+        t.join(2)
+
+    assert len(calls) == 1
+    assert results == [FILES] * 4
+    assert cache.stats()["shared"] == 3
+
+
+def test_evicts_least_recently_used_files(tmp_path):
+    shas = [c * 40 for c in "abcd"]
+    urls = [COMMIT_URL.replace(SHA, sha) for sha in shas]
+    repo_dir = tmp_path / "cache" / "MicrosoftDocs__azure-docs"
+    probe = CommitDetailCache(cache_dir=str(tmp_path / "probe"))
+    probe.get_files(urls[0], lambda: FILES)
+    size = (tmp_path / "probe" / "MicrosoftDocs__azure-docs" / f"{shas[0]}.json.gz").stat().st_size
+
+    # Room for three files; eviction goes down to 90% of the budget, i.e. one file.
+    cache = CommitDetailCache(cache_dir=str(tmp_path / "cache"), max_bytes=int(size * 3.4))
+    for age, url in enumerate(urls[:3]):
+        cache.get_files(url, lambda: FILES)
+        os.utime(repo_dir / f"{shas[age]}.json.gz", (1000 + age, 1000 + age))
+    # A hit makes the oldest file the most recently used one.
+    assert cache.get_files(urls[0], lambda: None) == FILES
+    cache.get_files(urls[3], lambda: FILES)
+
+    remaining = sorted(p.name for p in repo_dir.iterdir())
+    assert remaining == [f"{sha}.json.gz" for sha in (shas[0], shas[2], shas[3])]
+
+
+def test_get_change_from_each_url_uses_cache_and_filters_by_path(tmp_path):
+    fetcher = CommitFetcher()
+    fetcher.topic_path = "articles/machine-learning"
+    cache = CommitDetailCache(cache_dir=str(tmp_path))
+    with patch.object(commit_fetch, "commit_details_cache", cache), \
+         patch.object(CommitFetcher, "_make_request_to_json", return_value={"files": FILES}) as request:
+        first = fetcher.get_change_from_each_url(None, COMMIT_URL, 30000)
+        second = fetcher.get_change_from_each_url(None, COMMIT_URL, 30000)
+
+    assert request.call_count == 1
+    assert first == second
+    assert "articles/machine-learning/a.md" in first
+    assert "articles/storage/b.md" not in first
+
+
+def test_get_change_from_each_url_returns_error_on_failed_request(tmp_path):
+    fetcher = CommitFetcher()
+    fetcher.topic_path = None
+    with patch.object(commit_fetch, "commit_details_cache", CommitDetailCache(cache_dir=str(tmp_path))), \
+         patch.object(CommitFetcher, "_make_request_to_json", return_value=None):
+        assert fetcher.get_change_from_each_url(None, COMMIT_URL, 30000) == "Error"
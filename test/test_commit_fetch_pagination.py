@@ -0,0 +1,173 @@
+"""
+Unit tests for paginated commit listing in `CommitFetcher.get_all_commits`.
+
+`_request_with_retries` is replaced by a fake that serves canned pages with
+`Link: rel="next"` metadata, so no GitHub API call is made.
+Run: `python -m pytest test/test_commit_fetch_pagination.py -v`
+"""
+import datetime
+import os
+import sys
+from urllib.parse import parse_qs, urlparse
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import commit_fetch
+from commit_fetch import CommitFetcher, build_commits_page_url
+from github_cache import ValidatorCache
+
+ROOT = "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/machine-learning"
+
+
+@pytest.fixture(autouse=True)
+def validators():
+    """Use an in-memory validator cache so tests never touch the disk cache."""
+    cache = ValidatorCache(cache_path=None)
+    with patch.object(commit_fetch, "commit_list_validators", cache):
+        yield cache
+
+
+class _FakeResponse:
+    def __init__(self, items, next_url=None, status_code=200, headers=None):
+        self._items = items
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.links = {"next": {"url": next_url}} if next_url else {}
+
+    def json(self):
+        return self._items
+
+
+def _item(sha, when):
+    return {
+        "url": f"https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/{sha}",
+        "commit": {"author": {"date": when.strftime("%Y-%m-%dT%H:%M:%SZ")}},
+    }
+
+
+def _serve(pages):
+    """Return a fake `_request_with_retries` serving `pages` in order and
+    recording the requested URLs."""
+    requested = []
+
+    def fake(self, url, is_stream=False, headers={}, retries=3, delay=2):
+        requested.append(url)
+        index = len(requested) - 1
+        next_url = f"https://api.github.com/next?page={index + 2}" if index + 1 < len(pages) else None
+        return _FakeResponse(pages[index], next_url)
+
+    return fake, requested
+
+
+def test_build_url_adds_per_page_and_since():
+    url = build_commits_page_url(ROOT + "&sha=live", datetime.datetime(2026, 6, 1, 8, 30))
+    params = parse_qs(urlparse(url).query)
+    assert params["path"] == ["articles/machine-learning"]
+    assert params["sha"] == ["live"]
+    assert params["per_page"] == ["100"]
+    assert params["since"] == ["2026-06-01T08:30:00Z"]
+
+
+def test_build_url_keeps_explicit_per_page_and_skips_missing_since():
+    url = build_commits_page_url(ROOT + "&per_page=50")
+    params = parse_qs(urlparse(url).query)
+    assert params["per_page"] == ["50"]
+    assert "since" not in params
+    assert "until" not in params
+
+
+def test_build_url_adds_until_for_backfill():
+    url = build_commits_page_url(ROOT, datetime.datetime(2026, 1, 1), datetime.datetime(2026, 2, 1))
+    params = parse_qs(urlparse(url).query)
+    assert params["since"] == ["2026-01-01T00:00:00Z"]
+    assert params["until"] == ["2026-02-01T00:00:00Z"]
+
+
+def test_follows_next_links_across_pages():
+    base = datetime.datetime(2026, 6, 10)
+    pages = [
+        [_item(f"a{i}", base - datetime.timedelta(minutes=i)) for i in range(3)],
+        [_item(f"b{i}", base - datetime.timedelta(hours=1, minutes=i)) for i in range(3)],
+        [_item("c0", base - datetime.timedelta(hours=2))],
+    ]
+    fake, requested = _serve(pages)
+    with patch.object(CommitFetcher, "_request_with_retries", fake):
+        commits = CommitFetcher().get_all_commits(ROOT, since=base - datetime.timedelta(days=1))
+    assert len(requested) == 3
+    assert len(commits) == 7
+
+
+def test_stops_paging_once_a_page_is_older_than_since():
+    since = datetime.datetime(2026, 6, 10)
+    pages = [
+        [_item("new", since + datetime.timedelta(hours=1)), _item("old", since - datetime.timedelta(hours=1))],
+        [_item("older", since - datetime.timedelta(hours=2))],
+        [_item("never", since - datetime.timedelta(hours=3))],
+    ]
+    fake, requested = _serve(pages)
+    with patch.object(CommitFetcher, "_request_with_retries", fake):
+        commits = CommitFetcher().get_all_commits(ROOT, since=since)
+    # page 2 holds only older commits, so page 3 is never requested
+    assert len(requested) == 2
+    selected, _ = CommitFetcher().select_latest_commits(commits, since)
+    assert list(selected.values()) == ["https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/new"]
+
+
+def test_max_pages_bounds_requests():
+    base = datetime.datetime(2026, 6, 10)
+    pages = [[_item(f"p{i}", base)] for i in range(5)]
+    fake, requested = _serve(pages)
+    with patch.object(CommitFetcher, "_request_with_retries", fake):
+        CommitFetcher().get_all_commits(ROOT, max_pages=2)
+    assert len(requested) == 2
+
+
+def test_failed_request_returns_empty_dict():
+    with patch.object(CommitFetcher, "_request_with_retries", lambda self, url, **kwargs: None):
+        assert CommitFetcher().get_all_commits(ROOT) == {}
+
+
+def test_empty_result_is_cached_and_next_request_is_conditional(validators):
+    since = datetime.datetime(2026, 6, 10)
+    seen_headers = []
+
+    def fake(self, url, is_stream=False, headers={}, retries=3, delay=2):
+        seen_headers.append(dict(headers))
+        if headers.get("If-None-Match") == '"abc"':
+            return _FakeResponse(None, status_code=304)
+        return _FakeResponse([], headers={"ETag": '"abc"'})
+
+    with patch.object(CommitFetcher, "_request_with_retries", fake):
+        assert CommitFetcher().get_all_commits(ROOT, since=since) == {}
+        assert CommitFetcher().get_all_commits(ROOT, since=since) == {}
+
+    assert "If-None-Match" not in seen_headers[0]
+    assert seen_headers[1]["If-None-Match"] == '"abc"'
+    assert validators.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_response_with_new_commits_is_not_cached(validators):
+    since = datetime.datetime(2026, 6, 10)
+    page = [_item("new", since + datetime.timedelta(hours=1))]
+
+    def fake(self, url, is_stream=False, headers={}, retries=3, delay=2):
+        assert "If-None-Match" not in headers
+        return _FakeResponse(page, headers={"ETag": '"with-new"'})
+
+    with patch.object(CommitFetcher, "_request_with_retries", fake):
+        assert len(CommitFetcher().get_all_commits(ROOT, since=since)) == 1
+        assert len(CommitFetcher().get_all_commits(ROOT, since=since)) == 1
+    assert validators.stats()["entries"] == 0
+
+
+def test_validator_cache_persists_to_disk(tmp_path):
+    path = str(tmp_path / "etag.json")
+    cache = ValidatorCache(cache_path=path)
+    cache.store("https://api.github.com/x", _FakeResponse([], headers={"ETag": '"v1"', "Last-Modified": "Mon"}))
+
+    reloaded = ValidatorCache(cache_path=path)
+    headers = reloaded.conditional_headers("https://api.github.com/x", {"Authorization": "token t"})
+    assert headers == {"Authorization": "token t", "If-None-Match": '"v1"', "If-Modified-Since": "Mon"}
@@ -24,7 +24,7 @@ def _extract_topic_path(url):
     """Call get_all_commits far enough to compute topic_path, then bail out."""
     fetcher = CommitFetcher()
     # Short-circuit the HTTP call so we only exercise the parsing logic.
-    with patch.object(CommitFetcher, '_make_request_to_json', return_value=[]):
+    with patch.object(CommitFetcher, '_iter_commit_pages', return_value=iter([])):
         fetcher.get_all_commits(url, headers={})
     return fetcher.topic_path
 
@@ -0,0 +1,123 @@
+"""
+Unit tests for the write-behind commit history buffer (`commit_history_writer`).
+
+CosmosDB is faked and the spill file lives in a temporary directory.
+Run: `python -m pytest test/test_commit_history_writer.py -v`
+"""
+import json
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import spyder as spyder_module
+from commit_history_writer import CommitHistoryWriter
+from spyder import Spyder
+
+
+class _FakeCosmos:
+    def __init__(self, delay=0.0, fail_times=0):
+        self.delay = delay
+        self.fail_times = fail_times
+        self.documents = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create_commit_history(self, history_dict):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            with self._lock:
+                if self.fail_times > 0:
+                    self.fail_times -= 1
+                    return False
+                self.documents[history_dict["id"]] = history_dict
+                return True
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _writer(tmp_path, cosmos, **kwargs):
+    kwargs.setdefault("retry_delay", 0.001)
+    return CommitHistoryWriter(client_factory=lambda: cosmos, spill_path=str(tmp_path / "spill.jsonl"), enabled=True, **kwargs)
+
+
+def _spilled(tmp_path):
+    path = tmp_path / "spill.jsonl"
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] if path.exists() else []
+
+
+def test_submit_returns_before_the_write_and_flush_drains(tmp_path):
+    cosmos = _FakeCosmos(delay=0.05)
+    writer = _writer(tmp_path, cosmos, batch_size=5, max_concurrency=3)
+
+    start = time.monotonic()
+    assert all(writer.submit({"commit_url": f"u{i}"}) for i in range(12))
+    assert time.monotonic() - start < 0.05
+
+    assert writer.flush(timeout=5)
+    assert sorted(d["commit_url"] for d in cosmos.documents.values()) == sorted(f"u{i}" for i in range(12))
+    assert cosmos.max_in_flight == 3
+    assert _spilled(tmp_path) == []
+    assert writer.stats() == {"written": 12, "failed": 0, "queued": 0, "spilled": 0}
+    writer.close()
+
+
+def test_spill_file_is_replayed_after_a_crash(tmp_path):
+    blocked = threading.Event()
+    stuck = MagicMock()
+    stuck.create_commit_history.side_effect = lambda doc: blocked.wait(5) and False
+    dead = _writer(tmp_path, stuck)
+    dead.submit({"commit_url": "u1"})
+    dead.submit({"commit_url": "u2"})
+    ids = [d["id"] for d in _spilled(tmp_path)]
+    assert len(ids) == 2
+
+    # The process "dies" here; a new writer replays the spill file with the same ids.
+    cosmos = _FakeCosmos()
+    assert _writer(tmp_path, cosmos).flush(timeout=5)
+    assert sorted(cosmos.documents) == sorted(ids)
+    blocked.set()
+    dead.close(timeout=5)
+
+
+def test_failing_writes_are_parked_and_retried_on_flush(tmp_path):
+    cosmos = _FakeCosmos(fail_times=4)
+    writer = _writer(tmp_path, cosmos, max_attempts=2, max_concurrency=1)
+    writer.submit({"commit_url": "u1"})
+    writer.submit({"commit_url": "u2"})
+
+    assert not writer.flush(timeout=5)          # both failed twice, still in the spill file
+    assert len(_spilled(tmp_path)) == 2
+    assert writer.flush(timeout=5)              # CosmosDB is back
+    assert len(cosmos.documents) == 2
+    assert _spilled(tmp_path) == []
+    writer.close()
+
+
+def test_unwritable_spill_and_disabled_writer_fall_back_to_sync(tmp_path):
+    unwritable = CommitHistoryWriter(client_factory=_FakeCosmos, spill_path=str(tmp_path / "missing" / "spill.jsonl"), enabled=True)
+    assert not unwritable.submit({"commit_url": "u1"})
+    assert not CommitHistoryWriter(client_factory=_FakeCosmos, spill_path="", enabled=True).submit({"commit_url": "u1"})
+    assert not CommitHistoryWriter(client_factory=_FakeCosmos, spill_path=str(tmp_path / "s.jsonl"), enabled=False).submit({})
+
+
+def test_upload_commit_history_goes_through_the_writer(tmp_path):
+    cosmos = _FakeCosmos()
+    writer = _writer(tmp_path, cosmos)
+    spyder = Spyder.__new__(Spyder)
+    spyder.cosmosDB_client = MagicMock()
+
+    with patch.object(spyder_module, "commit_history_writer", writer):
+        assert spyder.upload_commit_history({"commit_url": "u1"})
+    spyder.cosmosDB_client.create_commit_history.assert_not_called()
+    assert writer.flush(timeout=5)
+    assert [d["commit_url"] for d in cosmos.documents.values()] == ["u1"]
+    writer.close()
@@ -0,0 +1,149 @@
+"""
+Unit tests for the pipelined commit processing in `Spyder.process_commits`.
+
+The Spyder is built with `Spyder.__new__` so no GitHub / Cosmos / OpenAI
+call is made; `analyze_commit` dependencies are replaced with fakes that
+sleep for a random amount of time to shuffle completion order.
+Run: `python -m pytest test/test_commit_pipeline.py -v`
+"""
+import os
+import random
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import spyder as spyder_module
+from rate_limiter import TokenBucket
+from spyder import Spyder
+from watermark_store import WatermarkStore
+
+
+@pytest.fixture(autouse=True)
+def no_watermarks():
+    """Keep publish_commit from writing the real watermark database."""
+    with patch.object(spyder_module, "watermark_store", WatermarkStore(path="")):
+        yield
+
+
+class _FakeCosmos:
+    def __init__(self):
+        self.records = []
+
+    def create_commit_history(self, history_dict):
+        self.records.append(dict(history_dict))
+        return True
+
+
+def _make_spyder(workers, deadline=None):
+    spyder = Spyder.__new__(Spyder)
+    spyder.topic = "AML"
+    spyder.language = "English"
+    spyder.root_commits_url = "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/machine-learning"
+    spyder.teams_webhook_url = "https://example.invalid/webhook"
+    spyder.system_prompt_dict = {}
+    spyder.max_input_token = 1000
+    spyder.show_topic_in_title = False
+    spyder.gpt_analysis_mode = "legacy"
+    spyder.headers = {}
+    spyder.deadline = deadline
+    spyder.pipeline_workers = workers
+    spyder.cosmosDB_client = _FakeCosmos()
+    spyder.posted = []
+
+    def get_change(time_, url, max_input_token, headers):
+        time.sleep(random.uniform(0, 0.02))
+        return f"patch of {url}"
+
+    def generate(patch, language, prompts, url_mapping, commit_history):
+        time.sleep(random.uniform(0, 0.02))
+        commit_history["gpt_summary_tokens"] = {"thread": threading.current_thread().name}
+        commit_history["commit_patch_data"] = patch
+        return f"summary of {patch}", "1 [New] title", "post"
+
+    def post(title, time_, summary, webhook, commit_url=None):
+        spyder.posted.append(commit_url)
+        return [{"title": title}, "success", ""]
+
+    spyder.get_change_from_each_url = get_change
+    spyder.generate_gpt_responses = generate
+    spyder.post_teams_message = post
+    return spyder
+
+
+def _commits(n):
+    return {
+        i: f"https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/sha{i:03d}"
+        for i in range(n)
+    }
+
+
+def test_parallel_pipeline_preserves_commit_order():
+    spyder = _make_spyder(workers=4)
+    spyder.process_commits(_commits(20), url_mapping=None)
+
+    expected = [f"https://github.com/MicrosoftDocs/azure-docs/commit/sha{i:03d}" for i in range(20)]
+    assert spyder.posted == expected
+    assert [r["commit_url"] for r in spyder.cosmosDB_client.records] == expected
+
+
+def test_each_commit_gets_its_own_record():
+    spyder = _make_spyder(workers=4)
+    spyder.process_commits(_commits(10), url_mapping=None)
+
+    for i, record in enumerate(spyder.cosmosDB_client.records):
+        assert record["commit_patch_data"].endswith(f"sha{i:03d}")
+        assert record["gpt_summary_response"].endswith(f"sha{i:03d}")
+        assert record["status"] == "post"
+        assert record["post_status"] == "success"
+
+
+def test_serial_mode_matches_parallel_mode():
+    serial = _make_spyder(workers=1)
+    serial.process_commits(_commits(5), url_mapping=None)
+    parallel = _make_spyder(workers=3)
+    parallel.process_commits(_commits(5), url_mapping=None)
+
+    assert serial.posted == parallel.posted
+    strip = lambda records: [{k: v for k, v in r.items() if k != "gpt_summary_tokens"} for r in records]
+    assert strip(serial.cosmosDB_client.records) == strip(parallel.cosmosDB_client.records)
+
+
+def test_deadline_stops_publishing():
+    spyder = _make_spyder(workers=2, deadline=time.monotonic() - 1)
+    spyder.process_commits(_commits(5), url_mapping=None)
+    assert spyder.posted == []
+    assert spyder.cosmosDB_client.records == []
+
+
+def test_analysis_failure_still_records_commit_in_order():
+    spyder = _make_spyder(workers=3)
+    original = spyder.get_change_from_each_url
+
+    def flaky(time_, url, max_input_token, headers):
+        if url.endswith("sha001"):
+            raise RuntimeError("boom")
+        return original(time_, url, max_input_token, headers)
+
+    spyder.get_change_from_each_url = flaky
+    spyder.process_commits(_commits(3), url_mapping=None)
+
+    records = spyder.cosmosDB_client.records
+    assert [r["status"] for r in records] == ["post", "Error in Getting Patch Data", "post"]
+    assert len(spyder.posted) == 2
+
+
+def test_token_bucket_unlimited_never_waits():
+    bucket = TokenBucket(0)
+    assert bucket.reserve(10 ** 9) == 0
+
+
+def test_token_bucket_waits_when_budget_exhausted():
+    bucket = TokenBucket(rate_per_minute=600)  # 10 tokens per second
+    assert bucket.reserve(600) == 0
+    wait_seconds = bucket.reserve(60)
+    assert 5.5 < wait_seconds <= 6.0
@@ -0,0 +1,147 @@
+"""
+Unit tests for the paged, projected and server-side aggregated queries in
+`cosmosdbservice` (`get_commit_history`, `get_value_list`,
+`get_commit_time_list`, `get_commit_time_range`).
+
+The CosmosDB container is faked; it answers by query text and pages its
+results like the SDK's `by_page()`.
+Run: `python -m pytest test/test_cosmos_paging.py -v`
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cosmosdbservice
+from cosmosdbservice import CosmosConversationClient, RequestChargeStats
+
+
+class _Pager:
+    def __init__(self, pages, hook, continuation_token):
+        self._pages = pages
+        self._hook = hook
+        self._next = int(continuation_token or 0)
+        self.continuation_token = None
+        self.served = 0
+
+    def __iter__(self):
+        while self._next < len(self._pages):
+            page = self._pages[self._next]
+            self._next += 1
+            self.served += 1
+            self.continuation_token = str(self._next) if self._next < len(self._pages) else None
+            self._hook({"x-ms-request-charge": "1.5"}, {"Documents": page})
+            yield iter(page)
+
+
+class _FakeContainer:
+    def __init__(self, answers):
+        self.answers = answers   # query substring -> result list, or callable(parameters) -> result list
+        self.queries = []
+        self.pagers = []
+
+    def _answer(self, query, parameters):
+        for key, answer in self.answers.items():
+            if key in query:
+                return answer(parameters) if callable(answer) else answer
+        raise AssertionError(f"unexpected query: {query}")
+
+    def query_items(self, query, parameters=None, response_hook=None, max_item_count=None, **options):
+        self.queries.append(query)
+        results = self._answer(query, parameters)
+        container = self
+
+        class _Items(list):
+            def by_page(self, continuation_token=None):
+                size = max_item_count or len(results) or 1
+                pages = [results[i:i + size] for i in range(0, len(results), size)]
+                pager = _Pager(pages, response_hook, continuation_token)
+                container.pagers.append(pager)
+                return pager
+
+        items = _Items(results)
+        if response_hook:
+            response_hook({"x-ms-request-charge": "99"}, items)   # stale headers when the iterator is created
+        return items
+
+
+@pytest.fixture
+def charges(monkeypatch):
+    charges = RequestChargeStats()
+    monkeypatch.setattr(cosmosdbservice, "request_charges", charges)
+    return charges
+
+
+def _client(container):
+    client = CosmosConversationClient.__new__(CosmosConversationClient)
+    client.container_name = "commits"
+    client.container_client = container
+    client._partition_key_paths = None
+    return client
+
+
+def test_commit_history_is_streamed_page_by_page_with_projection(charges):
+    container = _FakeContainer({"FROM c": [{"commit_url": f"u{i}"} for i in range(5)]})
+    history = _client(container).get_commit_history(fields=["commit_url", "status"], page_size=2)
+
+    assert next(history) == {"commit_url": "u0"}
+    assert container.pagers[0].served == 1                      # only the first page has been fetched
+    assert [d["commit_url"] for d in history] == ["u1", "u2", "u3", "u4"]
+    assert container.queries == ["SELECT c.commit_url, c.status FROM c"]
+    assert charges.stats() == {"get_commit_history": {"calls": 1, "ru": 4.5}}
+
+    with pytest.raises(ValueError):
+        next(_client(container).get_commit_history(fields=["x FROM c WHERE 1=1 --"]))
+
+
+def test_pages_can_be_resumed_from_a_continuation_token():
+    container = _FakeContainer({"FROM c": list(range(5))})
+    client = _client(container)
+    pages = client.iter_query_pages("q", "SELECT VALUE c.n FROM c", page_size=2, enable_cross_partition_query=True)
+    assert next(pages) == ([0, 1], "1")
+    pages.close()
+
+    resumed = client.iter_query_pages("q", "SELECT VALUE c.n FROM c", page_size=2, continuation_token="1",
+                                      enable_cross_partition_query=True)
+    assert list(resumed) == [([2, 3], "2"), ([4], None)]
+
+
+def test_value_counts_are_aggregated_on_the_server(charges):
+    # One GROUP BY query; a value returned in several rows (one per partition) is summed.
+    container = _FakeContainer({
+        "GROUP BY c.topic": [{"value": "AML", "count": 4}, {"value": "AKS", "count": 3}, {"value": "AML", "count": 3}],
+    })
+    assert _client(container).get_value_list("topic") == (["Select All", "AML", "AKS"], [7, 3])
+    assert len(container.queries) == 1
+    assert charges.stats()["get_value_list.topic"]["calls"] == 1
+
+    assert _client(_FakeContainer({"GROUP BY": []})).get_value_list("status") == ["None"]
+
+
+def test_value_counts_fall_back_to_one_projected_scan(charges):
+    def reject(parameters):
+        raise cosmosdbservice.exceptions.CosmosHttpResponseError(status_code=400, message="GROUP BY not supported")
+
+    container = _FakeContainer({"GROUP BY": reject, "SELECT VALUE c.status": ["post", "skip", "post"]})
+    assert _client(container).get_value_list("status") == (["Select All", "post", "skip"], [2, 1])
+    assert len(container.queries) == 2
+
+
+def test_tags_are_counted_while_streaming_titles():
+    container = _FakeContainer({"gpt_title_response": ["1 [新功能] a", "2 [修复] b", "3 [新功能] c", None]})
+    assert _client(container).get_value_list("tag") == (["Select All", "新功能", "修复"], [2, 1])
+
+
+def test_commit_times_are_distinct_and_sorted_on_the_server():
+    container = _FakeContainer({
+        "DISTINCT VALUE c.commit_time": ["2026-01-01 10:00:00", "2026-01-02 10:00:00"],
+        "MIN(": ["2026-01-01 10:00:00"],
+        "MAX(": ["2026-01-02 10:00:00"],
+    })
+    client = _client(container)
+    assert list(client.get_commit_time_list()) == ["2026-01-01 10:00:00", "2026-01-02 10:00:00"]
+    assert "ORDER BY c.commit_time ASC" in container.queries[0]
+    assert client.get_commit_time_range() == ("2026-01-01 10:00:00", "2026-01-02 10:00:00")
+    assert _client(_FakeContainer({"MIN(": [None]})).get_commit_time_range() is None
@@ -0,0 +1,107 @@
+"""
+Unit tests for partition-key-aware queries in `cosmosdbservice` and the
+re-keying tool `migrate_partition_key`.
+
+The CosmosDB containers are faked.
+Run: `python -m pytest test/test_cosmos_partition_key.py -v`
+"""
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cosmosdbservice import CosmosConversationClient, RequestChargeStats, partition_key_value
+import cosmosdbservice
+import migrate_partition_key
+
+ROOT = "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/machine-learning"
+
+
+class _FakeContainer:
+    """query_items answers from ``documents`` and reports ``charge`` RU per page, like the SDK's response_hook."""
+
+    def __init__(self, paths=("/pk",), documents=(), charge=2.5):
+        self.paths = list(paths)
+        self.documents = list(documents)
+        self.charge = charge
+        self.calls = []
+        self.upserts = []
+        self.client_connection = MagicMock(last_response_headers={"x-ms-request-charge": str(charge)})
+
+    def read(self):
+        return {"id": "c", "partitionKey": {"paths": self.paths, "kind": "Hash"}}
+
+    def query_items(self, query, parameters=None, response_hook=None, **options):
+        self.calls.append(options)
+        if response_hook:
+            response_hook({"x-ms-request-charge": "99"}, object())   # stale headers when the iterator is created
+            response_hook({"x-ms-request-charge": str(self.charge)}, {"Documents": self.documents})
+        return list(self.documents)
+
+    def upsert_item(self, body):
+        self.upserts.append(body)
+        return body
+
+
+def _client(container):
+    client = CosmosConversationClient.__new__(CosmosConversationClient)
+    client.container_name = "commits"
+    client.container_client = container
+    client._partition_key_paths = None
+    return client
+
+
+def test_queries_target_one_partition_when_the_container_is_keyed_by_pk(monkeypatch):
+    charges = RequestChargeStats()
+    monkeypatch.setattr(cosmosdbservice, "request_charges", charges)
+    container = _FakeContainer(documents=[{"commit_time": "2026-01-01 10:00:00"}])
+    client = _client(container)
+
+    assert client.get_lastest_commit("AML", "English", ROOT) == {"commit_time": "2026-01-01 10:00:00"}
+    client.get_commit_urls("AML", "English", ROOT, "2026-01-01", "2026-01-02")
+
+    assert container.calls == [{"partition_key": "AML|English"}] * 2
+    assert charges.stats() == {"get_lastest_commit": {"calls": 1, "ru": 2.5}, "get_commit_urls": {"calls": 1, "ru": 2.5}}
+
+
+def test_legacy_container_and_unreadable_properties_fall_back_to_cross_partition():
+    legacy = _FakeContainer(paths=["/id"])
+    _client(legacy).get_weekly_commit("AML", "English", ROOT)
+    assert legacy.calls == [{"enable_cross_partition_query": True}]
+
+    broken = _FakeContainer()
+    broken.read = MagicMock(side_effect=RuntimeError("forbidden"))
+    client = _client(broken)
+    client.check_weekly_summary("AML", "English", ROOT)
+    client.check_weekly_summary("AML", "English", ROOT)
+    assert broken.calls == [{"enable_cross_partition_query": True}] * 2
+    assert broken.read.call_count == 1
+
+
+def test_new_documents_carry_the_partition_key():
+    container = _FakeContainer()
+    _client(container).create_commit_history({"topic": "AML", "language": "Chinese", "commit_url": "u1"})
+    assert container.upserts[0]["pk"] == "AML|Chinese" == partition_key_value("AML", "Chinese")
+
+
+def test_migration_rekeys_documents_and_is_read_only_in_dry_run():
+    documents = [
+        {"id": "1", "topic": "AML", "language": "English", "_rid": "x", "_etag": "e", "_ts": 1},
+        {"id": "2", "topic": "AML", "language": "Chinese"},
+        {"id": "3", "topic": "AKS", "language": "English", "pk": "stale"},
+    ]
+    source = MagicMock()
+    source.query_items.return_value.by_page.return_value = iter([documents[:2], documents[2:]])
+    source.client_connection.last_response_headers = {"x-ms-request-charge": "3"}
+    target = _FakeContainer(charge=5)
+
+    stats = migrate_partition_key.migrate(source, target)
+    assert [d["pk"] for d in target.upserts] == ["AML|English", "AML|Chinese", "AKS|English"]
+    assert "_rid" not in target.upserts[0] and target.upserts[0]["id"] == "1"
+    assert stats == {"read": 3, "written": 3, "failed": 0, "read_ru": 6.0, "write_ru": 15.0, "partitions": 3}
+
+    source.query_items.return_value.by_page.return_value = iter([documents])
+    dry = _FakeContainer()
+    assert migrate_partition_key.migrate(source, dry, dry_run=True)["written"] == 0
+    assert dry.upserts == []
@@ -0,0 +1,90 @@
+"""
+Unit tests for the queue-backed error webhook sink (`logs.WebhookHandler`):
+logging never waits for the webhook, identical tracebacks are deduplicated
+within a window, several errors are batched into one message, and the queue
+is drained on close.
+
+The webhook is replaced by a recording (optionally slow) post function.
+Run: `python -m pytest test/test_error_webhook.py -v`
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from logs import WebhookHandler
+
+TRACEBACK = "Traceback (most recent call last):\n  File \"spyder.py\", line 1, in publish_commit\nValueError: boom"
+
+
+class _Recorder:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.texts = []
+        self.release = threading.Event()
+
+    def __call__(self, url, payload):
+        if self.delay:
+            self.release.wait(self.delay)
+        self.texts.append(payload["text"])
+
+
+def _handler(post, **kwargs):
+    options = dict(dedupe_seconds=300, batch_seconds=0.2, batch_size=10)
+    options.update(kwargs)
+    handler = WebhookHandler("https://example.webhook.office.com/errors", post=post, **options)
+    handler.threshold = 10_000
+    return handler
+
+
+def _line(stamp, text, traceback=""):
+    return f"2026-10-18 09:00:{stamp:02d}.000 | ERROR    | spyder:publish_commit:42 - {text}" + (f"\n{traceback}" if traceback else "")
+
+
+def test_logging_does_not_wait_for_a_slow_webhook():
+    post = _Recorder(delay=5)
+    handler = _handler(post, batch_seconds=0)
+    started = time.monotonic()
+    for i in range(20):
+        handler(_line(i, f"error {i}"))
+    assert time.monotonic() - started < 0.5
+    post.release.set()
+    handler.close(timeout=5)
+    assert sum(text.count("error ") for text in post.texts) == 20
+
+
+def test_identical_tracebacks_are_sent_once_per_window_and_errors_are_batched():
+    post = _Recorder()
+    handler = _handler(post)
+    for i in range(5):
+        handler(_line(i, "Unexpected exception:", TRACEBACK))      # same traceback, different timestamps
+    handler(_line(6, "Failed to create commit history in CosmosDB!"))
+    handler.close(timeout=5)
+
+    assert len(post.texts) == 1
+    assert post.texts[0].startswith("检测到 2 条异常：")
+    assert post.texts[0].count("ValueError: boom") == 1
+
+    # After the window the traceback is reported again, with the number of omitted repeats.
+    post = _Recorder()
+    handler = _handler(post, dedupe_seconds=0.05)
+    handler(_line(0, "Unexpected exception:", TRACEBACK))
+    handler(_line(1, "Unexpected exception:", TRACEBACK))
+    time.sleep(0.1)
+    handler(_line(2, "Unexpected exception:", TRACEBACK))
+    handler.close(timeout=5)
+    assert "重复 1 次" in post.texts[-1]
+    assert WebhookHandler.dedupe_key(_line(0, "x", TRACEBACK)) == WebhookHandler.dedupe_key(_line(9, "x", TRACEBACK))
+
+
+def test_a_full_queue_drops_errors_and_reports_the_count():
+    post = _Recorder(delay=5)
+    handler = _handler(post, batch_seconds=0, batch_size=1, queue_size=2)
+    for i in range(10):
+        handler(_line(i, f"error {i}"))
+    post.release.set()
+    handler.close(timeout=5)
+    assert any("丢弃了" in text for text in post.texts)
+    assert handler.dropped == 0
@@ -0,0 +1,78 @@
+"""
+Unit tests for github_http (shared session + rate-limit handling) and the
+retry loop in `CommitFetcher._request_with_retries`.
+
+The shared session's `get` and `time.sleep` are mocked; no GitHub call is made.
+Run: `python -m pytest test/test_github_http.py -v`
+"""
+import os
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import commit_fetch
+from commit_fetch import CommitFetcher
+from github_http import RateLimitGate, is_rate_limited
+
+
+def _response(status_code=200, headers=None, text=""):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.text = text
+    if status_code >= 400:
+        import requests
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} error")
+    return response
+
+
+def test_retry_after_header_is_honoured():
+    gate = RateLimitGate()
+    response = _response(403, {"Retry-After": "17"}, "You have exceeded a secondary rate limit")
+    assert is_rate_limited(response)
+    assert gate.retry_delay(response, attempt=0, base_delay=2) == 17
+
+
+def test_exhausted_quota_waits_until_reset_and_pauses_globally():
+    gate = RateLimitGate()
+    reset_at = int(time.time()) + 30
+    response = _response(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset_at)})
+    wait_seconds = gate.retry_delay(response, attempt=0, base_delay=2)
+    assert 29 <= wait_seconds <= 31
+    assert gate._pause_until >= reset_at
+
+
+def test_observe_pauses_when_quota_near_zero():
+    gate = RateLimitGate(reserve=10)
+    reset_at = int(time.time()) + 120
+    gate.observe(_response(200, {"X-RateLimit-Remaining": "5", "X-RateLimit-Limit": "5000", "X-RateLimit-Reset": str(reset_at)}))
+    stats = gate.stats()
+    assert stats["remaining"] == 5 and stats["limit"] == 5000 and stats["requests"] == 1
+    with patch("github_http.time.sleep") as sleep:
+        gate.wait_if_paused()
+    assert sleep.call_args[0][0] > 100
+
+
+def test_observe_does_not_pause_with_plenty_of_quota():
+    gate = RateLimitGate(reserve=10)
+    gate.observe(_response(200, {"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": str(int(time.time()) + 60)}))
+    assert gate.wait_if_paused() == 0
+
+
+def test_server_errors_are_retried_then_succeed():
+    responses = [_response(502), _response(200)]
+    with patch.object(commit_fetch.github_session, "get", side_effect=responses) as get, \
+            patch("time.sleep") as sleep:
+        result = CommitFetcher()._request_with_retries("https://api.github.com/x", headers={})
+    assert result is responses[1]
+    assert get.call_count == 2
+    assert sleep.call_count == 1
+
+
+def test_client_errors_are_not_retried():
+    with patch.object(commit_fetch.github_session, "get", return_value=_response(404)) as get, \
+            patch("time.sleep"):
+        assert CommitFetcher()._request_with_retries("https://api.github.com/x", headers={}) is None
+    assert get.call_count == 1
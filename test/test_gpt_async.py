@@ -0,0 +1,144 @@
+"""
+Unit tests for the async Azure OpenAI path in `gpt_reply`: sync shims,
+fan-out through the background event loop, the concurrency cap and the
+RPM/TPM limiter.
+
+The async client is faked, so no Azure OpenAI call is made.
+Run: `python -m pytest test/test_gpt_async.py -v`
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import gpt_reply
+from llm_cache import LLMResponseCache
+from rate_limiter import TokenBucket
+
+
+class _FakeCompletions:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.completed = []
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        content = kwargs["messages"][-1]["content"].upper()
+        self.completed.append(content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2, total_tokens=5),
+        )
+
+
+@pytest.fixture
+def fake_client():
+    completions = _FakeCompletions(delay=0.05)
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    with patch.object(gpt_reply, "async_client", fake), \
+         patch.object(gpt_reply, "response_cache", LLMResponseCache(path="")), \
+         patch.object(gpt_reply, "rpm_budget", TokenBucket(0)), \
+         patch.object(gpt_reply, "tpm_budget", TokenBucket(0)):
+        yield completions
+
+
+def _messages(text):
+    return [{"role": "system", "content": "s"}, {"role": "user", "content": text}]
+
+
+def test_sync_shim_returns_the_async_result(fake_client):
+    assert gpt_reply.get_gpt_response(_messages("hello")) == ("HELLO", 3, 2, 5)
+    assert fake_client.calls == 1
+
+
+def test_fan_out_runs_concurrently_and_keeps_order(fake_client):
+    coros = [gpt_reply.get_gpt_response_async(_messages(f"m{i}")) for i in range(6)]
+    with patch.object(gpt_reply, "_concurrency", asyncio.Semaphore(3)):
+        results = gpt_reply.run_sync(gpt_reply.gather_gpt_calls(*coros))
+
+    assert [r[0] for r in results] == [f"M{i}" for i in range(6)]
+    assert fake_client.max_in_flight == 3
+
+
+def test_run_sync_refuses_to_block_the_event_loop(fake_client):
+    async def nested():
+        return gpt_reply.run_sync(asyncio.sleep(0))
+
+    with pytest.raises(RuntimeError):
+        gpt_reply.run_sync(nested())
+
+
+def test_limiter_accounts_for_requests_and_tokens():
+    with patch.object(gpt_reply, "rpm_budget", TokenBucket(60, capacity=1)), \
+         patch.object(gpt_reply, "tpm_budget", TokenBucket(600000)):
+        assert gpt_reply._reserve_budget(_messages("x"))[1] == 0
+        # Second request within the same second has to wait for the RPM bucket.
+        assert gpt_reply._reserve_budget(_messages("x"))[1] == pytest.approx(1.0, abs=0.05)
+
+    with patch.object(gpt_reply, "rpm_budget", TokenBucket(0)), \
+         patch.object(gpt_reply, "tpm_budget", TokenBucket(5000)):
+        # 4002 prompt chars ~ 1000 tokens + max_tokens 1000
+        estimated, wait = gpt_reply._reserve_budget(_messages("x" * 4000), max_tokens=1000)
+        assert estimated == 2000
+        assert wait == 0
+        gpt_reply._reserve_budget(_messages("x" * 4000), max_tokens=1000)
+        # 1000 tokens left, the third request is 1000 short: 1000 / 5000 TPM = 12s.
+        assert gpt_reply._reserve_budget(_messages("x" * 4000), max_tokens=1000)[1] == pytest.approx(12, abs=0.5)
+
+
+def test_budget_wait_does_not_block_other_calls(fake_client):
+    """A call waiting for budget sleeps on the event loop, not in a thread."""
+    with patch.object(gpt_reply, "_reserve_budget", side_effect=[(10, 0.3), (10, 0.0)]):
+        results = gpt_reply.run_sync(gpt_reply.gather_gpt_calls(
+            gpt_reply.get_gpt_response_async(_messages("slow")),
+            gpt_reply.get_gpt_response_async(_messages("fast")),
+        ))
+    assert [r[0] for r in results] == ["SLOW", "FAST"]
+    assert fake_client.completed == ["FAST", "SLOW"]
+
+
+def test_cache_reads_and_writes_run_off_the_event_loop(fake_client):
+    """Blocking SQLite calls of the response cache run in worker threads."""
+    loop_threads = set()
+
+    class _SlowCache:
+        enabled = True
+
+        def __init__(self):
+            self.threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            time.sleep(0.2)
+            return None
+
+        def put(self, key, *args):
+            self.threads.append(threading.get_ident())
+
+    async def fan_out():
+        loop_threads.add(threading.get_ident())
+        return await gpt_reply.gather_gpt_calls(*[gpt_reply.get_gpt_response_async(_messages(f"m{i}")) for i in range(3)])
+
+    cache = _SlowCache()
+    started = time.monotonic()
+    with patch.object(gpt_reply, "response_cache", cache):
+        results = gpt_reply.run_sync(fan_out())
+    assert [r[0] for r in results] == ["M0", "M1", "M2"]
+    assert time.monotonic() - started < 0.5          # the three lookups overlap
+    assert len(cache.threads) == 6 and not loop_threads & set(cache.threads)
@@ -0,0 +1,125 @@
+"""
+Unit tests for the Batch API mode (`gpt_batch`) and the request collection
+mode in `gpt_reply`.
+
+Batches go through the real `openai` client against a local stand-in
+server (test/batch_stub_server.py), so no Azure OpenAI call is made.
+Run: `python -m pytest test/test_gpt_batch.py -v`
+"""
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, patch
+
+import openai
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import gpt_reply
+from batch_stub_server import BatchStubServer
+from gpt_batch import BatchCollector, GPTBatchRunner, parse_result_line, run_batch_rounds
+from llm_cache import LLMResponseCache
+
+SUMMARY_PROMPT = [{"role": "system", "content": "Summarize"}, {"role": "user", "content": "+ new line"}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    with patch.object(gpt_reply, "response_cache", cache):
+        yield cache
+
+
+@pytest.fixture
+def stub():
+    server = BatchStubServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _runner(stub, cache, tmp_path, **kwargs):
+    client = openai.OpenAI(api_key="test", base_url=stub.base_url, max_retries=0)
+    return GPTBatchRunner(client, cache, deployment="gpt-batch", batch_dir=str(tmp_path / "batches"),
+                          poll_seconds=0.01, **kwargs)
+
+
+def _summary_then_title():
+    """Legacy-style dependency: the title prompt is built from the summary answer."""
+    summary = gpt_reply.get_gpt_response(SUMMARY_PROMPT)[0]
+    if summary is None:
+        return None, None
+    title = gpt_reply.get_gpt_response([{"role": "user", "content": summary}])[0]
+    return summary, title
+
+
+def test_collect_mode_records_cache_misses_without_calling_the_api(cache):
+    collector = BatchCollector()
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock) as api, \
+         gpt_reply.collect_gpt_requests(collector):
+        assert gpt_reply.get_gpt_response(SUMMARY_PROMPT) == (None, None, None, None)
+        assert gpt_reply.get_gpt_response(SUMMARY_PROMPT) == (None, None, None, None)
+    assert api.call_count == 0
+    assert len(collector) == 1
+    assert list(collector.requests.values())[0]["messages"] == SUMMARY_PROMPT
+
+
+def test_rounds_answer_dependent_requests_from_the_batch(stub, cache, tmp_path):
+    stats = run_batch_rounds(_summary_then_title, _runner(stub, cache, tmp_path))
+
+    assert stats == {"rounds": 2, "requests": 2, "stored": 2}
+    # Every request went out under the batch deployment.
+    assert [body["model"] for body in stub.requests] == ["gpt-batch", "gpt-batch"]
+    # The real pass is served from the cache.
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock) as api:
+        assert _summary_then_title() == ("stub: + new line", "stub: stub: + new line")
+    assert api.call_count == 0
+
+
+def test_failed_and_unparseable_results_are_not_cached(stub, cache, tmp_path):
+    response_format = {"type": "json_schema", "json_schema": {"name": "x", "schema": {}}}
+    stub.responder = lambda body: None if "fail" in body["messages"][-1]["content"] else "not json"
+
+    def analyze():
+        gpt_reply.get_gpt_response([{"role": "user", "content": "fail"}])
+        gpt_reply.get_gpt_structured_response(SUMMARY_PROMPT, response_format)
+
+    stats = run_batch_rounds(analyze, _runner(stub, cache, tmp_path))
+    assert stats == {"rounds": 1, "requests": 2, "stored": 0}
+    assert cache.stats()["stores"] == 0
+
+
+def test_input_file_keeps_the_cache_key_as_custom_id(stub, cache, tmp_path):
+    runner = _runner(stub, cache, tmp_path)
+    path = runner.write_input_file({"k1": {"model": "gpt", "messages": SUMMARY_PROMPT, "temperature": 0}})
+    with open(path, encoding="utf-8") as f:
+        line = json.loads(f.readline())
+    assert line == {"custom_id": "k1", "method": "POST", "url": "/chat/completions",
+                    "body": {"model": "gpt-batch", "messages": SUMMARY_PROMPT, "temperature": 0}}
+
+    ok = {"custom_id": "k1", "response": {"status_code": 200, "body": {
+        "choices": [{"message": {"content": "x"}}], "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}}}}
+    assert parse_result_line(json.dumps(ok), {"k1": {}}) == ("k1", "x", 1, 2, 3)
+    assert parse_result_line(json.dumps(ok), {}) is None
+    assert parse_result_line(json.dumps({**ok, "error": {"code": "x"}}), {"k1": {}}) is None
+
+
+def test_unfinished_batch_is_cancelled_and_falls_back(stub, cache, tmp_path):
+    stub.polls_before_complete = 1000
+    stats = run_batch_rounds(_summary_then_title, _runner(stub, cache, tmp_path, timeout_seconds=0.05))
+
+    assert stats == {"rounds": 1, "requests": 1, "stored": 0}
+    assert [batch["status"] for batch in stub.batches.values()] == ["cancelled"]
+
+
+def test_batch_errors_and_disabled_cache_fail_open(tmp_path):
+    broken = GPTBatchRunner(openai.OpenAI(api_key="test", base_url="http://127.0.0.1:9/", max_retries=0),
+                            LLMResponseCache(path=str(tmp_path / "c.sqlite3")), batch_dir=str(tmp_path))
+    with patch.object(gpt_reply, "response_cache", broken.cache):
+        assert run_batch_rounds(_summary_then_title, broken) == {"rounds": 1, "requests": 1, "stored": 0}
+
+    disabled = GPTBatchRunner(broken.client, LLMResponseCache(path=""))
+    analyze = lambda: pytest.fail("analyze must not run without a cache")
+    assert run_batch_rounds(analyze, disabled)["rounds"] == 0
@@ -0,0 +1,126 @@
+"""
+Unit tests for the Azure OpenAI retry policy in `gpt_reply`
+(`chat_completion_with_backoff_async`, `retry_after_seconds`, `track_gpt_calls`)
+and the per-commit metrics stored by `Spyder.analyze_commit`.
+
+The request itself is faked with real `openai` exception objects.
+Run: `python -m pytest test/test_gpt_retry.py -v`
+"""
+import email.utils
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import gpt_reply
+from gpt_reply import retry_after_seconds, track_gpt_calls
+from llm_cache import LLMResponseCache
+from rate_limiter import TokenBucket
+
+MESSAGES = [{"role": "user", "content": "patch"}]
+_REQUEST = httpx.Request("POST", "https://example.openai.azure.com/openai/v1/chat/completions")
+
+
+def _error(cls, status, headers=None):
+    return cls("error", response=httpx.Response(status, headers=headers or {}, request=_REQUEST), body=None)
+
+
+def _ok(content="summary"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2),
+    )
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    with patch.object(gpt_reply, "response_cache", LLMResponseCache(path="")), \
+         patch.object(gpt_reply, "rpm_budget", TokenBucket(0)), \
+         patch.object(gpt_reply, "tpm_budget", TokenBucket(0)):
+        yield
+
+
+def _serve(*outcomes):
+    return patch.object(gpt_reply, "_create_chat_completion", side_effect=list(outcomes))
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(_error(openai.RateLimitError, 429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(_error(openai.RateLimitError, 429, {"retry-after": "7"})) == 7
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after_seconds(_error(openai.RateLimitError, 429, {"retry-after": http_date})) == pytest.approx(30, abs=2)
+    assert retry_after_seconds(_error(openai.RateLimitError, 429)) is None
+
+
+def test_429_is_retried_after_the_requested_delay():
+    throttled = _error(openai.RateLimitError, 429, {"retry-after-ms": "20"})
+    with _serve(throttled, throttled, _ok()) as create, track_gpt_calls() as metrics:
+        assert gpt_reply.get_gpt_response(MESSAGES)[0] == "summary"
+
+    assert create.call_count == 3
+    assert metrics.as_dict() == {"calls": 3, "retries": 2, "backoff_seconds": 0.04, "errors": {"429": 2}}
+
+
+def test_5xx_and_connection_errors_are_retried():
+    with _serve(_error(openai.InternalServerError, 503, {"retry-after": "0"}),
+                openai.APIConnectionError(request=_REQUEST), _ok()) as create, \
+         patch.object(gpt_reply.random, "uniform", return_value=0), \
+         patch.object(gpt_reply.asyncio, "sleep", new_callable=AsyncMock):
+        assert gpt_reply.get_gpt_response(MESSAGES)[0] == "summary"
+    assert create.call_count == 3
+
+
+def test_bad_request_is_not_retried():
+    with _serve(_error(openai.BadRequestError, 400), _ok()) as create, track_gpt_calls() as metrics:
+        assert gpt_reply.get_gpt_response(MESSAGES) == (None, None, None, None)
+    assert create.call_count == 1
+    assert metrics.as_dict()["errors"] == {"400": 1}
+
+
+def test_stops_after_max_retries():
+    unavailable = _error(openai.InternalServerError, 503, {"retry-after-ms": "1"})
+    with _serve(*[unavailable] * 10) as create, patch.object(gpt_reply, "GPT_MAX_RETRIES", 2):
+        assert gpt_reply.get_gpt_response(MESSAGES)[0] is None
+    assert create.call_count == 3
+
+
+def test_wait_budget_is_shared_by_the_calls_of_one_commit():
+    throttled = _error(openai.RateLimitError, 429, {"retry-after-ms": "60"})
+    start = time.monotonic()
+    with _serve(throttled, _ok(), throttled, _ok()) as create, track_gpt_calls(max_wait_seconds=0.1) as metrics:
+        assert gpt_reply.get_gpt_response(MESSAGES)[0] == "summary"   # waits 0.06s
+        assert gpt_reply.get_gpt_response(MESSAGES)[0] is None        # 0.06s more would exceed 0.1s
+    assert create.call_count == 3
+    assert metrics.retries == 1
+    assert time.monotonic() - start < 0.5
+
+
+def test_analyze_commit_stores_gpt_call_metrics():
+    from spyder import Spyder
+
+    spyder = Spyder.__new__(Spyder)
+    spyder.max_input_token = 1000
+    spyder.headers = {}
+    spyder.language = "English"
+    spyder.system_prompt_dict = {}
+    spyder.get_change_from_each_url = lambda time_, url, max_input_token, headers: "patch"
+
+    def generate(patch_data, language, prompts, url_mapping, commit_history):
+        summary = gpt_reply.get_gpt_response(MESSAGES)[0]
+        return summary, "1 title", "post"
+
+    spyder.generate_gpt_responses = generate
+    throttled = _error(openai.RateLimitError, 429, {"retry-after-ms": "10"})
+    with _serve(throttled, _ok()):
+        result = spyder.analyze_commit(None, "https://api.github.com/repos/o/r/commits/abc", None)
+
+    commit_history = result[-1]
+    assert commit_history["gpt_call_metrics"]["retries"] == 1
+    assert commit_history["gpt_call_metrics"]["errors"] == {"429": 1}
@@ -0,0 +1,114 @@
+"""
+Unit tests for the persistent GPT response cache (`llm_cache`) and its use
+in `gpt_reply`.
+
+The Azure OpenAI client is faked; the cache lives in a temporary directory.
+Run: `python -m pytest test/test_llm_cache.py -v`
+"""
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import gpt_reply
+import llm_cache
+from llm_cache import LLMResponseCache, request_cache_key
+
+MESSAGES = [{"role": "system", "content": "Summarize"}, {"role": "user", "content": "+ new line"}]
+
+
+def _completion(content, prompt=10, completion=5):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion),
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl_seconds=3600, max_entries=100, bypass=False)
+    with patch.object(gpt_reply, "response_cache", cache):
+        yield cache
+
+
+def test_key_covers_every_request_field():
+    base = {"model": "gpt", "messages": MESSAGES, "temperature": 0, "max_tokens": 1000}
+    assert request_cache_key(base) == request_cache_key(dict(reversed(list(base.items()))))
+    for field, value in [("model", "other"), ("temperature", 1), ("max_tokens", 10),
+                         ("response_format", {"type": "json_object"}), ("messages", MESSAGES[:1])]:
+        assert request_cache_key({**base, field: value}) != request_cache_key(base)
+
+
+def test_identical_request_is_served_from_cache(cache):
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock, return_value=_completion("summary")) as api:
+        first = gpt_reply.get_gpt_response(MESSAGES)
+        second = gpt_reply.get_gpt_response(MESSAGES)
+
+    assert api.call_count == 1
+    assert first == second == ("summary", 10, 5, 15)
+    assert cache.stats() == {"hits": 1, "misses": 1, "stores": 1}
+
+
+def test_use_cache_false_and_bypass_skip_lookup(cache):
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock, return_value=_completion("summary")) as api:
+        gpt_reply.get_gpt_response(MESSAGES)
+        gpt_reply.get_gpt_response(MESSAGES, use_cache=False)
+        cache.bypass = True
+        gpt_reply.get_gpt_response(MESSAGES)
+    assert api.call_count == 3
+
+
+def test_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    LLMResponseCache(path=path).put("k", "content", 1, 2, 3)
+    assert LLMResponseCache(path=path).get("k") == ("content", 1, 2, 3)
+
+
+def test_expired_and_excess_entries_are_evicted(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    with patch.object(llm_cache.time, "time", return_value=time.time() - 7200):
+        LLMResponseCache(path=path).put("old", "content", 1, 2, 3)
+    LLMResponseCache(path=path).put("new", "content", 1, 2, 3)
+    cache = LLMResponseCache(path=path, ttl_seconds=3600)
+    assert cache.get("old") is None
+    assert cache.get("new") == ("content", 1, 2, 3)
+
+    small = LLMResponseCache(path=str(tmp_path / "small.sqlite3"), max_entries=2)
+    for key in ("a", "b", "c"):
+        small.put(key, key, 1, 1, 2)
+    reopened = LLMResponseCache(path=str(tmp_path / "small.sqlite3"), max_entries=2)
+    assert reopened.get("a") is None
+    assert reopened.get("c") == ("c", 1, 1, 2)
+
+
+def test_unparseable_structured_response_is_not_cached(cache):
+    response_format = {"type": "json_schema", "json_schema": {"name": "x", "schema": {}}}
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock, return_value=_completion('{"title": "cut')) as api:
+        assert gpt_reply.get_gpt_structured_response(MESSAGES, response_format)[0] is None
+        assert gpt_reply.get_gpt_structured_response(MESSAGES, response_format)[0] is None
+    assert api.call_count == 2
+
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock, return_value=_completion(json.dumps({"title": "ok"}))) as api:
+        gpt_reply.get_gpt_structured_response(MESSAGES, response_format)
+        parsed, *_ = gpt_reply.get_gpt_structured_response(MESSAGES, response_format)
+    assert api.call_count == 1
+    assert parsed == {"title": "ok"}
+
+
+def test_failed_call_is_not_cached(cache):
+    with patch.object(gpt_reply, "chat_completion_with_backoff_async", new_callable=AsyncMock, side_effect=RuntimeError("429")):
+        assert gpt_reply.get_gpt_response(MESSAGES) == (None, None, None, None)
+    assert cache.stats()["stores"] == 0
+
+
+def test_disabled_cache_never_touches_disk(tmp_path):
+    cache = LLMResponseCache(path="")
+    cache.put("k", "content", 1, 2, 3)
+    assert cache.get("k") is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,156 @@
+"""
+Unit tests for the shared repository-level crawl planner (`repo_crawl`).
+
+Commit listing and commit details are faked, so no GitHub API call is made.
+Run: `python -m pytest test/test_repo_crawl.py -v`
+"""
+import datetime
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import commit_fetch
+from repo_crawl import PathPrefixTrie, SharedRepoCrawl, commit_stream_url, group_targets_by_stream
+
+REPO = "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits"
+T0 = datetime.datetime(2026, 6, 1, 0, 0, 0)
+
+
+def _at(minutes):
+    return T0 + datetime.timedelta(minutes=minutes)
+
+
+def _url(n):
+    return f"https://api.github.com/repos/MicrosoftDocs/azure-docs/commits/{n:040x}"
+
+
+def test_trie_matches_like_startswith():
+    trie = PathPrefixTrie()
+    trie.add("articles/ai-services/openai/", "openai")
+    trie.add("articles/ai-services/", "ai")
+    trie.add("articles/machine-learning", "aml")
+    trie.add(None, "all")
+
+    assert trie.match("articles/ai-services/openai/overview.md") == {"openai", "ai", "all"}
+    assert trie.match("articles/ai-services/speech/a.md") == {"ai", "all"}
+    # Same semantics as str.startswith: no path-component boundary is required.
+    assert trie.match("articles/machine-learning-v1/a.md") == {"aml", "all"}
+    assert trie.match("includes/x.md") == {"all"}
+
+
+def test_commit_stream_url_drops_path_but_keeps_branch():
+    assert commit_stream_url(REPO + "?path=articles/a") == REPO
+    assert commit_stream_url(REPO + "?path=articles/a&sha=live") == REPO + "?sha=live"
+    assert commit_stream_url(REPO + "?sha=live&per_page=50&path=x") == REPO + "?sha=live"
+
+
+def test_group_targets_by_stream_requires_min_targets():
+    targets = [
+        {"topic_name": "A", "root_commits_url": REPO + "?path=articles/a"},
+        {"topic_name": "B", "root_commits_url": REPO + "?path=articles/b"},
+        {"topic_name": "C", "root_commits_url": REPO + "?path=articles/c&sha=live"},
+        {"topic_name": "D", "root_commits_url": "https://api.github.com/repos/MicrosoftDocs/fabric-docs/commits?path=docs"},
+    ]
+    groups = group_targets_by_stream(targets, min_targets=2)
+    assert list(groups) == [REPO]
+    assert [t["topic_name"] for t in groups[REPO]] == ["A", "B"]
+
+
+def _crawl(start_times=None):
+    members = {"a": REPO + "?path=articles/a/", "b": REPO + "?path=articles/b/"}
+    return SharedRepoCrawl(REPO, members, start_times or {"a": T0, "b": T0}, headers={})
+
+
+def test_route_sends_each_commit_to_matching_targets():
+    files = {
+        _url(1): [{"filename": "articles/a/x.md"}],
+        _url(2): [{"filename": "articles/b/y.md"}, {"filename": "articles/a/z.md"}],
+        _url(3): [{"filename": "includes/other.md"}],
+        # A file moved out of articles/b still touched that topic.
+        _url(4): [{"filename": "archive/y.md", "previous_filename": "articles/b/y.md"}],
+    }
+    commits = [(_at(4), _url(4)), (_at(3), _url(3)), (_at(2), _url(2)), (_at(1), _url(1))]
+    crawl = _crawl()
+    with patch.object(SharedRepoCrawl, "list_commits", return_value=commits) as listing, \
+         patch.object(SharedRepoCrawl, "get_commit_files", side_effect=lambda url, headers: files[url]):
+        routed = crawl.route()
+
+    listing.assert_called_once()
+    assert routed["a"] == {_at(1): _url(1), _at(2): _url(2)}
+    assert routed["b"] == {_at(2): _url(2), _at(4): _url(4)}
+
+
+def test_route_respects_each_target_start_time():
+    commits = [(_at(1), _url(1)), (_at(5), _url(5))]
+    crawl = _crawl({"a": T0, "b": _at(3)})
+    with patch.object(SharedRepoCrawl, "list_commits", return_value=commits) as listing, \
+         patch.object(SharedRepoCrawl, "get_commit_files", return_value=[{"filename": "articles/a/x.md"}, {"filename": "articles/b/x.md"}]):
+        routed = crawl.route()
+
+    # The stream is listed from the earliest start time in the group.
+    assert listing.call_args.kwargs["since"] == T0
+    assert routed["a"] == {_at(1): _url(1), _at(5): _url(5)}
+    assert routed["b"] == {_at(5): _url(5)}
+
+
+def test_a_stale_member_crawls_on_its_own():
+    members = {"a": REPO + "?path=articles/a/", "b": REPO + "?path=articles/b/", "new": REPO + "?path=articles/c/"}
+    start_times = {"a": _at(60), "b": _at(30), "new": T0 - datetime.timedelta(days=90)}
+    crawl = SharedRepoCrawl(REPO, members, start_times, headers={}, max_lag_seconds=7200)
+    assert crawl.stale == {"new"}
+
+    commits = [(_at(90), _url(90)), (_at(45), _url(45))]
+    with patch.object(SharedRepoCrawl, "list_commits", return_value=commits) as listing, \
+         patch.object(SharedRepoCrawl, "get_commit_files", return_value=[{"filename": "articles/c/x.md"}, {"filename": "articles/b/x.md"}]):
+        routed = crawl.route()
+
+    # The stream is listed from the oldest member that is not stale, and the stale one gets no plan.
+    assert listing.call_args.kwargs["since"] == _at(30)
+    assert routed == {"a": {}, "b": {_at(45): _url(45), _at(90): _url(90)}}
+
+
+def test_route_fails_open_when_a_detail_request_fails():
+    with patch.object(SharedRepoCrawl, "list_commits", return_value=[(_at(1), _url(1))]), \
+         patch.object(SharedRepoCrawl, "get_commit_files", return_value=None):
+        assert _crawl().route() is None
+
+
+class _Page:
+    """Commits page response: ``size`` commits from ``newest`` minutes downwards."""
+
+    def __init__(self, newest, size, next_url=None):
+        self.status_code = 200
+        self.headers = {}
+        self._items = [{"url": _url(newest - i), "commit": {"author": {"date": _at(newest - i).strftime("%Y-%m-%dT%H:%M:%SZ")}}}
+                       for i in range(size)]
+        self.links = {"next": {"url": next_url}} if next_url else {}
+
+    def json(self):
+        return self._items
+
+
+def _route_pages(pages, start_times=None):
+    crawl = _crawl(start_times)
+    with patch.object(commit_fetch, "commit_list_validators", MagicMock(conditional_headers=lambda url, headers: headers)), \
+         patch.object(SharedRepoCrawl, "_request_with_retries", side_effect=pages), \
+         patch.object(SharedRepoCrawl, "get_commit_files", return_value=[{"filename": "articles/a/x.md"}]):
+        return crawl.route()
+
+
+def test_route_falls_back_when_the_listing_hits_the_page_limit():
+    per_page, limit = commit_fetch.GITHUB_COMMITS_PER_PAGE, commit_fetch.GITHUB_MAX_COMMIT_PAGES
+    newest = per_page * (limit + 1)
+    # Every page is full and still links to an older one: the oldest commits were never listed.
+    pages = [_Page(newest - n * per_page, per_page, next_url=f"{REPO}?page={n + 2}") for n in range(limit)]
+    assert _route_pages(pages) is None
+
+    # Without a Link header, a full last page at the limit is treated the same way.
+    pages[-1] = _Page(newest - (limit - 1) * per_page, per_page)
+    assert _route_pages(pages) is None
+
+    # A listing that reaches a page older than every start time is complete.
+    routed = _route_pages([_Page(10, 5, next_url=f"{REPO}?page=2"), _Page(5, 6, next_url=f"{REPO}?page=3"),
+                           _Page(-1, 3, next_url=f"{REPO}?page=4")])
+    assert routed["a"] == {_at(m): _url(m) for m in range(1, 11)}
@@ -0,0 +1,81 @@
+"""
+Unit tests for the adaptive per-target polling schedule (`scheduler`).
+
+The clock and the jitter source are faked.
+Run: `python -m pytest test/test_scheduler.py -v`
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler import AdaptiveScheduler
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _scheduler(keys, clock, rng=lambda: 0.5, **kwargs):
+    options = dict(min_interval=600, max_interval=21600, jitter=0.1, alpha=0.5, commits_per_poll=1.0,
+                   poll_budget_per_hour=0)
+    options.update(kwargs)
+    return AdaptiveScheduler(keys, 7200, clock=clock, rng=rng, **options)
+
+
+def test_every_target_is_due_at_start_and_rescheduled_after_record():
+    clock = _Clock()
+    scheduler = _scheduler(["a", "b", "c"], clock)
+    assert scheduler.pop_due() == ["a", "b", "c"]
+    assert scheduler.pop_due() == [] and scheduler.seconds_until_next() is None
+
+    assert scheduler.record("b", 0, window_seconds=7200) == 21600
+    assert scheduler.seconds_until_next() == 21600
+    clock.now = 21600
+    assert scheduler.pop_due() == ["b"]
+
+
+def test_busy_targets_are_polled_more_often_and_dormant_ones_less():
+    clock = _Clock()
+    scheduler = _scheduler(["hot", "cold"], clock, poll_budget_per_hour=100)
+    scheduler.pop_due()
+
+    hot = scheduler.record("hot", 4, window_seconds=3600)      # 4 commits/hour
+    cold = scheduler.record("cold", 0, window_seconds=3600)
+    assert hot == 900 and cold == 21600
+    assert scheduler.snapshot() == {"hot": {"rate": 4.0, "interval": 900}, "cold": {"rate": 0.0, "interval": 21600}}
+
+    # The rate is smoothed: a quiet poll does not drop a busy target to the maximum interval at once.
+    clock.now = 900
+    assert scheduler.record("hot", 0) == 1800
+    assert scheduler.record("hot", 100, window_seconds=3600) == 600   # never below the minimum
+
+
+def test_total_polls_stay_within_the_budget_of_the_fixed_schedule():
+    clock = _Clock()
+    keys = [f"t{i}" for i in range(4)]
+    scheduler = _scheduler(keys, clock)       # budget: 4 targets every 7200 s = 2 polls/hour
+    scheduler.pop_due()
+    for _ in range(2):      # every target is rescaled on its next poll
+        for key in keys:
+            scheduler.record(key, 12, window_seconds=3600)
+
+    intervals = [state["interval"] for state in scheduler.snapshot().values()]
+    assert sum(3600 / interval for interval in intervals) <= 2 + 1e-9
+    assert all(interval <= 21600 for interval in intervals)
+
+
+def test_jitter_spreads_next_due_times_within_bounds():
+    clock = _Clock()
+    draws = iter([0.0, 1.0])
+    scheduler = _scheduler(["a", "b"], clock, rng=lambda: next(draws))
+    scheduler.pop_due()
+    scheduler.record("a", 0, window_seconds=7200)
+    scheduler.record("b", 0, window_seconds=7200)
+
+    due = sorted(due for due, _, _ in scheduler._heap)
+    assert due == [21600 * 0.9, 21600 * 1.1]
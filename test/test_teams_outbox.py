@@ -0,0 +1,178 @@
+"""
+Unit tests for the durable Teams outbox (`teams_outbox`) and
+`TeamsNotifier.send_teams_message`.
+
+Teams is replaced by a fake session with scripted responses; the outbox
+database lives in a temporary directory.
+Run: `python -m pytest test/test_teams_outbox.py -v`
+"""
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import teams_notifier
+from teams_notifier import TeamsNotifier
+from teams_outbox import TeamsOutbox, build_digest_card, build_message_card, classify_response
+
+HOOK_A = "https://example.webhook.office.com/a"
+HOOK_B = "https://example.webhook.office.com/b"
+
+
+class _Response:
+    def __init__(self, status_code=200, text="1", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class _FakeSession:
+    """Answers each webhook from its script (default: success) and records the titles sent."""
+
+    def __init__(self, scripts=None):
+        self.scripts = {url: list(responses) for url, responses in (scripts or {}).items()}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        assert timeout
+        with self.lock:
+            self.sent.append((url, json["title"]))
+            script = self.scripts.get(url)
+            response = script.pop(0) if script else _Response()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def _outbox(tmp_path, session, reporter=None, **kwargs):
+    options = dict(enabled=True, workers=2, rate_per_minute=0, base_delay=0.01, max_attempts=4, session=session,
+                   reporter=reporter or MagicMock(return_value=True))
+    options.update(kwargs)
+    return TeamsOutbox(str(tmp_path / "outbox.sqlite3"), **options)
+
+
+def _card(title):
+    return build_message_card(title, "2026-10-13 09:00:00", "summary", "https://github.com/o/r/commit/1")
+
+
+def test_messages_are_retried_in_order_and_the_status_is_written_back(tmp_path):
+    session = _FakeSession({
+        HOOK_A: [_Response(429, headers={"Retry-After": "0"}), _Response(200, text="Microsoft Teams endpoint returned HTTP error 429"),
+                 requests.ConnectionError("reset")],
+    })
+    reporter = MagicMock(return_value=True)
+    outbox = _outbox(tmp_path, session, reporter)
+    for title in ("a1", "a2"):
+        outbox.enqueue(HOOK_A, _card(title), {"id": title, "pk": "AML|English"})
+    outbox.enqueue(HOOK_B, _card("b1"), {"id": "b1", "pk": "AML|English"})
+
+    assert outbox.flush(timeout=10)
+    outbox.close()
+    assert [title for url, title in session.sent if url == HOOK_A] == ["a1", "a1", "a1", "a1", "a2"]
+    assert outbox.stats() == {"delivered": 3, "retried": 3, "failed": 0, "digests": 0, "coalesced": 0, "pending": 0}
+    reported = {call.args[0]["id"]: call.args[1] for call in reporter.call_args_list}
+    assert reported["a1"] == {"post_status": "success", "error_message": "", "post_attempts": 4}
+    assert reported["b1"]["post_attempts"] == 1
+
+
+def test_client_errors_fail_at_once_and_transient_ones_after_max_attempts(tmp_path):
+    session = _FakeSession({HOOK_A: [_Response(400, text="bad card")], HOOK_B: [_Response(503)] * 5})
+    reporter = MagicMock(return_value=True)
+    outbox = _outbox(tmp_path, session, reporter, max_attempts=3)
+    outbox.enqueue(HOOK_A, _card("a"), {"id": "a"})
+    outbox.enqueue(HOOK_B, _card("b"), {"id": "b"})
+    assert outbox.flush(timeout=10)
+    outbox.close()
+
+    assert len([1 for url, _ in session.sent if url == HOOK_B]) == 3
+    reported = {call.args[0]["id"]: call.args[1] for call in reporter.call_args_list}
+    assert reported["a"]["post_status"] == "failed" and reported["a"]["post_attempts"] == 1
+    assert reported["b"]["post_status"] == "failed" and reported["b"]["error_message"].startswith("HTTP 503")
+    assert classify_response(_Response(200)) is None
+
+
+def test_undelivered_messages_survive_a_restart_and_write_backs_wait_for_the_record(tmp_path):
+    stopped = _outbox(tmp_path, _FakeSession(), enabled=True)
+    stopped._start = lambda: stopped._connection()          # store without starting workers
+    stopped.enqueue(HOOK_A, _card("a"), {"id": "a"})
+
+    reporter = MagicMock(side_effect=[None, True])          # record not in CosmosDB yet, then updated
+    session = _FakeSession()
+    outbox = _outbox(tmp_path, session, reporter)
+    outbox.start()
+    assert outbox.flush(timeout=10)
+    for _ in range(100):                                    # the write-back is retried after a short backoff
+        if reporter.call_count == 2:
+            break
+        time.sleep(0.05)
+    outbox.close()
+    assert session.sent == [(HOOK_A, "a")]
+    assert reporter.call_count == 2
+
+
+def test_notifier_queues_with_a_record_reference_or_posts_synchronously():
+    notifier = TeamsNotifier()
+    notifier.topic, notifier.language = "AML", "English"
+    outbox = MagicMock(enabled=True)
+    outbox.enqueue.return_value = 1
+    commit_history = {}
+    with patch.object(teams_notifier, "teams_outbox", outbox):
+        message, status, error = notifier.send_teams_message("t", "time", "s", HOOK_A, "https://c", commit_history)
+    assert status == "queued" and message == build_message_card("t", "time", "s", "https://c")
+    assert outbox.enqueue.call_args.args[2] == {"id": commit_history["id"], "pk": "AML|English", "topic": "AML", "language": "English"}
+    assert outbox.enqueue.call_args.args[3] == "AML"       # commit cards of a topic may be merged
+
+    outbox.enqueue.return_value = None                      # outbox unavailable: post as before
+    with patch.object(teams_notifier, "teams_outbox", outbox), \
+         patch.object(teams_notifier.requests, "post", return_value=MagicMock()) as post:
+        assert notifier.send_teams_message("t", "time", "s", HOOK_A)[1] == "success"
+    assert post.call_args.kwargs["timeout"] > 0
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _held_outbox(tmp_path, session, reporter, clock):
+    outbox = _outbox(tmp_path, session, reporter, clock=clock, coalesce_window=600, coalesce_threshold=3)
+    outbox._start = lambda: outbox._connection()            # deliver on demand, after the window has passed
+    return outbox
+
+
+def test_a_burst_of_commits_for_a_topic_becomes_one_digest_card(tmp_path):
+    clock, session, reporter = _Clock(), _FakeSession(), MagicMock(return_value=True)
+    outbox = _held_outbox(tmp_path, session, reporter, clock)
+    for index in range(5):
+        clock.now += 60
+        outbox.enqueue(HOOK_A, _card(f"aml{index}"), {"id": f"aml{index}"}, coalesce_key="AML")
+    outbox.enqueue(HOOK_A, _card("aks0"), {"id": "aks0"}, coalesce_key="AKS")
+    outbox.enqueue(HOOK_A, build_message_card("weekly", "t", "summary"), {"id": "weekly"})   # not held
+
+    assert outbox._claim(clock.now)[0] is None               # the head commit card is held for the window
+    clock.now += 600
+    outbox._threads = []
+    TeamsOutbox._start(outbox)
+    assert outbox.flush(timeout=10)
+    outbox.close()
+
+    assert [title for _, title in session.sent] == ["[AML] 5 updates", "aks0", "weekly"]
+    assert outbox.stats()["coalesced"] == 5 and outbox.stats()["digests"] == 1
+    reported = {call.args[0]["id"]: call.args[1] for call in reporter.call_args_list}
+    assert {key for key, fields in reported.items() if fields.get("teams_digest_size") == 5} == {f"aml{i}" for i in range(5)}
+    assert "teams_digest_size" not in reported["aks0"]
+
+
+def test_digest_card_lists_titles_and_commit_links():
+    card = build_digest_card("AML", [_card("a"), build_message_card("b", "t", "s")])
+    assert card["title"] == "[AML] 2 updates"
+    assert card["text"] == "1. [a](https://github.com/o/r/commit/1)\n\n2. b"
@@ -0,0 +1,104 @@
+"""
+Unit tests for `token_utils`: the cached encoder and the token-budgeted
+patch builder used by `CommitFetcher.get_change_from_each_url`.
+
+The approximate counter (4 chars per token) is forced so the tests do not
+depend on downloading the tiktoken BPE file.
+Run: `python -m pytest test/test_token_utils.py -v`
+"""
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import token_utils
+from token_utils import build_patch_prompt, count_tokens, split_hunks
+
+
+@pytest.fixture(autouse=True)
+def approximate_encoding():
+    with patch.dict(token_utils._encoders, {token_utils.DEFAULT_ENCODING: None}, clear=True):
+        yield
+
+
+def _hunk(n, lines):
+    body = "".join(f"+line {n}-{i} of the new content\n" for i in range(lines))
+    return f"@@ -{n},1 +{n},{lines} @@\n{body}"
+
+
+def test_get_encoding_is_cached_and_falls_back():
+    with patch.dict(token_utils._encoders, {}, clear=True), \
+         patch.object(token_utils.tiktoken, "get_encoding", side_effect=OSError("offline")) as loader:
+        assert token_utils.get_encoding("cl100k_base") is None
+        assert token_utils.get_encoding("cl100k_base") is None
+        assert count_tokens("abcdefgh") == 2
+    assert loader.call_count == 1
+
+
+def test_count_tokens_allows_special_token_text():
+    encoding = MagicMock()
+    encoding.encode.return_value = [1, 2, 3]
+    with patch.dict(token_utils._encoders, {token_utils.DEFAULT_ENCODING: encoding}):
+        assert count_tokens("<|endoftext|>") == 3
+    encoding.encode.assert_called_once_with("<|endoftext|>", disallowed_special=())
+
+
+def test_split_hunks():
+    patch_text = _hunk(1, 2) + _hunk(10, 3).rstrip("\n")
+    hunks = split_hunks(patch_text)
+    assert len(hunks) == 2
+    assert hunks[1].startswith("@@ -10,1")
+    assert "".join(hunks) == patch_text
+
+
+def test_small_commit_is_unchanged():
+    files = [("a.md", _hunk(1, 2)), ("b.md", _hunk(1, 1))]
+    expected = "".join("Original Path:" + name + "\r\n" + p + "\n\n" for name, p in files)
+    assert build_patch_prompt(files, 10000) == expected
+
+
+def test_large_file_is_trimmed_by_whole_hunks_and_small_files_survive():
+    big = "".join(_hunk(n * 100, 40) for n in range(10))
+    files = [("big.md", big), ("small-1.md", _hunk(1, 2)), ("small-2.md", _hunk(2, 2))]
+    result = build_patch_prompt(files, 2000)
+
+    assert count_tokens(result) <= 2000
+    # Small files are kept whole and in their original order.
+    assert result.index("Original Path:big.md") < result.index("Original Path:small-1.md")
+    assert _hunk(1, 2) in result and _hunk(2, 2) in result
+    # Only complete hunks of the big file are present, followed by a marker.
+    kept = [h for h in split_hunks(big) if h in result]
+    assert 0 < len(kept) < 10
+    assert "hunk(s)" in result and "omitted to fit the token limit" in result
+    for line in result.splitlines():
+        assert not line.startswith("+line") or line.endswith("of the new content")
+
+
+def test_budget_is_shared_between_large_files():
+    files = [(f"f{i}.md", "".join(_hunk(n, 30) for n in range(8))) for i in range(3)]
+    result = build_patch_prompt(files, 3000)
+
+    assert count_tokens(result) <= 3000
+    for name, _ in files:
+        assert f"Original Path:{name}" in result
+
+
+def test_files_that_do_not_fit_are_listed():
+    files = [(f"docs/file-{i}.md", _hunk(i, 20)) for i in range(200)]
+    result = build_patch_prompt(files, 1000)
+
+    assert count_tokens(result) <= 1000
+    assert "more changed file(s) omitted" in result
+
+
+def test_single_huge_hunk_is_cut_at_a_line_boundary():
+    result = build_patch_prompt([("new-article.md", _hunk(1, 500))], 300)
+
+    assert count_tokens(result) <= 300
+    assert result.startswith("Original Path:new-article.md\r\n@@ -1,1 +1,500 @@\n+line 1-0")
+    assert "line(s) omitted to fit the token limit" in result
+    for line in result.splitlines():
+        assert not line.startswith("+line") or line.endswith("of the new content")
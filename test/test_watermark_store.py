@@ -0,0 +1,76 @@
+"""
+Unit tests for the per-target crawl watermark store (`watermark_store`) and
+its use in `CosmosDBHandler.get_target_start_time` and `Spyder.publish_commit`.
+
+CosmosDB is faked and the store lives in a temporary directory.
+Run: `python -m pytest test/test_watermark_store.py -v`
+"""
+import datetime
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cosmosdb_client
+import spyder as spyder_module
+from cosmosdb_client import CosmosDBHandler
+from spyder import Spyder
+from watermark_store import Watermark, WatermarkStore
+
+KEY = ("AML", "English", "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/machine-learning")
+T1 = datetime.datetime(2026, 1, 1, 10, 0, 0)
+T2 = datetime.datetime(2026, 1, 2, 10, 0, 0)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WatermarkStore(path=str(tmp_path / "watermarks.sqlite3"))
+    with patch.object(cosmosdb_client, "watermark_store", store), patch.object(spyder_module, "watermark_store", store):
+        yield store
+
+
+def test_advance_is_monotonic_and_persistent(tmp_path):
+    path = str(tmp_path / "watermarks.sqlite3")
+    store = WatermarkStore(path=path)
+    assert store.get(KEY) is None
+    assert store.advance(KEY, T2, "sha2")
+    assert not store.advance(KEY, T1, "sha1")
+    assert store.get(KEY) == Watermark(T2, "sha2")
+    assert WatermarkStore(path=path).get(KEY) == Watermark(T2, "sha2")
+    assert WatermarkStore(path=path).get(("AML", "Chinese", KEY[2])) is None
+
+
+def test_disabled_store_is_a_no_op(tmp_path):
+    store = WatermarkStore(path="")
+    assert not store.advance(KEY, T1, "sha1")
+    assert store.get(KEY) is None
+
+
+def test_start_time_is_a_point_read_once_seeded(store):
+    handler = CosmosDBHandler()
+    cosmos = MagicMock()
+    cosmos.get_lastest_commit.return_value = {"commit_time": str(T1)}
+
+    with patch.object(CosmosDBHandler, "read_time", return_value=None):
+        assert handler.get_target_start_time(cosmos, *KEY) == T1   # first run: CosmosDB query, seeds the watermark
+        assert handler.get_target_start_time(cosmos, *KEY) == T1
+    assert cosmos.get_lastest_commit.call_count == 1
+    assert store.get(KEY) == Watermark(T1, None)
+
+
+def test_publish_commit_advances_the_watermark(store):
+    spyder = Spyder.__new__(Spyder)
+    spyder.topic, spyder.language, spyder.root_commits_url = KEY
+    spyder.teams_webhook_url = None
+    spyder.show_topic_in_title = False
+    spyder.cosmosDB_client = MagicMock()
+    spyder.cosmosDB_client.create_commit_history.side_effect = [True, False]
+
+    spyder.publish_commit(T1, "https://github.com/MicrosoftDocs/azure-docs/commit/sha1", "s", "1 t", "post", {})
+    spyder.publish_commit(T2, "https://github.com/MicrosoftDocs/azure-docs/commit/sha2", "s", "1 t", "post", {})
+
+    # The second upload failed, so the next cycle starts after sha1.
+    assert store.get(KEY) == Watermark(T1, "sha1")
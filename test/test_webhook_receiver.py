@@ -0,0 +1,103 @@
+"""
+Unit tests for the GitHub push webhook receiver (`webhook_receiver`) and
+`AdaptiveScheduler.trigger`.
+
+Recorded-style push payloads are posted to a receiver listening on an
+ephemeral local port.
+Run: `python -m pytest test/test_webhook_receiver.py -v`
+"""
+import hashlib
+import hmac
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler import AdaptiveScheduler
+from webhook_receiver import WebhookReceiver, WebhookRouter, verify_signature
+
+SECRET = "s3cret"
+REPOS = "https://api.github.com/repos/MicrosoftDocs"
+TARGETS = [
+    {"topic_name": "AML", "language": "English", "root_commits_url": f"{REPOS}/azure-docs/commits?path=articles/machine-learning"},
+    {"topic_name": "AML", "language": "Chinese", "root_commits_url": f"{REPOS}/azure-docs/commits?path=articles/machine-learning"},
+    {"topic_name": "AKS", "language": "English", "root_commits_url": f"{REPOS}/azure-docs/commits?path=articles/aks"},
+    {"topic_name": "Foundry", "language": "English", "root_commits_url": f"{REPOS}/azure-ai-docs-pr/commits?path=articles/ai-foundry&sha=live"},
+]
+
+
+def _key(target):
+    return target["topic_name"], target["language"]
+
+
+def _push(repo, ref, *commits, default_branch="main"):
+    return {
+        "ref": ref,
+        "repository": {"full_name": repo, "default_branch": default_branch},
+        "commits": [{"added": [], "removed": [], "modified": list(paths)} for paths in commits],
+    }
+
+
+def _sign(body):
+    return "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def test_changed_paths_select_targets_of_the_pushed_repo_and_branch():
+    router = WebhookRouter(TARGETS, key=_key)
+    assert router.route(_push("MicrosoftDocs/azure-docs", "refs/heads/main",
+                              ["articles/machine-learning/how-to.md"], ["README.md"])) == {("AML", "English"), ("AML", "Chinese")}
+    assert router.route(_push("MicrosoftDocs/azure-docs", "refs/heads/feature", ["articles/aks/a.md"])) == set()
+    assert router.route(_push("MicrosoftDocs/azure-ai-docs-pr", "refs/heads/main", ["articles/ai-foundry/a.md"])) == set()
+    assert router.route(_push("microsoftdocs/azure-ai-docs-pr", "refs/heads/live", ["articles/ai-foundry/a.md"])) == {("Foundry", "English")}
+
+    # A truncated delivery may omit the commits that touched a path: trigger the whole stream.
+    big = _push("MicrosoftDocs/azure-docs", "refs/heads/main", *[["includes/x.md"]] * 20)
+    assert router.route(big) == {("AML", "English"), ("AML", "Chinese"), ("AKS", "English")}
+
+
+def test_signed_deliveries_trigger_targets_over_http():
+    triggered = []
+    receiver = WebhookReceiver(WebhookRouter(TARGETS, key=_key), triggered.append, secret=SECRET, host="127.0.0.1", port=0)
+    assert receiver.start()
+    url = f"http://127.0.0.1:{receiver._server.server_address[1]}/"
+
+    def post(body, event="push", signature=None):
+        request = urllib.request.Request(url, data=body, method="POST", headers={
+            "X-GitHub-Event": event, "X-Hub-Signature-256": signature or _sign(body), "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    try:
+        body = json.dumps(_push("MicrosoftDocs/azure-docs", "refs/heads/main", ["articles/aks/intro.md"])).encode()
+        assert post(body) == (202, {"status": "accepted", "targets": 1})
+        assert triggered == [{("AKS", "English")}]
+
+        assert post(body, signature="sha256=" + "0" * 64)[0] == 401
+        assert post(b"{}", event="ping")[0] == 200
+        assert len(triggered) == 1
+    finally:
+        receiver.stop()
+
+    assert not verify_signature("", body, _sign(body))
+    assert not WebhookReceiver(WebhookRouter([], key=_key), triggered.append, secret="").start()
+
+
+def test_trigger_makes_a_waiting_target_due_and_a_running_one_due_after_its_poll():
+    now = [0.0]
+    scheduler = AdaptiveScheduler(["a", "b"], 7200, min_interval=600, max_interval=21600, jitter=0.0,
+                                  poll_budget_per_hour=100, clock=lambda: now[0], rng=lambda: 0.5)
+    assert scheduler.pop_due() == ["a", "b"]
+    scheduler.record("a", 0, window_seconds=7200)
+
+    now[0] = 60
+    assert scheduler.trigger("a") and scheduler.trigger("b") and not scheduler.trigger("unknown")
+    assert scheduler.pop_due() == ["a"]                 # "b" is still running
+    assert scheduler.record("b", 1, window_seconds=7200) == 7200
+    assert scheduler.pop_due() == ["b"]
+    assert scheduler.seconds_until_next() is None      # the superseded entry of "a" is dropped
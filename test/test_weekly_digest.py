@@ -0,0 +1,221 @@
+"""
+Unit tests for the incrementally maintained weekly digest (`weekly_digest`)
+and its use in `Spyder.publish_commit`, `Spyder.generate_weekly_summary`
+and `Spyder.has_weekly_summary`.
+
+CosmosDB is faked (point reads, etag-conditional replaces) and the
+approximate token counter is forced.
+Run: `python -m pytest test/test_weekly_digest.py -v`
+"""
+import copy
+import datetime
+import os
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import spyder as spyder_module
+import token_utils
+from spyder import Spyder
+from weekly_digest import WeeklyDigestStore, digest_id, last_week_start, week_start
+
+KEY = ("AML", "English", "https://api.github.com/repos/MicrosoftDocs/azure-docs/commits?path=articles/machine-learning")
+MONDAY = datetime.date(2026, 10, 12)
+
+
+@pytest.fixture(autouse=True)
+def approximate_encoding():
+    with patch.dict(token_utils._encoders, {token_utils.DEFAULT_ENCODING: None}, clear=True):
+        yield
+
+
+class _FakeCosmos:
+    """Documents by id with an etag that changes on every write."""
+
+    def __init__(self, stored_commits=(), pk_supported=True):
+        self.documents = {}
+        self.stored_commits = list(stored_commits)
+        self.pk_supported = pk_supported
+        self.seed_queries = 0
+        self.conflicts = 0
+        self._version = 0
+
+    def partition_key_of(self, document):
+        return document.get("pk") if self.pk_supported else None
+
+    def read_document(self, doc_id, partition_document):
+        return copy.deepcopy(self.documents.get(doc_id))
+
+    def _store(self, document):
+        self._version += 1
+        self.documents[document["id"]] = dict(copy.deepcopy(document), _etag=str(self._version))
+        return self.documents[document["id"]]
+
+    def create_document(self, document):
+        return None if document["id"] in self.documents else self._store(document)
+
+    def replace_document(self, document):
+        if self.conflicts:
+            self.conflicts -= 1
+            current = self.documents[document["id"]]
+            current["entries"].append({"commit_url": "concurrent", "commit_time": "2026-10-13 00:00:00",
+                                       "title": "1 other", "summary": "s", "tokens": 1})
+            current["_etag"] = "changed"
+            return None
+        if self.documents[document["id"]]["_etag"] != document.get("_etag"):
+            return None
+        return self._store(document)
+
+    def get_important_commits(self, topic, language, root_commits_url, start_time, end_time):
+        self.seed_queries += 1
+        return [c for c in self.stored_commits if str(start_time) <= c["commit_time"] < str(end_time)]
+
+
+def _store(cosmos, **kwargs):
+    return WeeklyDigestStore(cosmos, *KEY, enabled=True, **kwargs)
+
+
+def test_digest_is_seeded_once_then_appended_without_duplicates():
+    earlier = {"commit_url": "u0", "commit_time": "2026-10-12 08:00:00", "gpt_title_response": "1 [新功能] a",
+               "gpt_summary_response": "x" * 40}
+    cosmos = _FakeCosmos(stored_commits=[earlier])
+    store = _store(cosmos)
+
+    assert store.add_commit(datetime.datetime(2026, 10, 14, 9), "u1", "1 [修复] b", "y" * 80)
+    assert store.add_commit(datetime.datetime(2026, 10, 14, 9), "u1", "1 [修复] b", "y" * 80)   # replay
+    assert store.add_commit(datetime.datetime(2026, 10, 19, 9), "u2", "1 [修复] c", "z")         # next week
+
+    digest = store.load(MONDAY)
+    assert digest["id"] == digest_id(*KEY, MONDAY) and digest["pk"] == "AML|English"
+    assert [e["commit_url"] for e in digest["entries"]] == ["u0", "u1"]
+    assert digest["total_tokens"] == sum(e["tokens"] for e in digest["entries"]) > 0
+    assert cosmos.seed_queries == 2     # once per week, on creation
+    assert "gpt_title_response" not in digest and "gpt_weekly_summary_tokens" not in digest
+
+    assert [c["commit_url"] for c in WeeklyDigestStore.commit_list(digest)] == ["u1", "u0"]   # newest first
+
+
+def test_conflicting_update_is_reapplied_on_the_latest_version():
+    cosmos = _FakeCosmos()
+    store = _store(cosmos)
+    store.add_commit(datetime.datetime(2026, 10, 13, 9), "u1", "1 a", "s")
+    cosmos.conflicts = 1
+    assert store.add_commit(datetime.datetime(2026, 10, 13, 10), "u2", "1 b", "s")
+    assert [e["commit_url"] for e in store.load(MONDAY)["entries"]] == ["u1", "concurrent", "u2"]
+
+
+def test_disabled_or_unsupported_digest_is_a_no_op():
+    cosmos = _FakeCosmos(pk_supported=False)
+    store = _store(cosmos)
+    assert not store.add_commit(datetime.datetime(2026, 10, 13, 9), "u1", "1 a", "s")
+    assert store.load(MONDAY) is None and not store.enabled
+    assert WeeklyDigestStore(None, *KEY, enabled=True).load(MONDAY) is None
+    assert cosmos.documents == {}
+
+
+def _spyder(cosmos_client, digest_store):
+    spyder = Spyder.__new__(Spyder)
+    spyder.topic, spyder.language, spyder.root_commits_url = KEY
+    spyder.teams_webhook_url = None
+    spyder.show_topic_in_title = False
+    spyder.system_prompt_dict = {"GPT_WEEKLY_SUMMARY_PROMPT": "system"}
+    spyder.max_input_token = 30000
+    spyder.gpt_batch_mode = False
+    spyder.cosmosDB_client = cosmos_client
+    spyder.weekly_digest = digest_store
+    return spyder
+
+
+def test_weekly_summary_reads_the_digest_and_marks_it():
+    cosmos = _FakeCosmos()
+    store = _store(cosmos)
+    last_week = last_week_start()
+    store.add_commit(datetime.datetime.combine(last_week, datetime.time(9)), "u1", "1 [新功能] a", "s")
+    db = MagicMock()
+    db.check_weekly_summary.return_value = None
+    db.create_commit_history.return_value = True
+    spyder = _spyder(db, store)
+
+    assert not spyder.has_weekly_summary()
+    with patch.object(Spyder, "generate_weekly_summary_using_weekly_commit_list", return_value=("summary", {"total": 3})) as build, \
+         patch("spyder.watermark_store"):
+        spyder.generate_weekly_summary()
+
+    assert [c["commit_url"] for c in build.call_args[0][1]] == ["u1"]
+    db.get_weekly_commit.assert_not_called()
+    assert db.create_commit_history.call_args[0][0]["gpt_weekly_summary_tokens"] == {"total": 3}
+    assert store.load(last_week)["summary_status"] == "post"
+    assert spyder.has_weekly_summary()
+    assert db.check_weekly_summary.call_count == 1    # only before the summary was marked
+
+
+def test_a_summary_stored_without_its_digest_status_is_found_and_backfilled():
+    cosmos = _FakeCosmos()
+    store = _store(cosmos)
+    last_week = last_week_start()
+    store.add_commit(datetime.datetime.combine(last_week, datetime.time(9)), "u1", "1 [新功能] a", "s")
+    db = MagicMock()
+    db.check_weekly_summary.return_value = [{"id": "weekly"}]   # the summary record exists, its status write-back failed
+    spyder = _spyder(db, store)
+
+    assert spyder.has_weekly_summary()
+    assert store.load(last_week)["summary_status"] == "post"
+    assert spyder.has_weekly_summary()
+    assert db.check_weekly_summary.call_count == 1
+
+
+def test_batched_weekly_summary_waits_in_the_background_without_blocking_the_target():
+    cosmos = _FakeCosmos()
+    store = _store(cosmos)
+    last_week = last_week_start()
+    store.add_commit(datetime.datetime.combine(last_week, datetime.time(9)), "u1", "1 [新功能] a", "s")
+    db = MagicMock()
+    db.create_commit_history.return_value = True
+    spyder = _spyder(db, store)
+    spyder.gpt_batch_mode = True
+    release, polling = threading.Event(), []
+
+    def batch_rounds(analyze):
+        polling.append(threading.current_thread())
+        release.wait(5)                                 # the Batch API is still working
+
+    with patch.object(spyder_module, "_weekly_batch_threads", {}), \
+         patch.object(spyder_module, "run_batch_rounds", side_effect=batch_rounds), \
+         patch.object(Spyder, "generate_weekly_summary_using_weekly_commit_list", return_value=("summary", {"total": 3})) as build, \
+         patch("spyder.watermark_store"):
+        spyder.generate_weekly_summary()                # submits and returns at once
+        spyder.generate_weekly_summary()                # still pending: skipped again
+        assert not build.called and not db.create_commit_history.called
+        assert polling and polling[0] is not threading.current_thread()
+
+        release.set()
+        polling[0].join(5)
+        spyder.generate_weekly_summary()                # results are in the cache now
+    assert build.call_count == 1
+    assert store.load(last_week)["summary_status"] == "post"
+
+
+def test_weeks_without_a_digest_use_the_queries_and_publish_feeds_the_digest():
+    cosmos = _FakeCosmos()
+    store = _store(cosmos)
+    db = MagicMock()
+    db.check_weekly_summary.return_value = None
+    db.get_weekly_commit.return_value = None
+    db.create_commit_history.return_value = True
+    spyder = _spyder(db, store)
+
+    assert not spyder.has_weekly_summary()          # no digest yet: legacy query
+    db.check_weekly_summary.assert_called_once()
+    spyder.generate_weekly_summary()                # nothing last week: recorded, later checks are point reads
+    assert store.load(last_week_start())["summary_status"] == "empty"
+    assert spyder.has_weekly_summary()
+    assert db.check_weekly_summary.call_count == 1
+
+    with patch("spyder.watermark_store"):
+        spyder.publish_commit(datetime.datetime(2026, 10, 13, 9), "u1", "s", "1 [新功能] a", "post", {})
+        spyder.publish_commit(datetime.datetime(2026, 10, 13, 10), "u2", "s", "0 minor", "skip", {})
+    assert [e["commit_url"] for e in store.load(week_start(datetime.date(2026, 10, 13)))["entries"]] == ["u1"]
@@ -0,0 +1,143 @@
+"""
+Unit tests for `CallGPT.generate_weekly_summary_using_weekly_commit_list`
+prompt assembly (incremental token accounting).
+
+The GPT call is stubbed and the approximate token counter is forced.
+Run: `python -m pytest test/test_weekly_prompt_assembly.py -v`
+"""
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import call_gpt
+import token_utils
+from call_gpt import CallGPT
+
+
+@pytest.fixture(autouse=True)
+def approximate_encoding():
+    with patch.dict(token_utils._encoders, {token_utils.DEFAULT_ENCODING: None}, clear=True):
+        yield
+
+
+def _week(n):
+    return [{"gpt_title_response": f"1 Title {i}", "gpt_summary_response": "x" * 400} for i in range(n)]
+
+
+def _assemble(weekly_commit_list, max_input_token):
+    captured = {}
+
+    def fake_gpt(messages, max_tokens=None):
+        captured["prompt"] = messages[1]["content"]
+        return "summary", 1, 2, 3
+
+    with patch.object(call_gpt, "get_gpt_response", side_effect=fake_gpt):
+        response, tokens = CallGPT().generate_weekly_summary_using_weekly_commit_list("English", weekly_commit_list, "system", max_input_token)
+    return captured.get("prompt"), response
+
+
+def test_all_important_commits_are_included_in_order():
+    week = _week(3) + [{"gpt_title_response": "0 Skipped", "gpt_summary_response": "ignored"}]
+    prompt, response = _assemble(week, 100000)
+
+    assert response == "summary"
+    assert prompt.index("Title 0") < prompt.index("Title 1") < prompt.index("Title 2")
+    assert "Skipped" not in prompt
+
+
+def test_stops_before_the_entry_that_exceeds_the_limit():
+    prompt, _ = _assemble(_week(10), 450)
+
+    assert "Title 2" in prompt
+    assert "Title 3" not in prompt
+    assert token_utils.count_tokens("system" + prompt) <= 450
+
+
+def test_each_entry_is_counted_once():
+    with patch.object(CallGPT, "num_tokens_from_string", wraps=CallGPT().num_tokens_from_string) as counter:
+        _assemble(_week(50), 100000)
+    # One call for the fixed part plus one per entry.
+    assert counter.call_count == 51
+
+
+def _map_reduce(weekly_commit_list, max_input_token, partial, honour_max_tokens=True):
+    """Runs the map-reduce mode; ``partial(prompt)`` answers each chunk call, the merge call echoes its prompt."""
+    calls = {"map": [], "final": []}
+
+    async def fake_async(messages, max_tokens=1000, use_cache=True):
+        calls["map"].append(messages[1]["content"])
+        response = partial(messages[1]["content"])
+        if response is not None and honour_max_tokens:
+            response = response[:4 * max_tokens]       # the model stops at max_tokens
+        return response, (None if response is None else 10), 1, 11
+
+    def fake_gpt(messages, max_tokens=None):
+        calls["final"].append(messages[1]["content"])
+        return "merged", 10, 1, 11
+
+    with patch.object(call_gpt, "get_gpt_response_async", side_effect=fake_async), \
+         patch.object(call_gpt, "get_gpt_response", side_effect=fake_gpt):
+        result = CallGPT().generate_weekly_summary_using_weekly_commit_list("English", weekly_commit_list, "system", max_input_token, map_reduce=True)
+    return result, calls
+
+
+def test_map_reduce_covers_every_commit_within_the_limit():
+    (response, tokens), calls = _map_reduce(_week(10), 450, lambda prompt: f"<partial {prompt.count('Title')}>")
+
+    assert response == "merged"
+    mapped = "".join(calls["map"])
+    assert all(f"Title {i}\n" in mapped for i in range(10))
+    assert all(token_utils.count_tokens("system" + prompt) <= 450 for prompt in calls["map"] + calls["final"])
+    assert len(calls["map"]) > 1 and len(calls["final"]) == 1
+    assert calls["final"][0].count("<partial") == len(calls["map"])
+    assert sum(int(p.split()[1].rstrip(">")) for p in calls["final"][0].split("<")[1:]) == 10
+    assert tokens == {"prompt": 10 * (len(calls["map"]) + 1), "completion": len(calls["map"]) + 1, "total": 11 * (len(calls["map"]) + 1)}
+
+
+def test_partial_summaries_that_do_not_fit_are_merged_hierarchically():
+    (response, _), calls = _map_reduce(_week(10), 450, lambda prompt: "P" * 500)
+
+    assert response == "merged"
+    first_level = [p for p in calls["map"] if "Title" in p]
+    second_level = [p for p in calls["map"] if "Title" not in p]
+    assert len(first_level) == 4 and len(second_level) == 2
+    assert all(token_utils.count_tokens("system" + prompt) <= 450 for prompt in calls["map"] + calls["final"])
+
+
+def test_map_reduce_is_only_used_when_the_week_does_not_fit():
+    (response, _), calls = _map_reduce(_week(2), 100000, lambda prompt: "unused")
+    assert response == "merged" and calls["map"] == []
+
+    (response, tokens), _ = _map_reduce(_week(10), 450, lambda prompt: None)
+    assert (response, tokens) == (None, None)
+
+
+def test_partial_summaries_are_capped_so_every_merge_shrinks():
+    def partial(prompt):
+        # "<n>" = commits covered; uncapped, a single partial would nearly fill the budget, so no two could be merged.
+        covered = prompt.count("Title") or sum(int(p.split(">")[0]) for p in prompt.split("<")[1:])
+        return f"<{covered}>" + "P" * 1600
+
+    (response, _), calls = _map_reduce(_week(10), 450, partial)
+
+    assert response == "merged"
+    assert len([p for p in calls["map"] if "Title" in p]) == 4
+    assert all(token_utils.count_tokens("system" + prompt) <= 450 for prompt in calls["map"] + calls["final"])
+    assert sum(int(p.split(">")[0]) for p in calls["final"][0].split("<")[1:]) == 10
+
+
+def test_map_reduce_stops_when_partials_outgrow_the_budget():
+    # The deployment's tokenizer may let partials run past the cl100k-based cap: no merge level can shrink.
+    (response, tokens), calls = _map_reduce(_week(10), 450, lambda prompt: "P" * 1600, honour_max_tokens=False)
+
+    assert (response, tokens) == (None, None)
+    assert len(calls["map"]) == 4 and calls["final"] == []
+
+    # Levels are capped even while the chunk count keeps shrinking.
+    with patch.object(call_gpt, "WEEKLY_SUMMARY_MAX_LEVELS", 1):
+        (response, _), calls = _map_reduce(_week(10), 450, lambda prompt: "P" * 500)
+    assert response is None and len(calls["map"]) == 4
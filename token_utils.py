@@ -0,0 +1,178 @@
+"""
+Token counting and token-budgeted patch assembly.
+
+Encoder
+-------
+``tiktoken.get_encoding`` builds a BPE table (and may download it) on every
+call, so encoders are cached per process. When the encoding can not be
+loaded (offline host, missing cache) counting falls back to an
+approximation of 4 characters per token instead of failing the commit.
+
+Patch builder
+-------------
+``build_patch_prompt`` turns the changed files of a commit into the GPT
+input and keeps it within a *token* budget:
+
+* Parts are measured once and the prompt is joined once (no repeated
+  string concatenation).
+* If everything fits, nothing is cut.
+* Otherwise the budget is shared across files smallest-first: each file may
+  use an equal share of what is left, and whatever a small file does not
+  use carries over to the larger ones. Small diffs survive intact and the
+  largest diffs are the ones that get trimmed.
+* A file is trimmed by dropping whole ``@@`` hunks, never by slicing
+  mid-line; a marker tells the model how much was left out. Only a file
+  whose first hunk alone is too large is cut, at a line boundary. Files
+  that get no room for content are listed by name in a final note.
+"""
+import re
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import tiktoken
+
+from logs import logger
+
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Start of a unified-diff hunk (`@@ -1,3 +1,4 @@`).
+_HUNK_START_RE = re.compile(r"(?m)^(?=@@ )")
+# Tokens kept back for the "files omitted" note when the budget is exceeded.
+_OMITTED_NOTE_RESERVE = 128
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoding(encoding_name: str = DEFAULT_ENCODING):
+    """Cached ``tiktoken`` encoding, or None when it can not be loaded."""
+    with _encoders_lock:
+        if encoding_name in _encoders:
+            return _encoders[encoding_name]
+    try:
+        encoding = tiktoken.get_encoding(encoding_name)
+    except Exception as exc:
+        logger.warning(f"Failed to load tiktoken encoding {encoding_name} ({exc}); using approximate token counts")
+        encoding = None
+    with _encoders_lock:
+        _encoders.setdefault(encoding_name, encoding)
+        return _encoders[encoding_name]
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """Number of tokens in ``text`` (approximate if the encoding is unavailable)."""
+    if not text:
+        return 0
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    # Patches may contain strings such as "<|endoftext|>"; count them as text.
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_hunks(patch: str) -> List[str]:
+    """Split a unified diff into its ``@@`` hunks (text before the first hunk is kept as its own part)."""
+    return [part for part in _HUNK_START_RE.split(patch) if part]
+
+
+def _file_header(filename: str) -> str:
+    return "Original Path:" + filename + "\r\n"
+
+
+def _omitted_marker(hunks: int, lines: int) -> str:
+    omitted = f"{hunks} hunk(s) / {lines} line(s)" if hunks else f"{lines} line(s)"
+    return f"... [{omitted} omitted to fit the token limit]\n"
+
+
+def _trim_file(filename: str, hunks: Sequence[Tuple[str, int]], allowance: int, encoding_name: str) -> Tuple[Optional[str], int]:
+    """Fit one file into ``allowance`` tokens by keeping whole hunks in order.
+
+    Only when not a single hunk fits (e.g. a new article is one huge hunk)
+    the first hunk is cut at a line boundary.
+
+    Returns ``(text, tokens)``; text is None when no content fits.
+    """
+    header = _file_header(filename)
+    used = count_tokens(header, encoding_name) + 1  # + trailing blank line
+    kept, omitted_hunks, omitted_lines = [], 0, 0
+    marker_reserve = count_tokens(_omitted_marker(999, 99999), encoding_name)
+    if used + marker_reserve > allowance:
+        return None, 0
+    for hunk, tokens in hunks:
+        if used + tokens + marker_reserve <= allowance:
+            kept.append(hunk)
+            used += tokens
+        else:
+            # Keep scanning: a later, smaller hunk may still fit.
+            omitted_hunks += 1
+            omitted_lines += hunk.count("\n") + 1
+    if not kept and hunks:
+        lines = hunks[0][0].splitlines(keepends=True)
+        partial = []
+        for line in lines:
+            tokens = count_tokens(line, encoding_name)
+            if used + tokens + marker_reserve > allowance:
+                break
+            partial.append(line)
+            used += tokens
+        # The `@@` line alone carries no content.
+        if len(partial) > 1:
+            kept.append("".join(partial))
+            omitted_hunks -= 1
+            omitted_lines -= len(partial)
+    if not kept:
+        return None, 0
+    parts = [header, *kept]
+    if omitted_hunks or omitted_lines:
+        if kept and not kept[-1].endswith("\n"):
+            parts.append("\n")
+        marker = _omitted_marker(omitted_hunks, omitted_lines)
+        parts.append(marker)
+        used += count_tokens(marker, encoding_name)
+    parts.append("\n\n")
+    return "".join(parts), used
+
+
+def build_patch_prompt(files: Sequence[Tuple[str, str]], max_tokens: int, encoding_name: str = DEFAULT_ENCODING) -> str:
+    """Build the GPT input for ``files`` (``(filename, patch)`` pairs) within ``max_tokens``.
+
+    Each file is rendered as ``Original Path:<filename>\\r\\n<patch>\\n\\n``.
+    """
+    rendered = [_file_header(name) + patch + "\n\n" for name, patch in files]
+    sizes = [count_tokens(text, encoding_name) for text in rendered]
+    total = sum(sizes)
+    if total <= max_tokens:
+        return "".join(rendered)
+
+    # Water-filling: smallest files first, each gets an equal share of what is left.
+    reserve = _OMITTED_NOTE_RESERVE if len(files) > 1 else 0
+    budget_left = max(0, max_tokens - reserve)
+    output: List[Optional[str]] = [None] * len(files)
+    order = sorted(range(len(files)), key=lambda i: sizes[i])
+    trimmed, dropped = 0, []
+    for position, index in enumerate(order):
+        share = budget_left // (len(order) - position)
+        if sizes[index] <= share:
+            output[index] = rendered[index]
+            budget_left -= sizes[index]
+            continue
+        name, patch = files[index]
+        hunks = [(hunk, count_tokens(hunk, encoding_name)) for hunk in split_hunks(patch)]
+        text, used = _trim_file(name, hunks, share, encoding_name)
+        if text is None:
+            dropped.append(name)
+            continue
+        output[index] = text
+        budget_left -= used
+        trimmed += 1
+
+    parts = [text for text in output if text is not None]
+    if dropped:
+        shown = ", ".join(dropped[:5]) + (", ..." if len(dropped) > 5 else "")
+        parts.append(f"... [{len(dropped)} more changed file(s) omitted to fit the token limit: {shown}]\n")
+    logger.info(
+        f"Patch exceeds token limit ({total} > {max_tokens}): "
+        f"{len(files) - trimmed - len(dropped)} files kept whole, {trimmed} trimmed by hunk, {len(dropped)} omitted"
+    )
+    return "".join(parts)
@@ -0,0 +1,104 @@
+"""
+Per-target crawl watermarks.
+
+Each target (topic, language, root_commits_url) used to find its start time
+with a cross-partition ``ORDER BY commit_time`` query on every cycle, and
+the only fallback was one global ``last_crawl_time.txt`` shared by all
+topics. This store keeps one row per target with the time and SHA of the
+last commit whose record was stored. ``Spyder`` advances it after every
+uploaded commit, so startup is a single primary-key read and a crash
+mid-batch resumes right after the last stored commit.
+
+A target without a watermark (first run after the upgrade) falls back to
+the old CosmosDB / ``last_crawl_time.txt`` logic once, and the result seeds
+its watermark.
+
+``advance`` never moves a watermark backwards, so records stored out of
+order (or an older backfill) cannot cause reprocessing.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from logs import logger
+
+
+WATERMARK_DB_PATH = os.getenv("WATERMARK_DB_PATH", "crawl_watermarks.sqlite3")
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Watermark(NamedTuple):
+    commit_time: datetime.datetime
+    commit_sha: Optional[str]
+
+
+class WatermarkStore:
+    """(topic, language, root_commits_url) -> Watermark, persisted in SQLite."""
+
+    def __init__(self, path: Optional[str] = WATERMARK_DB_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._path)
+
+    def _connection(self):
+        """Open the database lazily (caller holds ``self._lock``)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                " topic TEXT NOT NULL, language TEXT NOT NULL, root_commits_url TEXT NOT NULL,"
+                " commit_time TEXT NOT NULL, commit_sha TEXT, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (topic, language, root_commits_url))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Watermark]:
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT commit_time, commit_sha FROM watermarks WHERE topic = ? AND language = ? AND root_commits_url = ?",
+                    tuple(key),
+                ).fetchone()
+        except Exception as exc:
+            logger.warning(f"WatermarkStore: read failed ({exc}); using the CosmosDB lookup")
+            return None
+        if row is None:
+            return None
+        return Watermark(datetime.datetime.strptime(row[0], _TIME_FORMAT), row[1])
+
+    def advance(self, key: Tuple[str, str, str], commit_time: datetime.datetime, commit_sha: Optional[str] = None) -> bool:
+        """Move the watermark to ``commit_time`` unless it is already later; returns True if it moved."""
+        if not self.enabled:
+            return False
+        try:
+            with self._lock:
+                conn = self._connection()
+                cursor = conn.execute(
+                    "INSERT INTO watermarks VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (topic, language, root_commits_url) DO UPDATE SET"
+                    " commit_time = excluded.commit_time, commit_sha = excluded.commit_sha, updated_at = excluded.updated_at"
+                    " WHERE excluded.commit_time >= watermarks.commit_time",
+                    (*key, commit_time.strftime(_TIME_FORMAT), commit_sha, time.time()),
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as exc:
+            logger.warning(f"WatermarkStore: update failed ({exc})")
+            return False
+
+
+# Shared by every target in the process.
+watermark_store = WatermarkStore()
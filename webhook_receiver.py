@@ -0,0 +1,224 @@
+"""
+GitHub ``push`` webhook receiver that triggers targeted crawls.
+
+Polling used to be the only way to notice a change, so a commit could wait
+for hours before it was processed. With ``GITHUB_WEBHOOK_ENABLED=true`` a
+small HTTP listener accepts GitHub ``push`` deliveries and makes only the
+affected targets due immediately; the adaptive scheduler keeps polling
+every target as a slow safety net for missed or failed deliveries.
+
+1. Every delivery must carry a valid ``X-Hub-Signature-256`` (HMAC-SHA256
+   of the raw body with ``GITHUB_WEBHOOK_SECRET``); without a secret the
+   receiver refuses to start.
+2. The pushed repository and branch select the targets whose
+   ``root_commits_url`` reads that commit stream (``sha=`` or the default
+   branch), and the added/removed/modified paths of the pushed commits are
+   routed through a ``PathPrefixTrie`` of their ``topic_path`` values, the
+   same prefix semantics the per-target file filter uses.
+3. GitHub lists at most 20 commits per delivery; larger pushes trigger every
+   target of the stream.
+
+Recorded payloads can be replayed locally without a server:
+``python webhook_receiver.py --replay payload.json``.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from commit_fetch import parse_topic_path
+from logs import logger
+from repo_crawl import PathPrefixTrie
+
+
+GITHUB_WEBHOOK_ENABLED = os.getenv("GITHUB_WEBHOOK_ENABLED", "False") in ("True", "true")
+GITHUB_WEBHOOK_HOST = os.getenv("GITHUB_WEBHOOK_HOST", "0.0.0.0")
+GITHUB_WEBHOOK_PORT = int(os.getenv("GITHUB_WEBHOOK_PORT", 8085))
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+
+# GitHub truncates the ``commits`` array of a push delivery at 20 entries.
+PUSH_PAYLOAD_MAX_COMMITS = 20
+MAX_BODY_BYTES = 25 * 1024 * 1024
+
+_DEFAULT_BRANCH = None   # stream key of targets without ``sha=``: the repository's default branch
+
+
+def verify_signature(secret: str, body: bytes, signature_header: Optional[str]) -> bool:
+    """Check ``X-Hub-Signature-256`` (``sha256=<hex>``) against the raw request body."""
+    if not secret or not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):])
+
+
+def target_stream(root_commits_url: str) -> Optional[Tuple[str, Optional[str]]]:
+    """``(owner/repo, branch)`` read by a commits URL; branch is None for the default branch."""
+    parsed = urlparse(root_commits_url)
+    parts = [p for p in parsed.path.split("/") if p]
+    # /repos/{owner}/{repo}/commits
+    if len(parts) < 4 or parts[0] != "repos" or parts[3] != "commits":
+        return None
+    sha = parse_qs(parsed.query).get("sha", [None])[0]
+    return f"{parts[1]}/{parts[2]}".lower(), sha or _DEFAULT_BRANCH
+
+
+def changed_paths(commits: Iterable[dict]) -> Set[str]:
+    """Every path added, removed or modified by the pushed commits."""
+    paths = set()
+    for commit in commits:
+        for field in ("added", "removed", "modified"):
+            paths.update(p for p in commit.get(field) or () if p)
+    return paths
+
+
+class WebhookRouter:
+    """Maps push payloads to the keys of the targets they affect."""
+
+    def __init__(self, targets: Iterable[dict], key: Callable[[dict], Hashable]):
+        self._tries: Dict[Tuple[str, Optional[str]], PathPrefixTrie] = defaultdict(PathPrefixTrie)
+        self._members: Dict[Tuple[str, Optional[str]], Set[Hashable]] = defaultdict(set)
+        for target in targets:
+            stream = target_stream(target["root_commits_url"])
+            if stream is None:
+                logger.warning(f"Webhook: cannot map {target['root_commits_url']} to a repository, it is polled only")
+                continue
+            self._tries[stream].add(parse_topic_path(target["root_commits_url"]), key(target))
+            self._members[stream].add(key(target))
+
+    def route(self, payload: dict) -> Set[Hashable]:
+        """Keys of the targets affected by a ``push`` payload."""
+        repository = payload.get("repository") or {}
+        full_name = (repository.get("full_name") or "").lower()
+        ref = payload.get("ref") or ""
+        if not full_name or not ref.startswith("refs/heads/") or payload.get("deleted"):
+            return set()
+        branch = ref[len("refs/heads/"):]
+        streams = [(full_name, branch)]
+        if branch == repository.get("default_branch"):
+            streams.append((full_name, _DEFAULT_BRANCH))
+
+        commits = payload.get("commits") or []
+        affected = set()
+        for stream in streams:
+            if stream not in self._tries:
+                continue
+            if len(commits) >= PUSH_PAYLOAD_MAX_COMMITS:
+                # The delivery may not list every commit: let every target of the stream check.
+                affected |= self._members[stream]
+                continue
+            trie = self._tries[stream]
+            for path in changed_paths(commits):
+                affected |= trie.match(path)
+        return affected
+
+
+class WebhookReceiver:
+    """Threaded HTTP listener; ``on_targets`` is called with the affected target keys of each push."""
+
+    def __init__(self, router: WebhookRouter, on_targets: Callable[[Set[Hashable]], None],
+                 secret: str = GITHUB_WEBHOOK_SECRET, host: str = GITHUB_WEBHOOK_HOST, port: int = GITHUB_WEBHOOK_PORT):
+        self.router = router
+        self.on_targets = on_targets
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def handle(self, event: str, body: bytes, signature: Optional[str]) -> Tuple[int, dict]:
+        """Process one delivery; returns the HTTP status and a JSON response body."""
+        if not verify_signature(self.secret, body, signature):
+            logger.warning("Webhook: rejected a delivery with a missing or invalid signature")
+            return 401, {"error": "invalid signature"}
+        if event == "ping":
+            return 200, {"status": "pong"}
+        if event != "push":
+            return 202, {"status": "ignored", "event": event}
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, {"error": "invalid JSON"}
+        affected = self.router.route(payload)
+        logger.warning(
+            f"Webhook: push to {(payload.get('repository') or {}).get('full_name')} {payload.get('ref')}, "
+            f"{len(payload.get('commits') or [])} commits, {len(affected)} targets triggered"
+        )
+        if affected:
+            try:
+                self.on_targets(affected)
+            except Exception as e:
+                logger.exception("Webhook: failed to trigger targets:", e)
+                return 500, {"error": "trigger failed"}
+        return 202, {"status": "accepted", "targets": len(affected)}
+
+    def _handler_class(self):
+        receiver = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    self._reply(413 if length > 0 else 400, {"error": "invalid body length"})
+                    return
+                body = self.rfile.read(length)
+                status, response = receiver.handle(self.headers.get("X-GitHub-Event", ""), body,
+                                                   self.headers.get("X-Hub-Signature-256"))
+                self._reply(status, response)
+
+            def _reply(self, status, response):
+                data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug("Webhook: " + format % args)
+
+        return _Handler
+
+    def start(self) -> bool:
+        """Start listening in a daemon thread; False if it cannot (no secret, port in use)."""
+        if not self.secret:
+            logger.error("Webhook: GITHUB_WEBHOOK_SECRET is not set, the receiver is not started")
+            return False
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        except OSError as e:
+            logger.error(f"Webhook: cannot listen on {self.host}:{self.port} ({e})")
+            return False
+        threading.Thread(target=self._server.serve_forever, name="webhook", daemon=True).start()
+        logger.warning(f"Webhook: listening for GitHub push deliveries on {self.host}:{self.port}")
+        return True
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Replay a recorded push payload and print the targets it would trigger."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--replay", required=True, help="recorded push payload (JSON)")
+    parser.add_argument("--config", default="target_config.json", help="target configuration file")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r") as f:
+        targets = json.load(f)
+    with open(args.replay, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    router = WebhookRouter(targets, key=lambda t: (t["topic_name"], t["language"], t["root_commits_url"]))
+    for topic, language, root_commits_url in sorted(router.route(payload)):
+        print(f"{topic}\t{language}\t{root_commits_url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Per-target weekly digest documents, maintained as commits are published.
+
+``generate_weekly_summary`` used to re-query every commit of last week with
+``get_weekly_commit`` and re-encode each entry to count tokens, and
+``check_weekly_summary`` scanned for an existing summary on every cycle.
+With ``WEEKLY_DIGEST_ENABLED=true`` each target keeps one document per
+week (id derived from the target and the week's Monday) in the commit
+history container:
+
+1. ``Spyder.publish_commit`` appends every important commit (status
+   ``post``, title starting with ``1``) with its title, summary and token
+   count, and keeps a running ``total_tokens``. The first commit of a week
+   creates the document and seeds it with that week's important commits
+   already in CosmosDB, so a digest created mid-week is still complete.
+2. The Monday summary reads last week's digest with one point read instead
+   of a query, and ``summary_status`` is set on it once the summary has been
+   stored, so the "summary exists" check is a point read as well.
+
+Updates are read-modify-write with ``_etag`` conditions, retried on
+conflict, and deduplicated by commit URL, so replays and concurrent
+writers cannot lose or double-count entries. The digest deliberately has
+no ``gpt_title_response`` / ``gpt_weekly_summary_tokens`` fields, so the web
+app does not list it.
+
+A missing or unreadable digest falls back to the ``get_weekly_commit`` /
+``check_weekly_summary`` queries.
+"""
+import datetime
+import hashlib
+import os
+from typing import Callable, List, Optional
+
+from logs import logger
+from cosmosdbservice import PARTITION_KEY_FIELD, partition_key_value
+from token_utils import count_tokens
+
+
+WEEKLY_DIGEST_ENABLED = os.getenv("WEEKLY_DIGEST_ENABLED", "False") in ("True", "true")
+WEEKLY_DIGEST_MAX_ATTEMPTS = 5
+
+DIGEST_DOC_TYPE = "weekly_digest"
+
+
+def week_start(moment) -> datetime.date:
+    """Monday of the week containing ``moment`` (a date or datetime)."""
+    day = moment.date() if isinstance(moment, datetime.datetime) else moment
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def last_week_start(now: Optional[datetime.datetime] = None) -> datetime.date:
+    """Monday of last week (UTC), the week the weekly summary covers."""
+    return week_start(now or datetime.datetime.utcnow()) - datetime.timedelta(days=7)
+
+
+def digest_id(topic: str, language: str, root_commits_url: str, week: datetime.date) -> str:
+    target_hash = hashlib.sha1(f"{topic}|{language}|{root_commits_url}".encode("utf-8")).hexdigest()[:16]
+    return f"{DIGEST_DOC_TYPE}-{target_hash}-{week.isoformat()}"
+
+
+def is_important(status: Optional[str], title: Optional[str]) -> bool:
+    """Commits that go into the weekly summary (same rule as the prompt builder in call_gpt)."""
+    return status == "post" and isinstance(title, str) and title[:1] == "1"
+
+
+def entry_tokens(title: str, summary: str) -> int:
+    """Tokens of the entry as the weekly summary prompt renders it."""
+    return count_tokens(f"{title[2:]}\n\n{summary}\n\n", "cl100k_base")
+
+
+class WeeklyDigestStore:
+    """Reads and updates the weekly digest documents of one target."""
+
+    def __init__(self, cosmos_client, topic: str, language: str, root_commits_url: str,
+                 enabled: bool = WEEKLY_DIGEST_ENABLED):
+        self.enabled = enabled and cosmos_client is not None
+        self._client = cosmos_client
+        self.topic = topic
+        self.language = language
+        self.root_commits_url = root_commits_url
+
+    def _key_fields(self, week: datetime.date) -> dict:
+        return {
+            "id": digest_id(self.topic, self.language, self.root_commits_url, week),
+            PARTITION_KEY_FIELD: partition_key_value(self.topic, self.language),
+            "doc_type": DIGEST_DOC_TYPE,
+            "topic": self.topic,
+            "language": self.language,
+            "root_commits_url": self.root_commits_url,
+            "week_start": week.isoformat(),
+        }
+
+    def _supported(self, key: dict) -> bool:
+        """Point reads need the container's partition key value; disable the digest if it cannot be derived."""
+        if self.enabled and self._client.partition_key_of(key) is None:
+            logger.warning("WeeklyDigest: cannot derive the container's partition key for digest documents, digest disabled")
+            self.enabled = False
+        return self.enabled
+
+    def load(self, week: datetime.date) -> Optional[dict]:
+        """Point read of the digest for ``week``; None if missing, disabled or unreadable."""
+        key = self._key_fields(week)
+        if not self._supported(key):
+            return None
+        try:
+            return self._client.read_document(key["id"], key)
+        except Exception as exc:
+            logger.warning(f"WeeklyDigest: failed to read {key['id']} ({exc})")
+            return None
+
+    def add_commit(self, commit_time: datetime.datetime, commit_url: str, title: str, summary: str) -> bool:
+        """Append an important commit to its week's digest; True if the digest contains it afterwards."""
+        if not self.enabled:
+            return False
+        entry = self._entry(str(commit_time), commit_url, title, summary)
+        return self._update(week_start(commit_time), lambda digest: self._append(digest, entry), seed=True)
+
+    def mark_summarized(self, week: datetime.date, status: str) -> bool:
+        """Record that the weekly summary of ``week`` has been stored (``post``) or had nothing to report (``empty``)."""
+        if not self.enabled:
+            return False
+
+        def mark(digest):
+            digest["summary_status"] = status
+            digest["summary_log_time"] = datetime.datetime.utcnow().isoformat()
+            return True
+
+        return self._update(week, mark, seed=False)
+
+    @staticmethod
+    def commit_list(digest: dict) -> List[dict]:
+        """Digest entries in the shape ``generate_weekly_summary_using_weekly_commit_list`` expects, newest first."""
+        entries = sorted(digest.get("entries", []), key=lambda e: e.get("commit_time", ""), reverse=True)
+        return [
+            {
+                "commit_url": e.get("commit_url"),
+                "commit_time": e.get("commit_time"),
+                "gpt_title_response": e.get("title"),
+                "gpt_summary_response": e.get("summary"),
+                "digest_tokens": e.get("tokens"),
+            }
+            for e in entries
+        ]
+
+    # ------------------------------------------------------------------
+    # internals
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _entry(commit_time: str, commit_url: str, title: str, summary: str) -> dict:
+        summary = summary if isinstance(summary, str) else ""
+        return {"commit_url": commit_url, "commit_time": commit_time, "title": title, "summary": summary,
+                "tokens": entry_tokens(title, summary)}
+
+    @staticmethod
+    def _append(digest: dict, entry: dict) -> bool:
+        """Add ``entry`` unless its commit is already in the digest; False means nothing to write."""
+        if any(e.get("commit_url") == entry["commit_url"] for e in digest["entries"]):
+            return False
+        digest["entries"].append(entry)
+        digest["total_tokens"] = digest.get("total_tokens", 0) + entry["tokens"]
+        return True
+
+    def _new_digest(self, week: datetime.date, seed: bool) -> dict:
+        digest = dict(self._key_fields(week), entries=[], total_tokens=0)
+        if seed:
+            # Commits of this week stored before the digest existed (e.g. the week the feature was enabled).
+            start = datetime.datetime.combine(week, datetime.time.min)
+            for commit in self._client.get_important_commits(self.topic, self.language, self.root_commits_url,
+                                                             start, start + datetime.timedelta(days=7)):
+                self._append(digest, self._entry(commit.get("commit_time"), commit.get("commit_url"),
+                                                 commit.get("gpt_title_response"), commit.get("gpt_summary_response")))
+        return digest
+
+    def _update(self, week: datetime.date, mutate: Callable[[dict], bool], seed: bool) -> bool:
+        """Read-modify-write with an etag condition, retried when another writer got there first."""
+        key = self._key_fields(week)
+        if not self._supported(key):
+            return False
+        try:
+            for _ in range(WEEKLY_DIGEST_MAX_ATTEMPTS):
+                digest = self._client.read_document(key["id"], key)
+                if digest is None:
+                    digest = self._new_digest(week, seed)
+                    mutate(digest)
+                    if self._client.create_document(digest) is not None:
+                        return True
+                    continue   # created concurrently: read it and apply the change again
+                if not mutate(digest):
+                    return True
+                if self._client.replace_document(digest) is not None:
+                    return True
+            logger.warning(f"WeeklyDigest: giving up on {key['id']} after {WEEKLY_DIGEST_MAX_ATTEMPTS} conflicting updates")
+        except Exception as exc:
+            logger.warning(f"WeeklyDigest: failed to update {key['id']} ({exc})")
+        return False